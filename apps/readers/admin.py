@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.admin import AdminSite
-from .models import Reader, Preset, TagEvent
+from django import forms
+from .models import Reader, Preset, RetentionPolicy, TagEvent
+from .retention import model_choices
 
 class MyAdminSite(AdminSite):
     site_header = 'Reader Manager Admin'
@@ -22,7 +24,22 @@ class ReaderAdmin(admin.ModelAdmin):
 
 @admin.register(TagEvent)
 class TagEventAdmin(admin.ModelAdmin):
-    list_display = ('reader', 'epc', 'timestamp')
+    list_display = ('reader', 'epc', 'timestamp', 'last_seen_time', 'read_count')
     search_fields = ('epc',)
     list_filter = ('reader', 'timestamp')
     ordering = ('-timestamp',)
+
+class RetentionPolicyForm(forms.ModelForm):
+    model = forms.ChoiceField(choices=model_choices)
+
+    class Meta:
+        model = RetentionPolicy
+        fields = ['model', 'keep_days', 'enabled']
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    form = RetentionPolicyForm
+    list_display = ('model', 'keep_days', 'enabled', 'last_run_at', 'last_deleted')
+    list_editable = ('keep_days', 'enabled')
+    readonly_fields = ('last_run_at', 'last_deleted')
+    ordering = ('model',)
@@ -6,3 +6,6 @@ class ReadersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.readers"
     verbose_name = _("readers")
+
+    def ready(self):
+        from . import signals  # noqa: F401
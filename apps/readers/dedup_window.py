@@ -0,0 +1,175 @@
+# readers/dedup_window.py
+"""
+Edge-style deduplication of tag reads before they are persisted.
+
+A tag in front of an antenna is read many times per second. With a window of
+N seconds the reads of one EPC on one reader antenna are collapsed into a
+single TagEvent: ``timestamp`` is the first read of the window,
+``last_seen_time`` the latest one, ``read_count`` the number of reads and
+``peak_rssi_cdbm`` the strongest RSSI.
+
+* By default a window is fixed: a read more than N seconds after the first
+  read of the window opens a new event. The first read is inserted right
+  away and the reads that follow update that row, so a present tag writes
+  at most one row per window.
+* With ``INGEST_DEDUP_STATE_CHANGES_ONLY`` a window slides with every read
+  and only arrivals are persisted: a new event is written when an EPC was
+  not read for N seconds, later reads are only counted in memory.
+
+The window is global (``INGEST_DEDUP_WINDOW_SECONDS``) and can be overridden
+per reader with ``Reader.dedup_window_seconds``, 0 disables it. State is kept
+per process, so readers that are ingested by several processes are only
+deduplicated within each of them.
+
+The lock is only held while the windows are read or changed, events are
+written outside it. A read extending an event that another thread is still
+inserting is reported by ``saved`` to that thread, which updates the row.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+
+class DedupWindow:
+    """Open windows of the process, keyed by reader, antenna and EPC."""
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys
+        self._windows = {}
+        self._latest = None
+        self._purged_at = None
+        # Events returned by collapse and not saved yet, and those of them extended since, by id()
+        self._unsaved = {}
+        self._extended_unsaved = {}
+        self.lock = threading.RLock()
+
+    def window_for(self, reader):
+        seconds = reader.dedup_window_seconds
+        if seconds is None:
+            seconds = settings.INGEST_DEDUP_WINDOW_SECONDS
+        return timedelta(seconds=seconds) if seconds > 0 else None
+
+    def applies_to(self, tag_events):
+        """Whether a reader of ``tag_events`` has a dedup window, the chunk is written as is otherwise."""
+        readers = {tag_event.reader_id: tag_event.reader for tag_event in tag_events}
+        return any(self.window_for(reader) is not None for reader in readers.values())
+
+    def collapse(self, tag_events):
+        """
+        Fold a chunk of unsaved TagEvents into the open windows.
+
+        Returns ``(created, updated)``: the events to insert and the saved
+        events whose window was extended and must be updated. The created
+        events must then be passed to ``saved``, or ``forget`` if they could
+        not be inserted.
+        """
+        with self.lock:
+            return self._collapse(tag_events)
+
+    def saved(self, tag_events):
+        """Mark inserted events as saved. Returns those extended by other writers meanwhile, to update."""
+        with self.lock:
+            extended = []
+            for tag_event in tag_events:
+                self._unsaved.pop(id(tag_event), None)
+                if self._extended_unsaved.pop(id(tag_event), None) is not None:
+                    extended.append(tag_event)
+            return extended
+
+    def _collapse(self, tag_events):
+        state_changes_only = settings.INGEST_DEDUP_STATE_CHANGES_ONLY
+        windows = {}
+        created = []
+        updated = {}
+        for tag_event in tag_events:
+            reader = tag_event.reader
+            window = windows.get(reader.pk, windows)
+            if window is windows:
+                window = windows[reader.pk] = self.window_for(reader)
+            timestamp = tag_event.timestamp
+            if window is None or not isinstance(timestamp, datetime):
+                created.append(tag_event)
+                continue
+
+            if self._latest is None or timestamp > self._latest:
+                self._latest = timestamp
+            key = (reader.pk, tag_event.antenna_port, tag_event.epc)
+            current = self._windows.get(key)
+            if current is not None:
+                # Fixed windows are measured from the first read, sliding ones from the latest
+                start = current.last_seen_time if state_changes_only else current.timestamp
+                if timestamp - start <= window:
+                    self._extend(current, tag_event)
+                    if state_changes_only:
+                        continue
+                    if current.pk is not None:
+                        updated[current.pk] = current
+                    elif id(current) in self._unsaved:
+                        # Being inserted by another writer, which updates it once saved
+                        self._extended_unsaved[id(current)] = current
+                    continue
+
+            tag_event.last_seen_time = tag_event.last_seen_time or timestamp
+            self._windows[key] = tag_event
+            created.append(tag_event)
+
+        for tag_event in created:
+            if tag_event.pk is None:
+                self._unsaved[id(tag_event)] = tag_event
+        self._purge()
+        return created, list(updated.values())
+
+    def forget(self, tag_events):
+        """Close the windows of events that could not be saved."""
+        with self.lock:
+            for tag_event in tag_events:
+                self._unsaved.pop(id(tag_event), None)
+                self._extended_unsaved.pop(id(tag_event), None)
+                key = (tag_event.reader_id, tag_event.antenna_port, tag_event.epc)
+                if self._windows.get(key) is tag_event:
+                    del self._windows[key]
+
+    def clear(self):
+        with self.lock:
+            self._windows.clear()
+            self._unsaved.clear()
+            self._extended_unsaved.clear()
+            self._latest = self._purged_at = None
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _extend(self, current, tag_event):
+        current.read_count += tag_event.read_count
+        last_seen = tag_event.last_seen_time or tag_event.timestamp
+        if last_seen > current.last_seen_time:
+            current.last_seen_time = last_seen
+        if tag_event.peak_rssi_cdbm is not None and (current.peak_rssi_cdbm is None or tag_event.peak_rssi_cdbm > current.peak_rssi_cdbm):
+            current.peak_rssi_cdbm = tag_event.peak_rssi_cdbm
+
+    def _purge(self):
+        if self._latest is None:
+            return
+        # Drop closed windows about once per window of read time
+        horizon = timedelta(seconds=max(settings.INGEST_DEDUP_WINDOW_SECONDS, 1))
+        if self._purged_at is None:
+            self._purged_at = self._latest
+        elif self._latest - self._purged_at > horizon:
+            windows = {}
+            for key, tag_event in list(self._windows.items()):
+                window = windows.get(key[0], windows)
+                if window is windows:
+                    window = windows[key[0]] = self.window_for(tag_event.reader)
+                if window is None or self._latest - tag_event.last_seen_time > window:
+                    del self._windows[key]
+            self._purged_at = self._latest
+
+        max_keys = self.max_keys or settings.INGEST_DEDUP_MAX_KEYS
+        while len(self._windows) > max_keys:
+            # Oldest windows first, dicts keep insertion order
+            del self._windows[next(iter(self._windows))]
+
+
+# Shared by the ingest paths of the process
+read_window = DedupWindow()
@@ -0,0 +1,68 @@
+# readers/epc_sketch.py
+"""
+HyperLogLog sketch of the distinct EPCs of a tag read rollup.
+
+The sketch has 2^12 registers, estimates are within about 1.6%, and exact in
+practice for the few hundred tags of most buckets thanks to the linear
+counting correction. It is stored as bytes: sparse, 3 bytes per register set,
+until that is larger than the dense form of one byte per register. A minute
+bucket with a few tags costs some bytes instead of a row per EPC.
+"""
+import hashlib
+import math
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+_RANK_BITS = 64 - PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+_SPARSE = b's'
+_DENSE = b'd'
+
+
+class EpcSketch:
+    def __init__(self, data=b''):
+        data = bytes(data or b'')
+        self.registers = {}
+        self.dense = None
+        if data[:1] == _DENSE:
+            self.dense = bytearray(data[1:])
+        elif data[:1] == _SPARSE:
+            for offset in range(1, len(data), 3):
+                self.registers[int.from_bytes(data[offset:offset + 2], 'big')] = data[offset + 2]
+
+    def add(self, epc):
+        value = int.from_bytes(hashlib.blake2b(epc.encode(), digest_size=8).digest(), 'big')
+        index = value >> _RANK_BITS
+        rank = _RANK_BITS - (value & ((1 << _RANK_BITS) - 1)).bit_length() + 1
+        if self.dense is not None:
+            if rank > self.dense[index]:
+                self.dense[index] = rank
+            return
+        if rank > self.registers.get(index, 0):
+            self.registers[index] = rank
+            if 3 * len(self.registers) >= REGISTERS:
+                self.dense = bytearray(REGISTERS)
+                for index, rank in self.registers.items():
+                    self.dense[index] = rank
+                self.registers = {}
+
+    def update(self, epcs):
+        for epc in epcs:
+            self.add(epc)
+
+    def estimate(self):
+        ranks = self.dense if self.dense is not None else self.registers.values()
+        zeros = REGISTERS - sum(1 for rank in ranks if rank)
+        raw = _ALPHA * REGISTERS * REGISTERS / (zeros + sum(2.0 ** -rank for rank in ranks if rank))
+        if raw <= 2.5 * REGISTERS and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return round(REGISTERS * math.log(REGISTERS / zeros))
+        return round(raw)
+
+    def to_bytes(self):
+        if self.dense is not None:
+            return _DENSE + bytes(self.dense)
+        if not self.registers:
+            return b''
+        return _SPARSE + b''.join(index.to_bytes(2, 'big') + bytes([rank]) for index, rank in sorted(self.registers.items()))
@@ -1,10 +1,10 @@
 from django import forms
-from .models import Reader, Preset, PresetTemplate, WebhookTemplate, MqttTemplate
+from .models import Location, Reader, ReadPoint, Preset, PresetRollout, PresetTemplate, WebhookTemplate, MqttTemplate
 
 class ReaderForm(forms.ModelForm):
     class Meta:
         model = Reader
-        fields = ['serial_number', 'name', 'ip_address', 'port', 'username', 'password']
+        fields = ['serial_number', 'name', 'ip_address', 'port', 'username', 'password', 'dedup_window_seconds']
 
 class PresetForm(forms.ModelForm):
     class Meta:
@@ -35,6 +35,22 @@ class PresetTemplateForm(forms.ModelForm):
             'readers': forms.CheckboxSelectMultiple(),
         }
 
+class PresetRolloutForm(forms.Form):
+    action = forms.ChoiceField(choices=PresetRollout.ACTION_CHOICES)
+    preset_template = forms.ModelChoiceField(queryset=PresetTemplate.objects.all(), required=False, help_text='Pushed to every reader, then started')
+    preset_id = forms.CharField(max_length=255, required=False, help_text='Preset already stored on the readers, when no template is selected')
+    readers = forms.ModelMultipleChoiceField(queryset=Reader.objects.all(), required=False, widget=forms.CheckboxSelectMultiple())
+    read_points = forms.ModelMultipleChoiceField(queryset=ReadPoint.objects.all(), required=False, widget=forms.CheckboxSelectMultiple())
+    locations = forms.ModelMultipleChoiceField(queryset=Location.objects.all(), required=False, widget=forms.CheckboxSelectMultiple())
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('action') == PresetRollout.START and not (cleaned_data.get('preset_template') or cleaned_data.get('preset_id')):
+            raise forms.ValidationError('Select a preset template or enter a preset id to start.')
+        if not (cleaned_data.get('readers') or cleaned_data.get('read_points') or cleaned_data.get('locations')):
+            raise forms.ValidationError('Select at least one reader, read point or location.')
+        return cleaned_data
+
 class WebhookTemplateForm(forms.ModelForm):
     class Meta:
         model = WebhookTemplate
@@ -0,0 +1,141 @@
+# readers/identity_cache.py
+"""
+In-process cache of reader identities for the ingest hot path.
+
+Webhook and MQTT handlers resolve the same handful of readers for every tag
+read. Lookups are kept here with a TTL and bounded LRU eviction, and the whole
+cache is dropped by post_save/post_delete signals on Reader, SmartReader and
+MQTTConfiguration (see readers/signals.py and smartreader/signals.py).
+
+Signals only fire in the process that saved the model, so the TTL bounds how
+long a Celery worker or the MQTT subscriber can serve a stale entry.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+DEFAULT_READER_SERIAL = 'default-serial-number'
+
+SmartReaderIdentity = namedtuple('SmartReaderIdentity', ['smartreader', 'reader', 'config', 'topic_suffixes'])
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < now:
+                if entry is not _MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # Misses are cached too, so unknown readers don't hit the database on every read
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+reader_cache = TTLCache(
+    max_entries=getattr(settings, 'READER_CACHE_MAX_ENTRIES', 1024),
+    ttl=getattr(settings, 'READER_CACHE_TTL', 300),
+)
+
+
+def get_reader_by_name(name):
+    if not name:
+        return None
+    from .models import Reader
+    return reader_cache.get_or_load(('reader:name', name), lambda: Reader.objects.filter(name=name).first())
+
+
+def get_reader_by_serial(serial_number):
+    if not serial_number:
+        return None
+    from .models import Reader
+    return reader_cache.get_or_load(('reader:serial', serial_number), lambda: Reader.objects.filter(serial_number=serial_number).first())
+
+
+def get_default_reader(name='Default Reader'):
+    """Return the fallback reader used for events from unknown readers, creating it once."""
+    reader = get_reader_by_serial(DEFAULT_READER_SERIAL)
+    if reader is None:
+        from .models import Reader
+        reader, created = Reader.objects.get_or_create(serial_number=DEFAULT_READER_SERIAL, defaults={'name': name})
+        reader_cache.set(('reader:serial', DEFAULT_READER_SERIAL), reader)
+    return reader
+
+
+def get_smartreader_identity(reader_serial):
+    """Resolve a SmartReader serial to its SmartReader, Reader, MQTTConfiguration and topic suffixes."""
+    if not reader_serial:
+        return None
+    return reader_cache.get_or_load(('smartreader:serial', reader_serial), lambda: _load_smartreader_identity(reader_serial))
+
+
+def topic_suffixes_for(config):
+    """Last segment of each topic a SmartReader publishes on for the given configuration."""
+    if config is None:
+        return {}
+    topics = {
+        'tag_events': config.mqtt_tag_events_topic,
+        'management_command_response': config.mqtt_management_command_response_topic,
+        'control_command_response': config.mqtt_control_command_response_topic,
+        'management_events': config.mqtt_management_events_topic,
+    }
+    return {name: topic.split('/')[-1] for name, topic in topics.items() if topic}
+
+
+def invalidate(*args, **kwargs):
+    """Signal receiver that drops every cached identity."""
+    reader_cache.clear()
+
+
+def _load_smartreader_identity(reader_serial):
+    from apps.smartreader.models import MQTTConfiguration, SmartReader
+
+    smartreader = SmartReader.objects.filter(reader_serial=reader_serial).first()
+    if smartreader is None:
+        return None
+
+    # SmartReader topics are derived from the configuration of the broker it publishes to, None when there is none
+    config = MQTTConfiguration.objects.filter(
+        broker_hostname=smartreader.mqtt_broker_address,
+        broker_port=smartreader.mqtt_broker_port,
+    ).first()
+    reader = get_reader_by_serial(reader_serial)
+    return SmartReaderIdentity(smartreader, reader, config, topic_suffixes_for(config))
@@ -0,0 +1,107 @@
+# readers/management/commands/benchmark_tag_decoding.py
+
+import base64
+import os
+import timeit
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from apps.readers.ingest_pipeline import normalize
+from apps.readers.models import Reader, TagEvent
+
+def synthetic_webhook_payload(count):
+    # 96-bit EPCs and TIDs, as sent by Impinj readers in a webhook batch
+    return [
+        {
+            'timestamp': f'2024-08-09T17:44:{index % 60:02d}.{index % 1000:03d}Z',
+            'hostname': 'impinj-14-a2-b3',
+            'eventType': 'tagInventory',
+            'tagInventoryEvent': {
+                'epc': base64.b64encode(os.urandom(12)).decode(),
+                'tid': base64.b64encode(os.urandom(12)).decode(),
+                'antennaPort': index % 4 + 1,
+                'peakRssiCdbm': -5400,
+                'frequency': 915250,
+                'transmitPowerCdbm': 3000,
+                'lastSeenTime': f'2024-08-09T17:44:{index % 60:02d}.{index % 1000:03d}Z',
+            },
+        }
+        for index in range(count)
+    ]
+
+def decode_per_read(events, reader):
+    """The per-read decoding process_webhook used before the ingest pipeline."""
+    decoded = []
+    for event in events:
+        tag_inventory = event.get('tagInventoryEvent')
+        epc_base64 = tag_inventory.get('epc')
+        if epc_base64:
+            epc_hex = base64.b64decode(epc_base64).hex().upper()
+        else:
+            epc_hex = tag_inventory.get('epcHex')
+
+        antenna_port = tag_inventory.get('antennaPort')
+        peak_rssi_cdbm = tag_inventory.get('peakRssiCdbm')
+        frequency = tag_inventory.get('frequency')
+        transmit_power_cdbm = tag_inventory.get('transmitPowerCdbm')
+        last_seen_time_str = tag_inventory.get('lastSeenTime')
+        tid_base64 = tag_inventory.get('tid')
+        tid_hex = tag_inventory.get('tidHex')
+
+        last_seen_time = None
+        if last_seen_time_str:
+            try:
+                last_seen_time = datetime.fromisoformat(last_seen_time_str.replace('Z', '+00:00'))
+            except ValueError:
+                last_seen_time = None
+
+        if tid_base64 and not tid_hex:
+            tid_hex = base64.b64decode(tid_base64).hex().upper()
+
+        decoded.append(TagEvent(reader=reader, **{
+            'epc': epc_hex,
+            'tid': tid_base64,
+            'tid_hex': tid_hex,
+            'last_seen_time': last_seen_time,
+            'antenna_port': antenna_port if antenna_port is not None and antenna_port > 0 else None,
+            'antenna_name': tag_inventory.get('antennaName'),
+            'peak_rssi_cdbm': peak_rssi_cdbm if peak_rssi_cdbm is not None and peak_rssi_cdbm < 0 else None,
+            'frequency': frequency if frequency is not None and frequency > 0 else None,
+            'transmit_power_cdbm': transmit_power_cdbm if transmit_power_cdbm is not None and transmit_power_cdbm > 0 else None,
+            # Previously left to Django to parse on save
+            'timestamp': datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00')),
+        }))
+    return decoded
+
+def decode_with_pipeline(events, reader, chunk_size=None):
+    """The ingest pipeline up to the sink, with a fixed reader instead of database lookups."""
+    return list(normalize(((None, event) for event in events), lambda read_format, source, event: reader, chunk_size))
+
+def field_values(tag_events):
+    fields = [field.attname for field in TagEvent._meta.concrete_fields]
+    return [[getattr(tag_event, name) for name in fields] for tag_event in tag_events]
+
+class Command(BaseCommand):
+    help = 'Compare building TagEvents through the ingest pipeline with per-read decoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reads', type=int, default=10000, help='Tag reads per payload')
+        parser.add_argument('--chunk-size', type=int, help='Pipeline decode chunk size, defaults to WEBHOOK_BATCH_SIZE')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs, the best one is reported')
+
+    def handle(self, *args, **kwargs):
+        events = synthetic_webhook_payload(kwargs['reads'])
+        chunk_size = kwargs['chunk_size']
+        reader = Reader(id=1, name='impinj-14-a2-b3', serial_number='benchmark')
+
+        # Both paths must build the same TagEvents before their speed means anything
+        if field_values(decode_with_pipeline(events, reader, chunk_size)) != field_values(decode_per_read(events, reader)):
+            self.stderr.write(self.style.ERROR('Pipeline decoding does not match per-read decoding'))
+            return
+
+        per_read = min(timeit.repeat(lambda: decode_per_read(events, reader), number=1, repeat=kwargs['repeat']))
+        pipeline = min(timeit.repeat(lambda: decode_with_pipeline(events, reader, chunk_size), number=1, repeat=kwargs['repeat']))
+
+        reads = len(events)
+        self.stdout.write(f'Per-read decoding: {per_read * 1000:.2f} ms ({reads / per_read:,.0f} reads/s)')
+        self.stdout.write(f'Pipeline decoding: {pipeline * 1000:.2f} ms ({reads / pipeline:,.0f} reads/s)')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {per_read / pipeline:.2f}x'))
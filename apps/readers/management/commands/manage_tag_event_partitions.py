@@ -0,0 +1,32 @@
+# readers/management/commands/manage_tag_event_partitions.py
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.readers import partitions
+
+class Command(BaseCommand):
+    help = 'Create upcoming TagEvent partitions and detach or drop expired ones (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--premake', type=int, help='Number of periods to create partitions for ahead of the current one')
+        parser.add_argument('--retention-days', type=int, help='Remove partitions entirely older than this many days, 0 keeps them')
+        parser.add_argument('--detach-only', action='store_true', default=None, help='Detach expired partitions without dropping them')
+        parser.add_argument('--list', action='store_true', help='List the partitions and their ranges')
+
+    def handle(self, *args, **kwargs):
+        if not partitions.is_partitioned():
+            raise CommandError('The TagEvent table is not partitioned, run the migrations on PostgreSQL first.')
+
+        created, removed = partitions.maintain_partitions(
+            periods=kwargs['premake'],
+            retention_days=kwargs['retention_days'],
+            detach_only=kwargs['detach_only'],
+        )
+        for name in created:
+            self.stdout.write(f'Created {name}')
+        for name in removed:
+            self.stdout.write(f'Removed {name}')
+
+        if kwargs['list']:
+            for name, lower, upper in partitions.list_partitions():
+                self.stdout.write(f'{name}: {lower or "MINVALUE"} -> {upper or "MAXVALUE"}')
+        self.stdout.write(self.style.SUCCESS(f'{len(created)} partitions created, {len(removed)} removed'))
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reader',
+            name='dedup_window_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tagevent',
+            name='read_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
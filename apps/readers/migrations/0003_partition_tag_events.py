@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def partition_tag_events(apps, schema_editor):
+    # Range partitioning is PostgreSQL only, other databases keep a plain table
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from apps.readers.partitions import is_partitioned, partition_table
+    if not is_partitioned(schema_editor.connection):
+        partition_table(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0002_tag_event_dedup_window'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tag_events, elidable=False),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0004_retention_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagReadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('antenna_port', models.PositiveIntegerField(default=0)),
+                ('read_count', models.PositiveBigIntegerField(default=0)),
+                ('unique_epcs', models.PositiveIntegerField(default=0)),
+                ('rssi_min', models.IntegerField(blank=True, null=True)),
+                ('rssi_max', models.IntegerField(blank=True, null=True)),
+                ('rssi_sum', models.BigIntegerField(default=0)),
+                ('rssi_count', models.PositiveBigIntegerField(default=0)),
+                ('reader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_read_rollups', to='readers.reader')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagReadRollupEpc',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epc', models.CharField(max_length=256)),
+                ('rollup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='epcs', to='readers.tagreadrollup')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='tagreadrollupepc',
+            constraint=models.UniqueConstraint(fields=('rollup', 'epc'), name='unique_tag_read_rollup_epc'),
+        ),
+        migrations.AddIndex(
+            model_name='tagreadrollup',
+            index=models.Index(fields=['granularity', 'bucket'], name='tag_read_rollup_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagreadrollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'bucket', 'reader', 'antenna_port'), name='unique_tag_read_rollup'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0005_tag_read_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tagevent',
+            index=models.Index(fields=['timestamp'], name='tag_event_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagevent',
+            index=models.Index(fields=['reader', 'timestamp'], name='tag_event_reader_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagevent',
+            index=models.Index(fields=['epc', 'timestamp'], name='tag_event_epc_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagtraceability',
+            index=models.Index(fields=['epc', 'read_point'], name='traceability_epc_rp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagtraceability',
+            index=models.Index(condition=models.Q(('departed_at__isnull', True)), fields=['read_point', 'last_seen'], name='traceability_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagtraceability',
+            index=models.Index(fields=['arrived_at'], name='traceability_arrived_idx'),
+        ),
+    ]
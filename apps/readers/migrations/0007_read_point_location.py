@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0006_tag_event_and_traceability_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='readpoint',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='read_points', to='readers.location'),
+        ),
+        migrations.AlterField(
+            model_name='tagtraceability',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='readers.location'),
+        ),
+    ]
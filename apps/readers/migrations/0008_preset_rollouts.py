@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0007_read_point_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PresetRollout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('start', 'Start preset'), ('stop', 'Stop preset')], default='start', max_length=5)),
+                ('preset_id', models.CharField(blank=True, max_length=255)),
+                ('configuration', models.JSONField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished')], default='pending', max_length=8)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('succeeded', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('preset_template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rollouts', to='readers.presettemplate')),
+                ('readers', models.ManyToManyField(related_name='preset_rollouts', to='readers.reader')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PresetRolloutResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('success', models.BooleanField(default=False)),
+                ('step', models.CharField(max_length=10)),
+                ('response_message', models.TextField(blank=True, null=True)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='preset_rollout_results', to='readers.reader')),
+                ('rollout', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='readers.presetrollout')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0008_preset_rollouts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='preset',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='preset',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='preset',
+            name='preset_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='preset',
+            constraint=models.UniqueConstraint(fields=('reader', 'preset_id'), name='unique_reader_preset'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0009_preset_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReaderStatusSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reachable', models.BooleanField(default=False)),
+                ('active_preset_id', models.CharField(blank=True, max_length=255)),
+                ('status', models.JSONField(blank=True, null=True)),
+                ('latency_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('checked_at', models.DateTimeField()),
+                ('last_reachable_at', models.DateTimeField(blank=True, null=True)),
+                ('reader', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='status_snapshot', to='readers.reader')),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+def fill_epc_sketches(apps, schema_editor):
+    # Seed the sketches with the EPCs counted so far, so later reads are not counted again
+    from apps.readers.epc_sketch import EpcSketch
+    TagReadRollup = apps.get_model('readers', 'TagReadRollup')
+    TagReadRollupEpc = apps.get_model('readers', 'TagReadRollupEpc')
+    sketches = {}
+    for rollup_id, epc in TagReadRollupEpc.objects.values_list('rollup_id', 'epc').iterator():
+        sketches.setdefault(rollup_id, EpcSketch()).add(epc)
+    for rollup_id, sketch in sketches.items():
+        TagReadRollup.objects.filter(pk=rollup_id).update(epc_sketch=sketch.to_bytes())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0011_template_deployments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tagreadrollup',
+            name='epc_sketch',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(fill_epc_sketches, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='TagReadRollupEpc',
+        ),
+    ]
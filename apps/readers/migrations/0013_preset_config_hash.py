@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readers', '0012_tag_read_rollup_epc_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='preset',
+            name='config_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
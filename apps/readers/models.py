@@ -1,5 +1,4 @@
-from django.db import models
-import requests
+from django.db import models, transaction
 from django.utils import timezone
 
 class Reader(models.Model):
@@ -10,21 +9,35 @@ class Reader(models.Model):
     username = models.CharField(max_length=100)
     password = models.CharField(max_length=100)
     active_preset = models.OneToOneField('Preset', on_delete=models.SET_NULL, null=True, blank=True, related_name='active_reader')
+    dedup_window_seconds = models.PositiveIntegerField(null=True, blank=True)  # Overrides INGEST_DEDUP_WINDOW_SECONDS, 0 disables
 
     def __str__(self):
         return self.name
     
-    def get_active_preset_from_status(self):
-        url = f"https://{self.ip_address}:{self.port}/api/v1/status"
-        auth = (self.username, self.password)
-        try:
-            response = requests.get(url, auth=auth, headers={'Content-Type': 'application/json'}, verify=False)
-            response.raise_for_status()
-            status_data = response.json()
-            active_preset_id = status_data.get("activePreset", {}).get("id", "No Active Preset")
-            return active_preset_id
-        except requests.exceptions.RequestException as e:
-            return f"Error: {str(e)}"
+    def get_active_preset_from_status(self, refresh=False):
+        # Served from the status snapshot of the poller, the reader is only asked when there is none or on refresh
+        from .status_poller import poll
+
+        snapshot = None if refresh else ReaderStatusSnapshot.objects.filter(reader=self).first()
+        if snapshot is None:
+            snapshot = poll([self], jitter=0)[0]
+        if not snapshot.reachable:
+            return f"Error: {snapshot.error}"
+        return snapshot.active_preset_id or "No Active Preset"
+
+# Latest status of a reader, refreshed in the background by status_poller.py so views never wait on the reader
+class ReaderStatusSnapshot(models.Model):
+    reader = models.OneToOneField(Reader, on_delete=models.CASCADE, related_name='status_snapshot')
+    reachable = models.BooleanField(default=False)
+    active_preset_id = models.CharField(max_length=255, blank=True)  # Last known while the reader is unreachable
+    status = models.JSONField(null=True, blank=True)  # Body of /api/v1/status
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    checked_at = models.DateTimeField()
+    last_reachable_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.reader.name}: {"reachable" if self.reachable else "unreachable"} at {self.checked_at}'
 
 class Location(models.Model):
     name = models.CharField(max_length=100)
@@ -36,6 +49,7 @@ class ReadPoint(models.Model):
     name = models.CharField(max_length=100)
     readers = models.ManyToManyField(Reader, related_name='read_points', blank=True)
     timeout_seconds = models.IntegerField(default=300)  # Timeout in seconds
+    location = models.ForeignKey(Location, on_delete=models.SET_NULL, null=True, blank=True, related_name='read_points')  # Location of the traceability rows
 
     def __str__(self):
         return self.name
@@ -43,11 +57,21 @@ class ReadPoint(models.Model):
 class TagTraceability(models.Model):
     epc = models.CharField(max_length=256)
     read_point = models.ForeignKey(ReadPoint, on_delete=models.CASCADE)
-    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, null=True, blank=True)
     arrived_at = models.DateTimeField(null=True, blank=True)
     last_seen = models.DateTimeField(null=True, blank=True)
     departed_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # get_or_create(epc=..., read_point=...) for every tag read
+            models.Index(fields=['epc', 'read_point'], name='traceability_epc_rp_idx'),
+            # Departure sweep, only over the rows still present
+            models.Index(fields=['read_point', 'last_seen'], name='traceability_open_idx', condition=models.Q(departed_at__isnull=True)),
+            # Default sort of the traceability list
+            models.Index(fields=['arrived_at'], name='traceability_arrived_idx'),
+        ]
+
     def __str__(self):
         return f'{self.epc} - {self.read_point.name}'
 
@@ -63,21 +87,55 @@ class WebhookTemplate(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        # Enqueue a task to send the template to each associated reader
-        from .tasks import process_webhook_settings
-        for reader in self.readers.all():
-            process_webhook_settings.apply_async((self.id, reader.id))
+        # One deployment job sends the template to all associated readers, queued once the readers are saved too
+        from .tasks import deploy_template
+        transaction.on_commit(lambda: deploy_template.delay(TemplateDeployment.WEBHOOK, self.id))
 
     def __str__(self):
         return self.name
 
+# One push of a webhook or MQTT template to its readers, run by template_deployment.py
+class TemplateDeployment(models.Model):
+    WEBHOOK = 'webhook'
+    MQTT = 'mqtt'
+    KIND_CHOICES = [(WEBHOOK, 'Webhook'), (MQTT, 'MQTT')]
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (FINISHED, 'Finished')]
+
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    webhook_template = models.ForeignKey(WebhookTemplate, on_delete=models.CASCADE, null=True, blank=True, related_name='deployments')
+    mqtt_template = models.ForeignKey('MqttTemplate', on_delete=models.CASCADE, null=True, blank=True, related_name='deployments')
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=RUNNING)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)  # Updated while running, at most once per second
+    failed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    @property
+    def template(self):
+        return self.webhook_template if self.kind == self.WEBHOOK else self.mqtt_template
+
+    @property
+    def duration(self):
+        return self.finished_at - self.started_at if self.finished_at else None
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.template} ({self.succeeded}/{self.total})'
+
 class WebhookTemplateApplicationResult(models.Model):
     template = models.ForeignKey(WebhookTemplate, on_delete=models.CASCADE, related_name='application_results')
     reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='webhook_application_results')
+    deployment = models.ForeignKey(TemplateDeployment, on_delete=models.SET_NULL, null=True, blank=True, related_name='webhook_results')
     success = models.BooleanField(default=False)
     response_message = models.TextField(null=True, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
     retry = models.BooleanField(default=False)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.template.name} -> {self.reader.name} ({self.success})'
@@ -90,10 +148,9 @@ class MqttTemplate(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        # Enqueue a task to send the template to each associated reader
-        from .tasks import process_mqtt_settings
-        for reader in self.readers.all():
-            process_mqtt_settings.apply_async((self.id, reader.id))
+        # One deployment job sends the template to all associated readers, queued once the readers are saved too
+        from .tasks import deploy_template
+        transaction.on_commit(lambda: deploy_template.delay(TemplateDeployment.MQTT, self.id))
 
     def __str__(self):
         return self.name
@@ -101,19 +158,30 @@ class MqttTemplate(models.Model):
 class MQTTTemplateApplicationResult(models.Model):
     template = models.ForeignKey(MqttTemplate, on_delete=models.CASCADE, related_name='application_results')
     reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='mqtt_application_results')
+    deployment = models.ForeignKey(TemplateDeployment, on_delete=models.SET_NULL, null=True, blank=True, related_name='mqtt_results')
     success = models.BooleanField(default=False)
     response_message = models.TextField(null=True, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
     retry = models.BooleanField(default=False)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.template.name} -> {self.reader.name} ({self.success})'
     
 class Preset(models.Model):
     reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='presets')
-    preset_id = models.CharField(max_length=255, unique=True)
+    preset_id = models.CharField(max_length=255)
     configuration = models.JSONField()  # Stores the preset configuration as JSON
     is_active = models.BooleanField(default=False)
+    etag = models.CharField(max_length=255, blank=True)  # ETag of the configuration last fetched from the reader
+    config_hash = models.CharField(max_length=64, blank=True)  # SHA-256 of that configuration, for readers without ETags
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Every reader has its own presets, e.g. "default"
+            models.UniqueConstraint(fields=['reader', 'preset_id'], name='unique_reader_preset'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.is_active:
@@ -127,17 +195,14 @@ class Preset(models.Model):
         return f"{self.reader.name} - {self.preset_id}"
     
     def send_to_reader(self):
-        url = f"https://{self.reader.ip_address}:{self.reader.port}/api/v1/profiles/inventory/presets/{self.preset_id}"
-        auth = (self.reader.username, self.reader.password)
-        headers = {'Content-Type': 'application/json'}
-        response = requests.put(url, json=self.configuration, auth=auth, headers=headers, verify=False)
-        return response
+        from .reader_api import client_for
+
+        return client_for(self.reader).put_preset(self.preset_id, self.configuration)
 
     def delete_from_reader(self):
-        url = f"https://{self.reader.ip_address}:{self.reader.port}/api/v1/profiles/inventory/presets/{self.preset_id}"
-        auth = (self.reader.username, self.reader.password)
-        response = requests.delete(url, auth=auth, verify=False)
-        return response
+        from .reader_api import client_for
+
+        return client_for(self.reader).delete_preset(self.preset_id)
     
 class PresetTemplate(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -147,6 +212,48 @@ class PresetTemplate(models.Model):
     def __str__(self):
         return self.name
 
+# Start or stop of a preset on many readers at once, run concurrently by preset_rollout.py
+class PresetRollout(models.Model):
+    START = 'start'
+    STOP = 'stop'
+    ACTION_CHOICES = [(START, 'Start preset'), (STOP, 'Stop preset')]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FINISHED, 'Finished')]
+
+    action = models.CharField(max_length=5, choices=ACTION_CHOICES, default=START)
+    preset_id = models.CharField(max_length=255, blank=True)  # Preset started on every reader, blank to stop
+    configuration = models.JSONField(null=True, blank=True)  # Pushed before the start, None starts the preset as stored on the reader
+    preset_template = models.ForeignKey(PresetTemplate, on_delete=models.SET_NULL, null=True, blank=True, related_name='rollouts')
+    readers = models.ManyToManyField(Reader, related_name='preset_rollouts')
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+    @property
+    def duration(self):
+        return self.finished_at - self.started_at if self.started_at and self.finished_at else None
+
+    def __str__(self):
+        label = f'{self.get_action_display()} {self.preset_id}' if self.preset_id else self.get_action_display()
+        return f'{label} ({self.status})'
+
+class PresetRolloutResult(models.Model):
+    rollout = models.ForeignKey(PresetRollout, on_delete=models.CASCADE, related_name='results')
+    reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='preset_rollout_results')
+    success = models.BooleanField(default=False)
+    step = models.CharField(max_length=10)  # Last call made: put, start or stop
+    response_message = models.TextField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.rollout} -> {self.reader.name} ({self.success})'
+
 class TagEvent(models.Model):
     reader = models.ForeignKey(Reader, on_delete=models.CASCADE)
     epc = models.CharField(max_length=256)
@@ -163,6 +270,70 @@ class TagEvent(models.Model):
     tag_data_key = models.CharField(max_length=255, null=True, blank=True)  # For the smartreader type of event
     tag_data_key_name = models.CharField(max_length=255, null=True, blank=True)  # For the smartreader type of event
     tag_data_serial = models.CharField(max_length=255, null=True, blank=True)  # For the smartreader type of event
+    read_count = models.PositiveIntegerField(default=1)  # Reads collapsed into this event by the dedup window
+
+    class Meta:
+        # Plain indexes, created on every partition when the table is partitioned (see partitions.py)
+        indexes = [
+            # Time range filters and sorting of the list, export and dashboard
+            models.Index(fields=['timestamp'], name='tag_event_timestamp_idx'),
+            # Latest events of one reader
+            models.Index(fields=['reader', 'timestamp'], name='tag_event_reader_ts_idx'),
+            # History of one tag
+            models.Index(fields=['epc', 'timestamp'], name='tag_event_epc_ts_idx'),
+        ]
+
+    @property
+    def last_read_time(self):
+        # Collapsed events keep their latest read in last_seen_time, timestamp is the first one
+        return self.last_seen_time if self.read_count > 1 and self.last_seen_time else self.timestamp
 
     def __str__(self):
         return f'{self.reader.name} - {self.epc}'
+
+# Tag reads of one reader antenna per minute, hour or day, kept up to date by the ingest path (see rollups.py)
+class TagReadRollup(models.Model):
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [(MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day')]
+
+    granularity = models.CharField(max_length=6, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()  # Start of the minute, hour or day (UTC)
+    reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='tag_read_rollups')
+    antenna_port = models.PositiveIntegerField(default=0)  # 0 when the antenna is unknown
+    read_count = models.PositiveBigIntegerField(default=0)
+    unique_epcs = models.PositiveIntegerField(default=0)  # Estimated from epc_sketch
+    epc_sketch = models.BinaryField(default=b'')  # HyperLogLog registers of the EPCs read, see epc_sketch.py
+    rssi_min = models.IntegerField(null=True, blank=True)
+    rssi_max = models.IntegerField(null=True, blank=True)
+    rssi_sum = models.BigIntegerField(default=0)
+    rssi_count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'bucket', 'reader', 'antenna_port'], name='unique_tag_read_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'bucket'], name='tag_read_rollup_bucket_idx'),
+        ]
+
+    @property
+    def rssi_avg(self):
+        return self.rssi_sum / self.rssi_count if self.rssi_count else None
+
+    def __str__(self):
+        return f'{self.reader.name} - antenna {self.antenna_port} - {self.granularity} {self.bucket}'
+
+class RetentionPolicy(models.Model):
+    model = models.CharField(max_length=100, unique=True)  # Policy name from retention.RETAINED_MODELS, e.g. readers.TagEvent
+    keep_days = models.PositiveIntegerField()  # 0 keeps every row
+    enabled = models.BooleanField(default=True)  # Disabled policies keep every row, even when set in RETENTION_POLICIES
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_deleted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'retention policies'
+
+    def __str__(self):
+        return f'{self.model}: {self.keep_days} days'
@@ -0,0 +1,205 @@
+# readers/partitions.py
+"""
+Range partitioning of the TagEvent table by ``timestamp`` on PostgreSQL.
+
+Migration 0003 turns ``readers_tagevent`` into a table partitioned by day or
+week (``TAG_EVENT_PARTITION_INTERVAL``). The existing table is attached as
+the partition holding everything before the migration, so no rows are
+copied, and a DEFAULT partition catches reads outside every partition.
+
+The ORM still sees one table: queries filtering on ``timestamp`` only scan
+the partitions of their range. The primary key becomes ``(id, timestamp)``,
+ids stay unique as they all come from one sequence.
+
+``maintain_partitions`` creates the partitions of the next
+``TAG_EVENT_PARTITION_PREMAKE`` periods and detaches, or drops, those older
+than ``TAG_EVENT_PARTITION_RETENTION_DAYS``. It runs daily from Celery beat
+and through ``python manage.py manage_tag_event_partitions``. On other
+databases the table stays a plain table and all of this is a no-op.
+"""
+import logging
+import re
+from datetime import datetime, time, timedelta, timezone
+
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'readers_tagevent'
+DEFAULT_PARTITION = f'{TABLE}_default'
+INTERVALS = ('day', 'week')
+
+_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def period_start(moment, interval):
+    """Start (UTC midnight) of the day or ISO week containing ``moment``."""
+    day = moment.astimezone(timezone.utc).date()
+    if interval == 'week':
+        day -= timedelta(days=day.weekday())
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def period_end(start, interval):
+    return start + timedelta(days=7 if interval == 'week' else 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y%m%d}'
+
+
+def missing_ranges(existing, start, periods, interval):
+    """
+    Ranges of the ``periods`` periods from ``start`` not covered by ``existing``.
+
+    ``existing`` holds ``(lower, upper)`` bounds, None standing for
+    MINVALUE/MAXVALUE. Ranges are trimmed around existing partitions, so
+    changing the interval does not create overlapping partitions.
+    """
+    ranges = []
+    for _ in range(periods):
+        end = period_end(start, interval)
+        lower, upper = start, end
+        for bound_lower, bound_upper in existing:
+            if (bound_lower is None or bound_lower <= lower) and (bound_upper is None or lower < bound_upper):
+                lower = upper if bound_upper is None else max(lower, bound_upper)
+        for bound_lower, bound_upper in existing:
+            if bound_lower is not None and lower < bound_lower < upper:
+                upper = bound_lower
+        if lower < upper:
+            ranges.append((lower, upper))
+        start = end
+    return ranges
+
+
+def is_partitioned(connection=default_connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(connection=default_connection):
+    """``(name, lower, upper)`` of every range partition, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND pg_table_is_visible(p.oid)",
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound)
+        if match is None:
+            # The DEFAULT partition has no range
+            continue
+        lower, upper = (None if value.endswith('VALUE') else datetime.fromisoformat(value.strip("'")) for value in match.groups())
+        partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda partition: partition[1] or datetime.min.replace(tzinfo=timezone.utc))
+
+
+def create_partitions(connection=default_connection, now=None, periods=None, interval=None):
+    """Create the partitions of the current and the next ``periods`` periods. Returns their names."""
+    interval = interval or settings.TAG_EVENT_PARTITION_INTERVAL
+    if interval not in INTERVALS:
+        raise ValueError(f"TAG_EVENT_PARTITION_INTERVAL must be one of {INTERVALS}, got {interval!r}")
+    periods = settings.TAG_EVENT_PARTITION_PREMAKE if periods is None else periods
+    start = period_start(now or datetime.now(timezone.utc), interval)
+    existing = [(lower, upper) for name, lower, upper in list_partitions(connection)]
+
+    created = []
+    with connection.cursor() as cursor:
+        for lower, upper in missing_ranges(existing, start, periods + 1, interval):
+            name = partition_name(lower)
+            try:
+                # Rows of the range already in the DEFAULT partition make this fail, the range stays there
+                with transaction.atomic(using=connection.alias):
+                    cursor.execute(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                        [lower, upper],
+                    )
+            except Exception as e:
+                logger.error(f"Cannot create TagEvent partition {name}: {e}")
+                continue
+            created.append(name)
+    return created
+
+
+def remove_expired_partitions(connection=default_connection, now=None, retention_days=None, detach_only=None):
+    """Detach, and unless ``detach_only`` drop, partitions entirely older than the retention period."""
+    retention_days = settings.TAG_EVENT_PARTITION_RETENTION_DAYS if retention_days is None else retention_days
+    detach_only = settings.TAG_EVENT_PARTITION_DETACH_ONLY if detach_only is None else detach_only
+    if retention_days <= 0:
+        return []
+
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+    removed = []
+    with connection.cursor() as cursor:
+        for name, lower, upper in list_partitions(connection):
+            if upper is None or upper > cutoff:
+                continue
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+            if not detach_only:
+                cursor.execute(f'DROP TABLE "{name}"')
+            removed.append(name)
+    return removed
+
+
+def maintain_partitions(connection=default_connection, now=None, periods=None, retention_days=None, detach_only=None):
+    """Returns ``(created, removed)`` partition names, both empty when the table is not partitioned."""
+    if not is_partitioned(connection):
+        return [], []
+    created = create_partitions(connection, now=now, periods=periods)
+    removed = remove_expired_partitions(connection, now=now, retention_days=retention_days, detach_only=detach_only)
+    return created, removed
+
+
+def partition_table(connection, now=None, interval=None):
+    """
+    Convert the plain TagEvent table into a partitioned one, see migration 0003.
+
+    The current table becomes the partition of everything before the next
+    period, its identity column is replaced by a sequence shared through the
+    parent's default.
+    """
+    interval = interval or settings.TAG_EVENT_PARTITION_INTERVAL
+    cutoff = period_end(period_start(now or datetime.now(timezone.utc), interval), interval)
+    legacy = f'{TABLE}_legacy'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM "{TABLE}"')
+        next_id = cursor.fetchone()[0]
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{legacy}"')
+        # The parent's (id, timestamp) key is built on the partition when it is attached, the old key would be a second one
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+            [f'"{legacy}"'],
+        )
+        for (constraint,) in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{constraint}"')
+        cursor.execute(f'ALTER TABLE "{legacy}" ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE "{legacy}" ALTER COLUMN id DROP DEFAULT')
+        # Tables created before identity columns own a serial sequence of the same name
+        cursor.execute(f'DROP SEQUENCE IF EXISTS "{TABLE}_id_seq"')
+        cursor.execute(f'CREATE SEQUENCE "{TABLE}_id_seq" START WITH {int(next_id)}')
+        cursor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN id SET DEFAULT nextval(\'"{TABLE}_id_seq"\')')
+        cursor.execute(f'ALTER SEQUENCE "{TABLE}_id_seq" OWNED BY "{TABLE}".id')
+        # A primary key of a partitioned table must include the partition key
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey_partitioned" PRIMARY KEY (id, "timestamp")')
+        cursor.execute(f'CREATE INDEX "{TABLE}_reader_id_partitioned" ON "{TABLE}" (reader_id)')
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_reader_id_fk_partitioned" FOREIGN KEY (reader_id) '
+            f'REFERENCES "readers_reader" (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{legacy}" FOR VALUES FROM (MINVALUE) TO (%s)', [cutoff])
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+    create_partitions(connection, now=now, interval=interval)
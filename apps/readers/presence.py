@@ -0,0 +1,221 @@
+# readers/presence.py
+"""
+In-memory presence tracking for read point traceability.
+
+The open TagTraceability row of every (epc, read point) pair the process has
+seen is kept in memory. A read within the read point's timeout of the last
+one only moves ``last_seen`` in memory; the database is written for
+transitions only:
+
+* arrival, a read of a pair with no open row, inserts a row;
+* departure, a read more than ``timeout_seconds`` after the last one,
+  closes the row at ``last_seen + timeout`` and starts a new arrival.
+
+Pending ``last_seen`` values are flushed with one bulk UPDATE at most every
+``PRESENCE_FLUSH_INTERVAL`` seconds, after a batch or from the flush_presence
+beat task.
+
+Tags that are not read again depart from a timer wheel of the deadlines
+``last_seen + timeout``. A sighting does not touch the wheel: when a
+deadline comes up the entry is rescheduled if the tag was seen since, and
+otherwise closed. A ticker thread turns the wheel every
+``PRESENCE_TICK_SECONDS``, so departures are written within about a second
+of expiry. Starting the ticker rebuilds the state from the open rows, the
+departure sweep remains as a safety net for when no tracker runs.
+
+The state is per process: the traceability tasks are routed to their own
+queue (``traceability_queue``), consumed by a single worker process.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import TagTraceability
+from .timer_wheel import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+
+class Presence:
+    """Open traceability row of one (epc, read point) pair, ``row.pk`` is None until it is inserted."""
+
+    __slots__ = ('row', 'timeout', 'dirty')
+
+    def __init__(self, row, timeout):
+        self.row = row
+        self.timeout = timeout
+        self.dirty = False
+
+
+class PresenceTracker:
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval
+        self._open = {}
+        self._wheel = TimerWheel()
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._ticker = None
+        self.arrivals = 0
+        self.departures = 0
+
+    def observe(self, tag_events):
+        """Apply a batch of saved TagEvents, with their reader's read points prefetched."""
+        reads = [
+            (tag_event.timestamp, tag_event.last_read_time, tag_event.epc, read_point)
+            for tag_event in tag_events
+            for read_point in tag_event.reader.read_points.all()
+        ]
+        if not reads:
+            return
+        reads.sort(key=lambda read: read[0])
+
+        with self._lock:
+            self._load({(epc, read_point.id) for arrived, seen, epc, read_point in reads} - self._open.keys())
+            arrivals, departures = [], []
+            for arrived, seen, epc, read_point in reads:
+                key = (epc, read_point.id)
+                presence = self._open.get(key)
+                if presence is not None:
+                    row = presence.row
+                    if arrived - row.last_seen <= presence.timeout:
+                        if seen > row.last_seen:
+                            row.last_seen = seen
+                            presence.dirty = True
+                        continue
+                    row.departed_at = row.last_seen + presence.timeout
+                    if row.pk is not None:
+                        departures.append(row)
+
+                row = TagTraceability(epc=epc, read_point=read_point, location_id=read_point.location_id, arrived_at=arrived, last_seen=seen)
+                self._track(key, row, read_point.timeout_seconds)
+                arrivals.append(row)
+
+            try:
+                with transaction.atomic():
+                    TagTraceability.objects.bulk_create(arrivals)
+                    TagTraceability.objects.bulk_update(departures, ['last_seen', 'departed_at'])
+            except Exception:
+                # The state no longer matches the database, it is reloaded for the next batch
+                self._open.clear()
+                self._wheel.clear()
+                raise
+            self.arrivals += len(arrivals)
+            self.departures += len(departures) + sum(1 for row in arrivals if row.departed_at is not None)
+        self.flush()
+
+    def expire(self, now=None):
+        """Close the rows of pairs not seen within their timeout. Returns the number of departures."""
+        now = now or timezone.now()
+        with self._lock:
+            departures = []
+            for key in self._wheel.advance(now):
+                presence = self._open.get(key)
+                if presence is None:
+                    continue
+                row = presence.row
+                deadline = row.last_seen + presence.timeout
+                if deadline > now:
+                    # Seen since it was scheduled
+                    self._wheel.schedule(key, deadline)
+                    continue
+                row.departed_at = deadline
+                del self._open[key]
+                departures.append(row)
+            if departures:
+                TagTraceability.objects.bulk_update(departures, ['last_seen', 'departed_at'], batch_size=1000)
+                self.departures += len(departures)
+        return len(departures)
+
+    def flush(self, force=False):
+        """Write pending last_seen values. Returns the number of rows updated."""
+        interval = settings.PRESENCE_FLUSH_INTERVAL if self.flush_interval is None else self.flush_interval
+        with self._lock:
+            if not force and time.monotonic() - self._flushed_at < interval:
+                return 0
+            dirty = [presence for presence in self._open.values() if presence.dirty]
+            TagTraceability.objects.bulk_update([presence.row for presence in dirty], ['last_seen'], batch_size=1000)
+            for presence in dirty:
+                presence.dirty = False
+            self._flushed_at = time.monotonic()
+        return len(dirty)
+
+    def rebuild(self):
+        """Reload every open row, e.g. after a restart. Returns the number of pairs tracked."""
+        rows = (
+            TagTraceability.objects.filter(departed_at__isnull=True)
+            .filter(Q(last_seen__isnull=False) | Q(arrived_at__isnull=False))
+            .select_related('read_point')
+            .order_by('arrived_at')
+        )
+        with self._lock:
+            self._open.clear()
+            self._wheel.clear()
+            for row in rows.iterator(chunk_size=2000):
+                # The latest open row wins if duplicates were left behind
+                row.last_seen = row.last_seen or row.arrived_at
+                self._track((row.epc, row.read_point_id), row, row.read_point.timeout_seconds)
+            return len(self._open)
+
+    def start(self, tick=None):
+        """Rebuild the state and start the ticker thread of the process, unless it runs already."""
+        with self._lock:
+            if self._ticker is not None and self._ticker.is_alive():
+                return False
+            self._ticker = threading.Thread(target=self._tick, args=(tick,), name='presence-ticker', daemon=True)
+        self.rebuild()
+        self._ticker.start()
+        logger.info(f"Presence ticker started with {len(self)} open traceability rows")
+        return True
+
+    def _tick(self, tick):
+        tick = tick or settings.PRESENCE_TICK_SECONDS
+        while True:
+            time.sleep(tick)
+            try:
+                self.expire()
+                self.flush()
+            except Exception as e:
+                logger.error(f"Presence ticker failed: {e}", exc_info=True)
+                close_old_connections()
+
+    def _track(self, key, row, timeout_seconds):
+        presence = Presence(row, timedelta(seconds=timeout_seconds))
+        self._open[key] = presence
+        self._wheel.schedule(key, row.last_seen + presence.timeout)
+
+    def _load(self, keys):
+        if not keys:
+            return
+        epcs = {epc for epc, read_point_id in keys}
+        read_point_ids = {read_point_id for epc, read_point_id in keys}
+        rows = (
+            TagTraceability.objects.filter(departed_at__isnull=True, epc__in=epcs, read_point_id__in=read_point_ids)
+            .filter(Q(last_seen__isnull=False) | Q(arrived_at__isnull=False))
+            .select_related('read_point')
+            .order_by('arrived_at')
+        )
+        for row in rows:
+            key = (row.epc, row.read_point_id)
+            if key in keys:
+                # The latest open row wins if duplicates were left behind
+                row.last_seen = row.last_seen or row.arrived_at
+                self._track(key, row, row.read_point.timeout_seconds)
+
+    def __len__(self):
+        return len(self._open)
+
+    def clear(self):
+        with self._lock:
+            self._open.clear()
+            self._wheel.clear()
+
+
+# State of the traceability worker process
+tracker = PresenceTracker()
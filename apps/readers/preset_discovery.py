@@ -0,0 +1,123 @@
+# readers/preset_discovery.py
+"""
+Discovery of the inventory presets stored on readers.
+
+``fetch`` lists the preset ids of a reader and GETs their configurations
+concurrently, up to ``READER_API_POOL_SIZE`` at a time, the size of the
+reader's connection pool. A preset fetched before is requested with
+``If-None-Match`` and its ETag, a 304 skips it. Readers that send no ETag
+are compared by a hash of the configuration last fetched, so an unchanged
+preset is not written again and keeps its local edits. ``store`` then
+upserts the changed presets with one ``bulk_create(update_conflicts=True)``.
+
+``sync_readers`` does this for many readers at once through
+reader_api.fan_out, from the sync_presets task. HTTP calls run in the pool
+threads, the database is written from the calling thread only.
+"""
+import hashlib
+import json
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import reader_api
+from .models import Preset, Reader
+
+logger = logging.getLogger(__name__)
+
+# status: 'changed', 'unchanged' (304 or same hash) or 'failed', the other fields are None unless changed
+FetchedPreset = namedtuple('FetchedPreset', 'preset_id status configuration etag config_hash')
+
+
+def config_hash(configuration):
+    return hashlib.sha256(json.dumps(configuration, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def fetch(client, known):
+    """List the presets of a reader and fetch the configurations that changed. ``known`` maps preset ids to ``(etag, config_hash)``."""
+    response = client.list_presets()
+    response.raise_for_status()
+    preset_ids = response.json()
+
+    def fetch_one(preset_id):
+        etag, known_hash = known.get(preset_id, ('', ''))
+        headers = {'If-None-Match': etag} if etag else None
+        try:
+            detail = client.get_preset(preset_id, headers=headers)
+            if detail.status_code == 304:
+                return FetchedPreset(preset_id, 'unchanged', None, None, None)
+            detail.raise_for_status()
+            configuration = detail.json()
+            etag, fetched_hash = detail.headers.get('ETag', ''), config_hash(configuration)
+            if not etag and fetched_hash == known_hash:
+                return FetchedPreset(preset_id, 'unchanged', None, None, None)
+            return FetchedPreset(preset_id, 'changed', configuration, etag, fetched_hash)
+        except Exception as e:
+            logger.warning(f"Failed to retrieve configuration for preset '{preset_id}' from {client.base_url}: {e}")
+            return FetchedPreset(preset_id, 'failed', None, None, None)
+
+    if not preset_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=min(settings.READER_API_POOL_SIZE, len(preset_ids))) as pool:
+        return list(pool.map(fetch_one, preset_ids))
+
+
+def store(reader, fetched, known=()):
+    """Upsert the fetched presets of ``reader``. Returns the count of presets per status."""
+    now = timezone.now()
+    rows = [
+        Preset(
+            reader=reader, preset_id=preset.preset_id, configuration=preset.configuration,
+            etag=preset.etag, config_hash=preset.config_hash, synced_at=now,
+        )
+        for preset in fetched if preset.status == 'changed'
+    ]
+    # Presets that could not be fetched are still listed, without configuration, like before
+    rows.extend(
+        Preset(reader=reader, preset_id=preset.preset_id, configuration={})
+        for preset in fetched if preset.status == 'failed' and preset.preset_id not in known
+    )
+    Preset.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['reader', 'preset_id'], update_fields=['configuration', 'etag', 'config_hash', 'synced_at'],
+    )
+    unchanged = [preset.preset_id for preset in fetched if preset.status == 'unchanged']
+    if unchanged:
+        Preset.objects.filter(reader=reader, preset_id__in=unchanged).update(synced_at=now)
+
+    counts = {'changed': 0, 'unchanged': 0, 'failed': 0}
+    for preset in fetched:
+        counts[preset.status] += 1
+    return counts
+
+
+def _known(readers):
+    known = {}
+    presets = Preset.objects.filter(reader__in=readers).values_list('reader_id', 'preset_id', 'etag', 'config_hash')
+    for reader_id, preset_id, etag, configuration_hash in presets:
+        known.setdefault(reader_id, {})[preset_id] = (etag, configuration_hash)
+    return known
+
+
+def sync_reader(reader):
+    """Sync the presets of one reader. Raises requests exceptions when the preset list cannot be read."""
+    known = _known([reader]).get(reader.pk, {})
+    return store(reader, fetch(reader_api.client_for(reader), known), known=known)
+
+
+def sync_readers(readers=None, max_workers=None):
+    """Sync the presets of many readers concurrently. Returns the counts per reader id, None when the reader failed."""
+    readers = list(Reader.objects.all() if readers is None else readers)
+    known = _known(readers)
+    results = {}
+    for reader, fetched, error, seconds in reader_api.fan_out(
+        readers, lambda client, reader: fetch(client, known.get(reader.pk, {})), max_workers=max_workers,
+    ):
+        if error is not None:
+            logger.warning(f"Failed to list the presets of reader {reader.name} ({reader.ip_address}): {error}")
+            results[reader.pk] = None
+            continue
+        results[reader.pk] = store(reader, fetched, known=known.get(reader.pk, {}))
+    return results
@@ -0,0 +1,105 @@
+# readers/preset_rollout.py
+"""
+Preset start and stop on a fleet of readers.
+
+A PresetRollout targets readers picked one by one or through their ReadPoint
+or Location. ``run`` pushes the configuration and starts the preset (or stops
+the running one) on all of them concurrently, at most
+``READER_API_CONCURRENCY`` readers at a time over the pooled reader_api
+sessions. A PresetRolloutResult is saved per reader as soon as it completes,
+so the detail page can poll them while the rollout runs.
+"""
+import logging
+
+import requests
+from django.db.models import Q
+from django.utils import timezone
+
+from . import reader_api
+from .models import Preset, PresetRollout, PresetRolloutResult, Reader
+
+logger = logging.getLogger(__name__)
+
+
+def target_readers(readers=(), read_points=(), locations=()):
+    """Readers picked directly, through one of ``read_points`` or through a read point of ``locations``."""
+    return Reader.objects.filter(
+        Q(pk__in=[reader.pk for reader in readers])
+        | Q(read_points__in=read_points)
+        | Q(read_points__location__in=locations)
+    ).distinct()
+
+
+def create_rollout(action, readers, preset_id='', configuration=None, preset_template=None):
+    if preset_template is not None:
+        preset_id = preset_id or preset_template.name
+        configuration = preset_template.configuration if configuration is None else configuration
+    rollout = PresetRollout.objects.create(
+        action=action, preset_id=preset_id, configuration=configuration, preset_template=preset_template,
+    )
+    rollout.readers.set(readers)
+    return rollout
+
+
+def _call(rollout):
+    def call(client, reader):
+        """PUT and start, or stop, on one reader. Returns ``(step, success, message)``."""
+        if rollout.action == PresetRollout.STOP:
+            step, response = 'stop', client.stop_preset()
+        else:
+            step, response = 'put', None
+            try:
+                # The default preset cannot be changed
+                if rollout.configuration is not None and rollout.preset_id != 'default':
+                    response = client.put_preset(rollout.preset_id, rollout.configuration)
+                    response.raise_for_status()
+                step, response = 'start', client.start_preset(rollout.preset_id)
+            except requests.exceptions.RequestException as e:
+                return step, False, str(e)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            return step, False, str(e)
+        return step, True, response.text
+    return call
+
+
+def run(rollout, max_workers=None):
+    """Run a pending rollout. Returns False when it was already started elsewhere."""
+    started_at = timezone.now()
+    if not PresetRollout.objects.filter(pk=rollout.pk, status=PresetRollout.PENDING).update(status=PresetRollout.RUNNING, started_at=started_at):
+        return False
+    rollout.status, rollout.started_at = PresetRollout.RUNNING, started_at
+
+    succeeded = []
+    failed = 0
+    for reader, outcome, error, seconds in reader_api.fan_out(rollout.readers.all(), _call(rollout), max_workers=max_workers):
+        step, success, message = outcome if error is None else ('', False, str(error))
+        PresetRolloutResult.objects.create(
+            rollout=rollout, reader=reader, success=success, step=step,
+            response_message=message, duration_ms=round(seconds * 1000),
+        )
+        if success:
+            succeeded.append(reader)
+        else:
+            failed += 1
+            logger.warning(f"Preset rollout {rollout.pk} failed on reader {reader.name} at {step or 'request'}: {message}")
+
+    if rollout.action == PresetRollout.START:
+        _mark_active(rollout.preset_id, succeeded)
+
+    rollout.status = PresetRollout.FINISHED
+    rollout.finished_at = timezone.now()
+    rollout.succeeded = len(succeeded)
+    rollout.failed = failed
+    rollout.save(update_fields=['status', 'finished_at', 'succeeded', 'failed'])
+    logger.info(f"Preset rollout {rollout.pk} finished in {rollout.duration.total_seconds():.2f}s: {rollout.succeeded} succeeded, {failed} failed")
+    return True
+
+
+def _mark_active(preset_id, readers):
+    # Same bookkeeping as the start_preset view, for the readers that store the preset
+    for preset in Preset.objects.filter(reader__in=readers, preset_id=preset_id).select_related('reader'):
+        preset.reader.presets.exclude(pk=preset.pk).update(is_active=False)
+        preset.is_active = True
+        preset.save()
@@ -0,0 +1,154 @@
+# readers/reader_api.py
+"""
+Client for the Impinj reader REST API.
+
+Every call to a reader goes through a ``requests.Session`` kept per reader, so
+its TLS connections are reused (keep-alive) instead of paying a handshake per
+request. Requests get connect and read timeouts, and connection errors and
+502/503/504 answers are retried with exponential backoff. Only idempotent
+methods are retried once the request was sent, a POST is retried on connect
+errors only.
+
+Responses are returned as they are and failures raise
+``requests.exceptions.RequestException``, like the bare ``requests`` calls
+this replaces. Sessions are safe to share between threads: ``fan_out`` runs
+a call against many readers concurrently for the fleet operations.
+"""
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class ReaderClient:
+
+    def __init__(self, reader):
+        self.key = _key(reader)
+        self.base_url = f"https://{reader.ip_address}:{reader.port}/api/v1"
+        self.timeout = (settings.READER_API_CONNECT_TIMEOUT, settings.READER_API_READ_TIMEOUT)
+        self.session = requests.Session()
+        self.session.auth = (reader.username, reader.password)
+        # Readers ship self-signed certificates
+        self.session.verify = settings.READER_API_VERIFY_TLS
+        retry = Retry(
+            total=settings.READER_API_RETRIES,
+            backoff_factor=settings.READER_API_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'PUT', 'DELETE'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=settings.READER_API_POOL_SIZE)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+    def get_status(self):
+        return self.request('GET', '/status', headers=JSON_HEADERS)
+
+    def list_presets(self):
+        return self.request('GET', '/profiles/inventory/presets', headers=JSON_HEADERS)
+
+    def get_preset(self, preset_id, headers=None):
+        return self.request('GET', f'/profiles/inventory/presets/{preset_id}', headers={**JSON_HEADERS, **(headers or {})})
+
+    def put_preset(self, preset_id, configuration):
+        return self.request('PUT', f'/profiles/inventory/presets/{preset_id}', json=configuration, headers=JSON_HEADERS)
+
+    def delete_preset(self, preset_id):
+        return self.request('DELETE', f'/profiles/inventory/presets/{preset_id}')
+
+    def start_preset(self, preset_id):
+        return self.request('POST', f'/profiles/inventory/presets/{preset_id}/start')
+
+    def stop_preset(self):
+        return self.request('POST', '/profiles/stop')
+
+    def put_webhook(self, content):
+        return self.request('PUT', '/webhooks/event', json=content, headers=JSON_HEADERS)
+
+    def put_mqtt(self, content):
+        return self.request('PUT', '/mqtt', json=content, headers=JSON_HEADERS)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_for(reader):
+    """The pooled client of ``reader``, a new one when its address or credentials changed."""
+    with _lock:
+        client = _clients.get(reader.pk)
+        if client is not None and client.key == _key(reader):
+            return client
+        if client is not None:
+            client.close()
+        client = _clients[reader.pk] = ReaderClient(reader)
+        return client
+
+
+def fan_out(readers, call, max_workers=None, stagger=0):
+    """
+    Run ``call(client, reader)`` for every reader, at most ``READER_API_CONCURRENCY`` at a time.
+
+    Yields ``(reader, result, error, seconds)`` as the calls complete, ``error``
+    being the exception raised by the call if any. Only the HTTP calls run in
+    the pool threads, the caller writes to the database. With ``stagger`` each
+    call is submitted after a random delay of up to that many seconds, waited
+    in the calling thread so no pool thread sleeps.
+    """
+    readers = list(readers)
+    if not readers:
+        return
+
+    def timed(reader):
+        started = time.monotonic()
+        try:
+            return call(client_for(reader), reader), None, time.monotonic() - started
+        except Exception as e:
+            return None, e, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=min(max_workers or settings.READER_API_CONCURRENCY, len(readers))) as pool:
+        if not stagger:
+            futures = {pool.submit(timed, reader): reader for reader in readers}
+            for future in as_completed(futures):
+                yield (futures[future], *future.result())
+            return
+
+        schedule = sorted(((random.uniform(0, stagger), reader) for reader in readers), key=lambda item: item[0])
+        started = time.monotonic()
+        futures = {}
+        while schedule or futures:
+            elapsed = time.monotonic() - started
+            while schedule and schedule[0][0] <= elapsed:
+                reader = schedule.pop(0)[1]
+                futures[pool.submit(timed, reader)] = reader
+            timeout = schedule[0][0] - elapsed if schedule else None
+            if not futures:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield (futures.pop(future), *future.result())
+
+
+def _key(reader):
+    return (reader.pk, reader.ip_address, reader.port, reader.username, reader.password)
+
+
+def close_all():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,107 @@
+# readers/retention.py
+"""
+Retention of event and result tables.
+
+Every table that grows without bound is listed in RETAINED_MODELS with the
+field its age is measured on. Rollups have one entry per granularity, e.g.
+raw reads can be kept 7 days and hourly rollups a year. How long rows are
+kept comes from ``settings.RETENTION_POLICIES`` (policy name -> days) and can
+be changed per model with a RetentionPolicy in the admin, which takes
+precedence.
+
+``enforce_retention`` runs from Celery beat and deletes expired rows in
+batches of ``RETENTION_BATCH_SIZE`` primary keys, one short transaction per
+batch with a pause in between, so it never holds long locks or writes a
+burst of WAL. A run stops after ``RETENTION_MAX_BATCHES`` batches per model,
+the next run carries on. On a partitioned TagEvent table whole partitions
+are dropped by partitions.py, this only removes what is left in between.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Policy name -> (model label, field the age of a row is measured on, extra filters).
+# Names are model labels, with the granularity appended for rollups
+RETAINED_MODELS = {
+    'readers.TagEvent': ('readers.TagEvent', 'timestamp', {}),
+    'readers.TagReadRollup.minute': ('readers.TagReadRollup', 'bucket', {'granularity': 'minute'}),
+    'readers.TagReadRollup.hour': ('readers.TagReadRollup', 'bucket', {'granularity': 'hour'}),
+    'readers.TagReadRollup.day': ('readers.TagReadRollup', 'bucket', {'granularity': 'day'}),
+    'readers.WebhookTemplateApplicationResult': ('readers.WebhookTemplateApplicationResult', 'timestamp', {}),
+    'readers.MQTTTemplateApplicationResult': ('readers.MQTTTemplateApplicationResult', 'timestamp', {}),
+    'readers.PresetRolloutResult': ('readers.PresetRolloutResult', 'timestamp', {}),
+    'readers.TemplateDeployment': ('readers.TemplateDeployment', 'started_at', {}),
+    'smartreader.StatusEvent': ('smartreader.StatusEvent', 'timestamp', {}),
+    'smartreader.AntennaStatus': ('smartreader.AntennaStatus', 'status_event__timestamp', {}),
+    'smartreader.HeartbeatEvent': ('smartreader.HeartbeatEvent', 'received_at', {}),
+    'smartreader.ConnectionEvent': ('smartreader.ConnectionEvent', 'timestamp', {}),
+    'smartreader.DisconnectionEvent': ('smartreader.DisconnectionEvent', 'timestamp', {}),
+    'smartreader.InventoryStatusEvent': ('smartreader.InventoryStatusEvent', 'timestamp', {}),
+    'smartreader.GPIEvent': ('smartreader.GPIEvent', 'timestamp', {}),
+}
+
+
+def model_choices():
+    return [(label, label) for label in RETAINED_MODELS]
+
+
+def retention_days():
+    """Days to keep per model label, from the settings overridden by the RetentionPolicy rows."""
+    from .models import RetentionPolicy
+
+    days = {label: keep_days for label, keep_days in settings.RETENTION_POLICIES.items() if label in RETAINED_MODELS}
+    for policy in RetentionPolicy.objects.all():
+        if policy.enabled:
+            days[policy.model] = policy.keep_days
+        else:
+            days.pop(policy.model, None)
+    return days
+
+
+def purge(label, cutoff, batch_size=None, max_batches=None, pause=None):
+    """Delete rows of ``label`` older than ``cutoff`` a batch at a time. Returns the number of deleted rows."""
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    max_batches = max_batches or settings.RETENTION_MAX_BATCHES
+    pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+
+    model_label, age_field, filters = RETAINED_MODELS[label]
+    model = apps.get_model(model_label)
+    expired = {f'{age_field}__lt': cutoff, **filters}
+    deleted = 0
+    for batch in range(max_batches):
+        ids = list(model._base_manager.filter(**expired).order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        # Repeating the age filter lets a partitioned table prune the partitions it scans
+        deleted += model._base_manager.filter(pk__in=ids, **expired).delete()[1].get(model_label, 0)
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def enforce_retention(now=None):
+    """Apply every retention policy, returns the number of deleted rows per model label."""
+    from .models import RetentionPolicy
+
+    now = now or timezone.now()
+    results = {}
+    for label, keep_days in retention_days().items():
+        if keep_days <= 0:
+            continue
+        try:
+            results[label] = purge(label, now - timedelta(days=keep_days))
+        except Exception as e:
+            logger.error(f"Retention of {label} failed: {e}", exc_info=True)
+            continue
+        RetentionPolicy.objects.filter(model=label).update(last_run_at=now, last_deleted=results[label])
+        if results[label]:
+            logger.info(f"Retention deleted {results[label]} {label} rows older than {keep_days} days")
+    return results
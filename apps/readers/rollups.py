@@ -0,0 +1,120 @@
+# readers/rollups.py
+"""
+Incrementally maintained tag read rollups.
+
+Every chunk written by ingest_pipeline.sink is folded into TagReadRollup rows
+per minute, hour and day, reader and antenna: read count, unique EPCs and
+RSSI min/max/sum/count. The raw reads are counted, so the figures are the
+same with or without the dedup window.
+
+A chunk touches a handful of rollups. They are created when missing, locked
+in primary key order and incremented in one transaction, so several workers
+can ingest the same reader. unique_epcs is estimated from a HyperLogLog
+sketch kept on the rollup (see epc_sketch.py), no row is written per EPC.
+The dashboard and reports read these tables instead of scanning TagEvent.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .epc_sketch import EpcSketch
+from .models import TagReadRollup
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = (TagReadRollup.MINUTE, TagReadRollup.HOUR, TagReadRollup.DAY)
+
+
+def bucket_start(moment, granularity):
+    moment = moment.astimezone(timezone.utc)
+    if granularity == TagReadRollup.MINUTE:
+        return moment.replace(second=0, microsecond=0)
+    if granularity == TagReadRollup.HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate(tag_events):
+    """Fold tag events into ``{(granularity, bucket, reader_id, antenna_port): totals}``."""
+    totals = {}
+    for tag_event in tag_events:
+        timestamp = tag_event.timestamp
+        if not isinstance(timestamp, datetime):
+            continue
+        rssi = tag_event.peak_rssi_cdbm
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), tag_event.reader_id, tag_event.antenna_port or 0)
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = {'read_count': 0, 'epcs': set(), 'rssi_min': None, 'rssi_max': None, 'rssi_sum': 0, 'rssi_count': 0}
+            total['read_count'] += 1
+            total['epcs'].add(tag_event.epc)
+            if rssi is not None:
+                total['rssi_min'] = rssi if total['rssi_min'] is None else min(total['rssi_min'], rssi)
+                total['rssi_max'] = rssi if total['rssi_max'] is None else max(total['rssi_max'], rssi)
+                total['rssi_sum'] += rssi
+                total['rssi_count'] += 1
+    return totals
+
+
+def record(tag_events):
+    """Add a chunk of tag reads to the rollups. Returns the number of rollups updated."""
+    totals = aggregate(tag_events)
+    if not totals:
+        return 0
+
+    with transaction.atomic():
+        TagReadRollup.objects.bulk_create(
+            [TagReadRollup(granularity=key[0], bucket=key[1], reader_id=key[2], antenna_port=key[3]) for key in totals],
+            ignore_conflicts=True,
+        )
+        # Locking in id order keeps concurrent writers from deadlocking
+        query = None
+        for granularity, buckets in _keys_by_granularity(totals).items():
+            condition = TagReadRollup.objects.filter(granularity=granularity, bucket__in=buckets['buckets'], reader_id__in=buckets['readers'])
+            query = condition if query is None else query | condition
+        rollups = {
+            (rollup.granularity, rollup.bucket, rollup.reader_id, rollup.antenna_port): rollup
+            for rollup in query.select_for_update().order_by('id')
+        }
+        rollups = {key: rollups[key] for key in totals if key in rollups}
+
+        for key, rollup in rollups.items():
+            total = totals[key]
+            sketch = EpcSketch(rollup.epc_sketch)
+            sketch.update(total['epcs'])
+            rollup.epc_sketch = sketch.to_bytes()
+            rollup.read_count += total['read_count']
+            rollup.unique_epcs = sketch.estimate()
+            rollup.rssi_sum += total['rssi_sum']
+            rollup.rssi_count += total['rssi_count']
+            if total['rssi_min'] is not None:
+                rollup.rssi_min = total['rssi_min'] if rollup.rssi_min is None else min(rollup.rssi_min, total['rssi_min'])
+                rollup.rssi_max = total['rssi_max'] if rollup.rssi_max is None else max(rollup.rssi_max, total['rssi_max'])
+        TagReadRollup.objects.bulk_update(
+            rollups.values(), ['read_count', 'unique_epcs', 'epc_sketch', 'rssi_min', 'rssi_max', 'rssi_sum', 'rssi_count'],
+        )
+    return len(rollups)
+
+
+def _keys_by_granularity(totals):
+    keys = defaultdict(lambda: {'buckets': set(), 'readers': set()})
+    for granularity, bucket, reader_id, antenna_port in totals:
+        keys[granularity]['buckets'].add(bucket)
+        keys[granularity]['readers'].add(reader_id)
+    return keys
+
+
+def read_count_since(since):
+    """Tag reads from ``since`` on, from the minute rollups."""
+    rollups = TagReadRollup.objects.filter(granularity=TagReadRollup.MINUTE, bucket__gte=bucket_start(since, TagReadRollup.MINUTE))
+    return rollups.aggregate(total=Sum('read_count'))['total'] or 0
+
+
+def active_reader_ids(since):
+    """Ids of the readers with tag reads from ``since`` on, from the minute rollups."""
+    rollups = TagReadRollup.objects.filter(granularity=TagReadRollup.MINUTE, bucket__gte=bucket_start(since, TagReadRollup.MINUTE))
+    return rollups.values('reader').distinct()
@@ -0,0 +1,11 @@
+# readers/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import identity_cache
+from .models import Reader
+
+
+@receiver([post_save, post_delete], sender=Reader)
+def invalidate_reader_identity_cache(sender, instance, **kwargs):
+    identity_cache.invalidate()
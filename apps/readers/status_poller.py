@@ -0,0 +1,68 @@
+# readers/status_poller.py
+"""
+Background polling of the reader fleet status.
+
+``poll`` GETs ``/api/v1/status`` from every reader concurrently through
+reader_api.fan_out and stores the result in ReaderStatusSnapshot, one row per
+reader upserted in a single ``bulk_create(update_conflicts=True)``: whether
+the reader answered, its active preset, the latency and the error if any. An
+unreachable reader keeps its last known status and preset.
+
+The poll_reader_status beat task runs it every
+``READER_STATUS_POLL_INTERVAL`` seconds. The requests are spread over
+``READER_STATUS_POLL_JITTER`` seconds so the fleet is not hit in one burst,
+the delays are waited before submitting them and do not hold a pool thread.
+The reader list and the dashboard read the snapshots instead of calling the
+readers.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import reader_api
+from .models import Reader, ReaderStatusSnapshot
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FIELDS = ['reachable', 'active_preset_id', 'status', 'latency_ms', 'error', 'checked_at', 'last_reachable_at']
+
+
+def poll(readers=None, jitter=None, max_workers=None):
+    """Poll the status of ``readers``, all of them by default. Returns their new snapshots."""
+    readers = list(Reader.objects.all() if readers is None else readers)
+    jitter = settings.READER_STATUS_POLL_JITTER if jitter is None else jitter
+    previous = {snapshot.reader_id: snapshot for snapshot in ReaderStatusSnapshot.objects.filter(reader__in=readers)}
+
+    def get_status(client, reader):
+        started = time.monotonic()
+        response = client.get_status()
+        response.raise_for_status()
+        return response.json(), time.monotonic() - started
+
+    snapshots = []
+    for reader, result, error, seconds in reader_api.fan_out(readers, get_status, max_workers=max_workers, stagger=jitter):
+        now = timezone.now()
+        snapshot = previous.get(reader.pk) or ReaderStatusSnapshot(reader=reader)
+        snapshot.reader = reader
+        snapshot.checked_at = now
+        if error is None:
+            status, latency = result
+            snapshot.reachable = True
+            snapshot.status = status
+            snapshot.active_preset_id = (status.get('activePreset') or {}).get('id', '') if isinstance(status, dict) else ''
+            snapshot.latency_ms = round(latency * 1000)
+            snapshot.error = ''
+            snapshot.last_reachable_at = now
+        else:
+            snapshot.reachable = False
+            snapshot.latency_ms = None
+            snapshot.error = str(error)
+        snapshots.append(snapshot)
+
+    ReaderStatusSnapshot.objects.bulk_create(snapshots, update_conflicts=True, unique_fields=['reader'], update_fields=SNAPSHOT_FIELDS)
+    unreachable = sum(1 for snapshot in snapshots if not snapshot.reachable)
+    if unreachable:
+        logger.warning(f"{unreachable} of {len(snapshots)} readers did not answer the status poll")
+    return snapshots
@@ -0,0 +1,58 @@
+# readers/task_publisher.py
+"""
+Celery task publishing for async views.
+
+``Task.delay`` blocks on the broker and, by default, checks a connection out
+of the producer pool for every call. Async views instead hand the publish to
+a TaskPublisher, which keeps one broker connection and channel open on a
+dedicated thread, so the event loop is never blocked and no request pays for
+a connection handshake. The connection is re-established after an error.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class TaskPublisher:
+    """Publishes Celery tasks over one persistent connection from a single thread."""
+
+    def __init__(self, name='task-publisher'):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._connection = None
+        self._producer = None
+
+    async def publish(self, task, *args, **kwargs):
+        """Send ``task`` to the broker without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._publish, task, args, kwargs)
+
+    def _publish(self, task, args, kwargs):
+        try:
+            return task.apply_async(args, kwargs, producer=self._get_producer())
+        except Exception:
+            # Drop the connection, the next publish opens a fresh one
+            self._close()
+            raise
+
+    def _get_producer(self):
+        if self._producer is None:
+            self._connection = current_app.connection_for_write()
+            self._producer = current_app.amqp.Producer(self._connection)
+        return self._producer
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.release()
+            except Exception as e:
+                logger.warning(f"Error closing broker connection: {e}")
+        self._connection = None
+        self._producer = None
+
+
+# Shared by the async webhook views of the process
+webhook_publisher = TaskPublisher(name='webhook-publisher')
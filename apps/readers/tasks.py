@@ -1,187 +1,160 @@
 from celery import shared_task
-from .models import Reader, TagEvent, TagTraceability, ReadPoint, MqttTemplate, MQTTTemplateApplicationResult, WebhookTemplate, WebhookTemplateApplicationResult
-from datetime import datetime
+from . import identity_cache, ingest_pipeline, partitions, presence, preset_discovery, preset_rollout, retention, status_poller, template_deployment
+from .models import PresetRollout, Reader, TagEvent, TagTraceability, ReadPoint, TemplateDeployment
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-import base64
-import requests
+from datetime import timedelta
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 #@shared_task(queue='webhook_queue')
 @shared_task(name='process_webhook')
 def process_webhook(data):
-    for event in data:
-        if event.get('eventType') == 'tagInventory':
-            tag_inventory = event.get('tagInventoryEvent')
-            if tag_inventory:
-                # Determine the reader based on hostname if provided
-                reader = None
-                hostname = event.get('hostname')
-                if hostname:
-                    try:
-                        reader = Reader.objects.get(name=hostname)
-                    except Reader.DoesNotExist:
-                        # Create or use a default reader if not found
-                        reader, created = Reader.objects.get_or_create(serial_number='default-serial-number', defaults={'name': 'Default Reader'})
-
-                # Handle EPC, checking for either Base64 or Hex format
-                epc_hex = None
-                epc_base64 = tag_inventory.get('epc')
-                if epc_base64:
-                    epc_hex = base64.b64decode(epc_base64).hex().upper()
-                else:
-                    epc_hex = tag_inventory.get('epcHex')
-
-                if epc_hex:
-                    timestamp = event.get('timestamp')
-
-                    # Parse optional fields
-                    antenna_port = tag_inventory.get('antennaPort')
-                    antenna_name = tag_inventory.get('antennaName')
-                    peak_rssi_cdbm = tag_inventory.get('peakRssiCdbm')
-                    frequency = tag_inventory.get('frequency')
-                    transmit_power_cdbm = tag_inventory.get('transmitPowerCdbm')
-                    last_seen_time_str = tag_inventory.get('lastSeenTime')
-                    tid_base64 = tag_inventory.get('tid')
-                    tid_hex = tag_inventory.get('tidHex')
-
-                    # Convert last seen time to datetime object if present
-                    last_seen_time = None
-                    if last_seen_time_str:
-                        try:
-                            last_seen_time = datetime.fromisoformat(last_seen_time_str.replace('Z', '+00:00'))
-                        except ValueError:
-                            last_seen_time = None
-
-                    # Decode tid from base64 if provided
-                    if tid_base64 and not tid_hex:
-                        tid_hex = base64.b64decode(tid_base64).hex().upper()
-
-                    # Store the data in the database
-                    tag_event = TagEvent.objects.create(
-                        reader=reader,
-                        epc=epc_hex,  # Store the hexadecimal EPC
-                        timestamp=timestamp,
-                        antenna_port=antenna_port if antenna_port is not None and antenna_port > 0 else None,
-                        antenna_name=antenna_name,
-                        peak_rssi_cdbm=peak_rssi_cdbm if peak_rssi_cdbm is not None and peak_rssi_cdbm < 0 else None,
-                        frequency=frequency if frequency is not None and frequency > 0 else None,
-                        transmit_power_cdbm=transmit_power_cdbm if transmit_power_cdbm is not None and transmit_power_cdbm > 0 else None,
-                        last_seen_time=last_seen_time,
-                        tid=tid_base64,
-                        tid_hex=tid_hex
-                    )
-
-                    try:
-                        from .tasks import process_tag_event
-                        process_tag_event.delay(tag_event.id)
-                    except:
-                        pass
+    # Normalize the whole payload through the shared pipeline, then write it in chunks so
+    # a large POST costs one INSERT and one broker message per chunk instead of per tag
+    return len(ingest_pipeline.sink(build_tag_events(data)))
 
+@shared_task(name='process_webhook_raw')
+def process_webhook_raw(body):
+    """Parse a webhook body the receiver enqueued unparsed and process its events."""
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Discarding webhook payload that is not valid JSON: {e}")
+        return 0
+    # A single event may be posted without the surrounding array
+    if isinstance(data, dict):
+        data = [data]
+    return process_webhook(data)
+
+def build_tag_events(data):
+    """Build unsaved TagEvent instances for every tagInventory event in a webhook payload."""
+    return ingest_pipeline.normalize(((None, event) for event in data), _resolve_webhook_reader)
+
+def _resolve_webhook_reader(read_format, source, event):
+    # Determine the reader based on hostname
+    hostname = event.get('hostname')
+    if not hostname:
+        return None
+    # Create or use a default reader if not found
+    return identity_cache.get_reader_by_name(hostname) or identity_cache.get_default_reader()
+
+
+@shared_task(name='deploy_template')
+def deploy_template(kind, template_id, reader_ids=None):
+    """Push a webhook or MQTT template to all its readers, or to ``reader_ids``, in one job."""
+    deployment = template_deployment.deploy(kind, template_id, reader_ids)
+    return {'deployment': deployment.id, 'succeeded': deployment.succeeded, 'failed': deployment.failed}
 
 #@shared_task(bind=True, queue='webhook_settings_queue')
 @shared_task(name='process_webhook_settings')
 def process_webhook_settings(template_id, reader_id):
-    try:
-        template = WebhookTemplate.objects.get(id=template_id)
-        reader = Reader.objects.get(id=reader_id)
-        url = f"https://{reader.ip_address}:{reader.port}/api/v1/webhooks/event"
-        auth = (reader.username, reader.password)
-        response = requests.put(url, json=template.content, auth=auth, headers={'Content-Type': 'application/json'}, verify=False)
-        response.raise_for_status()
-
-        # Save success result
-        WebhookTemplateApplicationResult.objects.create(
-            template=template,
-            reader=reader,
-            success=True,
-            response_message=response.text
-        )
-    except Exception as e:
-        # Save failure result
-        WebhookTemplateApplicationResult.objects.create(
-            template=template,
-            reader=reader,
-            success=False,
-            response_message=str(e)
-        )
-        # Retry if the retry flag is true
-        raise self.retry(exc=e, countdown=60)
+    # Kept for retries of a single reader and for messages queued before deployments
+    return deploy_template(TemplateDeployment.WEBHOOK, template_id, [reader_id])
 
 #@shared_task(bind=True, queue='mqtt_settings_queue')
 @shared_task(name='process_mqtt_settings')
 def process_mqtt_settings(template_id, reader_id):
-    try:
-        template = MqttTemplate.objects.get(id=template_id)
-        reader = Reader.objects.get(id=reader_id)
-        url = f"https://{reader.ip_address}:{reader.port}/api/v1/mqtt"
-        auth = (reader.username, reader.password)
-        response = requests.put(url, json=template.content, auth=auth, headers={'Content-Type': 'application/json'}, verify=False)
-        response.raise_for_status()
-
-        # Save success result
-        MQTTTemplateApplicationResult.objects.create(
-            template=template,
-            reader=reader,
-            success=True,
-            response_message=response.text
-        )
-    except Exception as e:
-        # Save failure result
-        MQTTTemplateApplicationResult.objects.create(
-            template=template,
-            reader=reader,
-            success=False,
-            response_message=str(e)
-        )
-        # Retry if the retry flag is true
-        raise self.retry(exc=e, countdown=60)
+    # Kept for retries of a single reader and for messages queued before deployments
+    return deploy_template(TemplateDeployment.MQTT, template_id, [reader_id])
     
-@shared_task
-def process_departure_time():
+@shared_task(name='process_departure_time')
+def process_departure_time(chunk_size=None):
+    """
+    Close the traceability rows of tags not seen within their read point's timeout.
+
+    Rows are closed with set-based UPDATEs, one read point and one chunk of ids
+    at a time, and depart at last_seen + timeout like in presence.py. The
+    presence ticker closes rows within a second, this sweep catches those left
+    behind while it was not running.
+    """
+    chunk_size = chunk_size or settings.TRACEABILITY_SWEEP_CHUNK_SIZE
+    started = time.monotonic()
     now = timezone.now()
-    traceabilities = TagTraceability.objects.filter(departed_at__isnull=True)
-    
-    for traceability in traceabilities:
-        timeout = timedelta(seconds=traceability.read_point.timeout_seconds)
-        if now - traceability.arrived_at > timeout:
-            traceability.update_departure()
-
-@shared_task
+    closed = 0
+    for read_point_id, timeout_seconds in ReadPoint.objects.values_list('id', 'timeout_seconds'):
+        timeout = timedelta(seconds=timeout_seconds)
+        cutoff = now - timeout
+        # Served by the partial index on open rows (read_point, last_seen)
+        expired = TagTraceability.objects.filter(read_point_id=read_point_id, departed_at__isnull=True).filter(
+            Q(last_seen__lt=cutoff) | Q(last_seen__isnull=True, arrived_at__lt=cutoff)
+        )
+        last_id = 0
+        while True:
+            # Keyset pagination on id, each chunk is one short UPDATE
+            ids = list(expired.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            closed += TagTraceability.objects.filter(id__in=ids, departed_at__isnull=True).update(
+                departed_at=Coalesce('last_seen', 'arrived_at') + timeout
+            )
+            last_id = ids[-1]
+            if len(ids) < chunk_size:
+                break
+
+    duration = time.monotonic() - started
+    if closed:
+        logger.info(f"Departure sweep closed {closed} traceability rows in {duration:.2f}s")
+    return {'closed': closed, 'duration': round(duration, 3)}
+
+@shared_task(name='process_tag_event')
 def process_tag_event(tag_event_id):
+    process_tag_event_batch([tag_event_id])
+
+@shared_task(name='process_tag_event_batch')
+def process_tag_event_batch(tag_event_ids):
+    """Update traceability for a chunk of tag events handed off by a batched ingest."""
+    tag_events = (
+        TagEvent.objects.filter(id__in=tag_event_ids)
+        .select_related('reader')
+        .prefetch_related('reader__read_points')
+    )
     try:
-        tag_event = TagEvent.objects.get(id=tag_event_id)
-        read_point = tag_event.reader.read_point  # Assuming a Reader is associated with a ReadPoint
-        timeout = read_point.timeout  # Get the timeout value from the ReadPoint
-
-        # Check if there's an existing traceability record for this EPC at this read point
-        traceability, created = TagTraceability.objects.get_or_create(
-            epc=tag_event.epc, 
-            read_point=read_point,
-            defaults={
-                'arrived_at': tag_event.timestamp, 
-                'last_seen': tag_event.timestamp, 
-                'departed_at': None
-            }
-        )
-
-        if not created:
-            # If the tag was seen before the timeout expired, update the last seen time
-            if traceability.departed_at is None and (tag_event.timestamp - traceability.last_seen).total_seconds() <= timeout:
-                traceability.last_seen = tag_event.timestamp
-                traceability.save()
-            else:
-                # If the timeout expired, update the departure time and create a new arrival event
-                if traceability.departed_at is None:
-                    traceability.departed_at = traceability.last_seen + timezone.timedelta(seconds=timeout)
-                    traceability.save()
-
-                # Now treat this event as a new arrival
-                traceability.arrived_at = tag_event.timestamp
-                traceability.last_seen = tag_event.timestamp
-                traceability.departed_at = None
-                traceability.save()
-
-        # Optionally, you might want to handle cases where there is no subsequent event, 
-        # and a background task might update the departure time after the timeout.
-
-    except TagEvent.DoesNotExist:
-        pass  # Handle the case where the TagEvent doesn't exist
\ No newline at end of file
+        presence.tracker.start()
+        presence.tracker.observe(tag_events)
+    except Exception as e:
+        logger.error(f"Failed to update traceability for {len(tag_event_ids)} tag events: {e}", exc_info=True)
+
+@shared_task(name='flush_presence')
+def flush_presence():
+    """Write the last_seen values the presence tracker holds in memory, starting its ticker after a restart."""
+    presence.tracker.start()
+    return presence.tracker.flush(force=True)
+
+@shared_task(name='run_preset_rollout')
+def run_preset_rollout(rollout_id):
+    """Push and start, or stop, a preset on every reader of a rollout."""
+    preset_rollout.run(PresetRollout.objects.get(pk=rollout_id))
+
+@shared_task(name='sync_presets')
+def sync_presets(reader_ids=None):
+    """Sync the presets of the given readers, or of all of them, concurrently."""
+    readers = Reader.objects.all() if reader_ids is None else Reader.objects.filter(id__in=reader_ids)
+    results = preset_discovery.sync_readers(readers)
+    failed = [reader_id for reader_id, counts in results.items() if counts is None]
+    logger.info(f"Presets synced from {len(results) - len(failed)} readers, {len(failed)} failed")
+    return {'synced': len(results) - len(failed), 'failed': failed}
+
+@shared_task(name='poll_reader_status')
+def poll_reader_status():
+    """Refresh the status snapshot of every reader."""
+    snapshots = status_poller.poll()
+    return {'polled': len(snapshots), 'unreachable': sum(1 for snapshot in snapshots if not snapshot.reachable)}
+
+@shared_task(name='maintain_tag_event_partitions')
+def maintain_tag_event_partitions():
+    """Create upcoming TagEvent partitions and remove expired ones."""
+    created, removed = partitions.maintain_partitions()
+    if created or removed:
+        logger.info(f"TagEvent partitions created: {created}, removed: {removed}")
+    return {'created': created, 'removed': removed}
+
+@shared_task(name='enforce_retention')
+def enforce_retention():
+    """Delete rows past their retention period, in bounded batches."""
+    return retention.enforce_retention()
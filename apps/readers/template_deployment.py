@@ -0,0 +1,65 @@
+# readers/template_deployment.py
+"""
+Deployment of webhook and MQTT templates to their readers.
+
+Saving a template queues one deploy_template task. ``deploy`` loads the
+template and its readers once, PUTs the content to all readers concurrently
+through reader_api.fan_out (at most ``READER_API_CONCURRENCY`` at a time over
+the pooled sessions) and writes the application results with one
+``bulk_create``. The TemplateDeployment row records the progress while it
+runs, and the timing.
+"""
+import logging
+import time
+
+from django.utils import timezone
+
+from . import reader_api
+from .models import MqttTemplate, MQTTTemplateApplicationResult, Reader, TemplateDeployment, WebhookTemplate, WebhookTemplateApplicationResult
+
+logger = logging.getLogger(__name__)
+
+# Kind -> (template model, result model, ReaderClient method, TemplateDeployment field)
+KINDS = {
+    TemplateDeployment.WEBHOOK: (WebhookTemplate, WebhookTemplateApplicationResult, 'put_webhook', 'webhook_template'),
+    TemplateDeployment.MQTT: (MqttTemplate, MQTTTemplateApplicationResult, 'put_mqtt', 'mqtt_template'),
+}
+
+
+def deploy(kind, template_id, reader_ids=None, max_workers=None):
+    """Push a template to its readers, or to ``reader_ids`` only. Returns the finished TemplateDeployment."""
+    template_model, result_model, method, field = KINDS[kind]
+    template = template_model.objects.get(pk=template_id)
+    readers = list(template.readers.all() if reader_ids is None else Reader.objects.filter(pk__in=reader_ids))
+    deployment = TemplateDeployment.objects.create(kind=kind, total=len(readers), **{field: template})
+
+    def push(client, reader):
+        response = getattr(client, method)(template.content)
+        response.raise_for_status()
+        return response
+
+    results = []
+    reported_at = time.monotonic()
+    for reader, response, error, seconds in reader_api.fan_out(readers, push, max_workers=max_workers):
+        if error is None:
+            deployment.succeeded += 1
+        else:
+            deployment.failed += 1
+            logger.warning(f"Failed to apply {kind} template {template.name} to reader {reader.name}: {error}")
+        results.append(result_model(
+            template=template, reader=reader, deployment=deployment, success=error is None,
+            response_message=response.text if error is None else str(error), duration_ms=round(seconds * 1000),
+        ))
+        if time.monotonic() - reported_at >= 1:
+            TemplateDeployment.objects.filter(pk=deployment.pk).update(succeeded=deployment.succeeded, failed=deployment.failed)
+            reported_at = time.monotonic()
+
+    result_model.objects.bulk_create(results)
+    deployment.status = TemplateDeployment.FINISHED
+    deployment.finished_at = timezone.now()
+    deployment.save(update_fields=['status', 'finished_at', 'succeeded', 'failed'])
+    logger.info(
+        f"Deployed {kind} template {template.name} to {deployment.succeeded} of {deployment.total} readers "
+        f"in {deployment.duration.total_seconds():.2f}s"
+    )
+    return deployment
@@ -1,5 +1,26 @@
-from django.test import TestCase
-from .models import Reader, TagEvent
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+import json
+import requests
+from . import preset_discovery, preset_rollout, reader_api, status_poller, template_deployment
+from .dedup_window import DedupWindow, read_window
+from .epc_sketch import EpcSketch
+from .identity_cache import TTLCache
+from .ingest_pipeline import normalize
+from .management.commands.benchmark_tag_decoding import decode_per_read, decode_with_pipeline, field_values, synthetic_webhook_payload
+from .models import Location, Preset, PresetRollout, ReadPoint, Reader, ReaderStatusSnapshot, RetentionPolicy, TagEvent, TagReadRollup, TagTraceability, TemplateDeployment, WebhookTemplate
+from .partitions import missing_ranges, partition_name, period_start
+from .presence import PresenceTracker
+from .retention import enforce_retention
+from .tag_decoding import decode_base64_hex
+from .tasks import process_departure_time, process_webhook
+from .timer_wheel import TimerWheel
+from .views import sniff_webhook_body
 
 class ReaderModelTest(TestCase):
 
@@ -42,3 +63,597 @@ class TagEventModelTest(TestCase):
         self.assertEqual(self.tag_event.reader.name, "Test Reader")
         self.assertEqual(self.tag_event.epc, "E2003412012345678900")
         self.assertEqual(self.tag_event.timestamp.isoformat(), "2024-08-09T17:44:30.659000+00:00")
+
+
+class ProcessWebhookTest(TestCase):
+
+    def setUp(self):
+        self.reader = Reader.objects.create(
+            serial_number="123-ABC-456",
+            name="Test Reader",
+            ip_address="192.168.1.1",
+            port=8080,
+            username="admin",
+            password="password"
+        )
+
+    def _tag_inventory_event(self, epc_hex):
+        return {
+            "timestamp": "2024-08-09T17:44:30.659Z",
+            "hostname": "Test Reader",
+            "eventType": "tagInventory",
+            "tagInventoryEvent": {
+                "epcHex": epc_hex,
+                "antennaPort": 1,
+                "peakRssiCdbm": -5400,
+            },
+        }
+
+    @mock.patch("apps.readers.tasks.process_tag_event_batch")
+    def test_payload_is_written_in_chunks(self, batch_task):
+        payload = [self._tag_inventory_event(f"E2003412{i:012d}") for i in range(5)]
+        payload.append({"eventType": "inventoryStatus"})
+
+        with self.settings(WEBHOOK_BATCH_SIZE=2):
+            self.assertEqual(process_webhook(payload), 5)
+
+        self.assertEqual(TagEvent.objects.filter(reader=self.reader).count(), 5)
+        self.assertEqual(batch_task.delay.call_count, 3)
+
+    @mock.patch("apps.readers.tasks.process_tag_event_batch")
+    def test_reads_without_a_valid_timestamp_are_skipped(self, batch_task):
+        missing = self._tag_inventory_event("E2003412000000000002")
+        del missing["timestamp"]
+        invalid = self._tag_inventory_event("E2003412000000000003")
+        invalid["timestamp"] = "yesterday"
+
+        self.assertEqual(process_webhook([self._tag_inventory_event("E2003412000000000001"), missing, invalid]), 1)
+        self.assertEqual(list(TagEvent.objects.values_list("epc", flat=True)), ["E2003412000000000001"])
+
+    @mock.patch("apps.readers.tasks.process_tag_event_batch")
+    def test_repeated_reads_are_collapsed_in_the_dedup_window(self, batch_task):
+        read_window.clear()
+        self.addCleanup(read_window.clear)
+        repeated = self._tag_inventory_event("E20034120000000000000001")
+        repeated.update(timestamp="2024-08-09T17:44:33Z")
+        repeated["tagInventoryEvent"]["peakRssiCdbm"] = -4100
+        later = self._tag_inventory_event("E20034120000000000000001")
+        later.update(timestamp="2024-08-09T17:44:45Z")
+
+        with self.settings(INGEST_DEDUP_WINDOW_SECONDS=10):
+            self.assertEqual(process_webhook([self._tag_inventory_event("E20034120000000000000001"), repeated]), 1)
+            # The read of a later payload updates the saved event of the open window
+            self.assertEqual(process_webhook([repeated]), 0)
+            self.assertEqual(process_webhook([later]), 1)
+
+        first, second = TagEvent.objects.order_by("timestamp")
+        self.assertEqual((first.read_count, first.peak_rssi_cdbm), (3, -4100))
+        self.assertEqual(first.last_seen_time.isoformat(), "2024-08-09T17:44:33+00:00")
+        self.assertEqual(second.read_count, 1)
+        self.assertEqual(batch_task.delay.call_args_list[1], mock.call([first.id]))
+
+    @mock.patch("apps.readers.tasks.process_tag_event_batch")
+    def test_reads_are_added_to_the_rollups(self, batch_task):
+        payload = [self._tag_inventory_event(epc_hex) for epc_hex in ("E2003412000000000001", "E2003412000000000001", "E2003412000000000002")]
+        payload[1]["tagInventoryEvent"]["peakRssiCdbm"] = -4100
+
+        process_webhook(payload)
+        process_webhook(payload[:1])
+
+        rollup = TagReadRollup.objects.get(granularity=TagReadRollup.HOUR)
+        self.assertEqual(rollup.bucket.isoformat(), "2024-08-09T17:00:00+00:00")
+        self.assertEqual((rollup.reader, rollup.antenna_port), (self.reader, 1))
+        self.assertEqual((rollup.read_count, rollup.unique_epcs), (4, 2))
+        self.assertEqual((rollup.rssi_min, rollup.rssi_max, rollup.rssi_avg), (-5400, -4100, -5075))
+        self.assertEqual(TagReadRollup.objects.filter(granularity=TagReadRollup.MINUTE).count(), 1)
+
+    def test_epc_sketch_estimates_unique_epcs(self):
+        sketch = EpcSketch()
+        sketch.update(f"E2003412{number:012d}" for number in range(20000))
+        restored = EpcSketch(sketch.to_bytes())
+        self.assertEqual(restored.estimate(), sketch.estimate())
+        self.assertAlmostEqual(restored.estimate(), 20000, delta=20000 * 0.05)
+        restored.update(["E2003412000000000001", "E2003412000000000002"])
+        self.assertEqual(restored.estimate(), sketch.estimate())
+
+
+class DepartureSweepTest(TestCase):
+
+    def test_rows_past_their_timeout_are_closed_in_chunks(self):
+        read_point = ReadPoint.objects.create(name="Dock", timeout_seconds=60)
+        location = Location.objects.create(name="Warehouse")
+        now = datetime.now(timezone.utc)
+        stale = TagTraceability.objects.create(epc="E2801100", read_point=read_point, location=location, arrived_at=now - timedelta(minutes=5), last_seen=now - timedelta(minutes=2))
+        never_seen = TagTraceability.objects.create(epc="E2801101", read_point=read_point, location=location, arrived_at=now - timedelta(minutes=5))
+        present = TagTraceability.objects.create(epc="E2801102", read_point=read_point, location=location, arrived_at=now - timedelta(minutes=5), last_seen=now - timedelta(seconds=10))
+
+        result = process_departure_time(chunk_size=1)
+
+        self.assertEqual(result["closed"], 2)
+        stale.refresh_from_db()
+        never_seen.refresh_from_db()
+        present.refresh_from_db()
+        self.assertEqual(stale.departed_at, stale.last_seen + timedelta(seconds=60))
+        self.assertEqual(never_seen.departed_at, never_seen.arrived_at + timedelta(seconds=60))
+        self.assertIsNone(present.departed_at)
+        self.assertEqual(process_departure_time()["closed"], 0)
+
+
+class PresenceTrackerTest(TestCase):
+
+    def setUp(self):
+        self.reader = Reader.objects.create(serial_number="123-ABC-456", name="Test Reader", ip_address="192.168.1.1", port=8080, username="admin", password="password")
+        self.location = Location.objects.create(name="Warehouse")
+        read_point = ReadPoint.objects.create(name="Dock", timeout_seconds=60, location=self.location)
+        read_point.readers.add(self.reader)
+        self.start = datetime.now(timezone.utc) - timedelta(minutes=10)
+
+    def _observe(self, tracker, *seconds):
+        tag_events = [TagEvent.objects.create(reader=self.reader, epc="E2801100", timestamp=self.start + timedelta(seconds=offset)) for offset in seconds]
+        tracker.observe(TagEvent.objects.filter(id__in=[tag_event.id for tag_event in tag_events]).select_related("reader").prefetch_related("reader__read_points"))
+
+    def test_only_transitions_are_written_until_flush(self):
+        tracker = PresenceTracker(flush_interval=3600)
+        self._observe(tracker, 0, 10)
+        self._observe(tracker, 20)
+
+        # The arrival is inserted with the reads of its batch, later reads wait for the flush
+        row = TagTraceability.objects.get()
+        self.assertEqual((row.arrived_at, row.last_seen, row.location), (self.start, self.start + timedelta(seconds=10), self.location))
+        self.assertEqual(tracker.flush(force=True), 1)
+        row.refresh_from_db()
+        self.assertEqual(row.last_seen, self.start + timedelta(seconds=20))
+
+        # More than the timeout after the last read: departure and new arrival
+        self._observe(tracker, 200)
+        departed, arrived = TagTraceability.objects.order_by("arrived_at")
+        self.assertEqual(departed.departed_at, self.start + timedelta(seconds=80))
+        self.assertEqual((arrived.arrived_at, arrived.departed_at), (self.start + timedelta(seconds=200), None))
+        self.assertEqual((tracker.arrivals, tracker.departures), (2, 1))
+
+        # Open rows are picked up again by a fresh tracker
+        fresh = PresenceTracker(flush_interval=3600)
+        self._observe(fresh, 230)
+        self.assertEqual(TagTraceability.objects.count(), 2)
+
+    def test_tags_no_longer_read_depart_when_their_timeout_expires(self):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.start = now - timedelta(seconds=30)
+        tracker = PresenceTracker(flush_interval=3600)
+        self._observe(tracker, 0)
+        self._observe(tracker, 20)
+
+        self.assertEqual(tracker.expire(now + timedelta(seconds=40)), 0)
+        self.assertEqual(tracker.expire(now + timedelta(seconds=51)), 1)
+        row = TagTraceability.objects.get()
+        self.assertEqual((row.last_seen, row.departed_at), (self.start + timedelta(seconds=20), self.start + timedelta(seconds=80)))
+        self.assertEqual(len(tracker), 0)
+
+        # A restarted tracker reloads the open rows and closes what expired meanwhile
+        self._observe(PresenceTracker(), 100)
+        restarted = PresenceTracker()
+        self.assertEqual(restarted.rebuild(), 1)
+        self.assertEqual(restarted.expire(now + timedelta(seconds=200)), 1)
+        self.assertFalse(TagTraceability.objects.filter(departed_at__isnull=True).exists())
+
+
+class ReaderApiTest(TestCase):
+
+    def setUp(self):
+        self.reader = Reader.objects.create(serial_number="123-ABC-456", name="Test Reader", ip_address="192.168.1.1", port=8080, username="admin", password="password")
+        self.addCleanup(reader_api.close_all)
+
+    def test_clients_are_pooled_per_reader(self):
+        client = reader_api.client_for(self.reader)
+        self.assertIs(reader_api.client_for(Reader.objects.get(pk=self.reader.pk)), client)
+        adapter = client.session.get_adapter("https://192.168.1.1:8080/")
+        self.assertEqual(adapter.max_retries.total, settings.READER_API_RETRIES)
+
+        with mock.patch.object(client.session, "request") as request:
+            client.start_preset("warehouse")
+        request.assert_called_once_with(
+            "POST", "https://192.168.1.1:8080/api/v1/profiles/inventory/presets/warehouse/start",
+            timeout=(settings.READER_API_CONNECT_TIMEOUT, settings.READER_API_READ_TIMEOUT),
+        )
+
+        # Changed credentials get a new session
+        self.reader.password = "changed"
+        self.assertIsNot(reader_api.client_for(self.reader), client)
+        self.assertEqual(reader_api.client_for(self.reader).session.auth, ("admin", "changed"))
+
+    def test_staggered_calls_are_delayed_before_they_reach_the_pool(self):
+        readers = [Reader(id=number, name=f"Reader {number}", ip_address=f"192.168.1.{number}", port=443) for number in range(1, 5)]
+        with mock.patch("apps.readers.reader_api.random.uniform", side_effect=[0.3, 0, 0.2, 0.1]):
+            results = [(reader.pk, result) for reader, result, error, seconds in reader_api.fan_out(readers, lambda client, reader: reader.pk, max_workers=1, stagger=1)]
+        # With one pool thread, the calls still run in the order of their delays
+        self.assertEqual(results, [(2, 2), (4, 4), (3, 3), (1, 1)])
+
+
+class PresetRolloutTest(TestCase):
+
+    def setUp(self):
+        self.readers = [
+            Reader.objects.create(serial_number=f"SN-{number}", name=f"Reader {number}", ip_address=f"192.168.1.{number}", port=443, username="admin", password="password")
+            for number in range(1, 5)
+        ]
+        self.addCleanup(reader_api.close_all)
+
+    def test_preset_is_pushed_and_started_on_every_target_reader(self):
+        location = Location.objects.create(name="Warehouse")
+        ReadPoint.objects.create(name="Dock").readers.add(self.readers[1])
+        ReadPoint.objects.create(name="Gate", location=location).readers.add(self.readers[2], self.readers[1])
+        readers = preset_rollout.target_readers([self.readers[0]], ReadPoint.objects.filter(name="Dock"), [location])
+        self.assertCountEqual(readers, self.readers[:3])
+
+        preset = Preset.objects.create(reader=self.readers[0], preset_id="fast", configuration={})
+        rollout = preset_rollout.create_rollout(PresetRollout.START, readers, preset_id="fast", configuration={"antennaConfigs": []})
+
+        def respond(client, method, path, **kwargs):
+            response = requests.Response()
+            # The start fails on the third reader
+            response.status_code = 500 if "192.168.1.3" in client.base_url and path.endswith("/start") else 204
+            return response
+
+        with mock.patch.object(reader_api.ReaderClient, "request", autospec=True, side_effect=respond) as request:
+            self.assertTrue(preset_rollout.run(rollout))
+        self.assertEqual(request.call_count, 6)
+
+        rollout.refresh_from_db()
+        self.assertEqual((rollout.status, rollout.succeeded, rollout.failed), (PresetRollout.FINISHED, 2, 1))
+        failed = rollout.results.get(success=False)
+        self.assertEqual((failed.reader, failed.step), (self.readers[2], "start"))
+        preset.refresh_from_db()
+        self.assertTrue(preset.is_active)
+        # A rollout runs once
+        self.assertFalse(preset_rollout.run(rollout))
+
+        self.client.force_login(User.objects.create_user("operator"))
+        first = rollout.results.order_by("id").first()
+        progress = self.client.get(reverse("preset_rollout_progress", args=[rollout.pk]), {"after": first.id}).json()
+        self.assertEqual((progress["finished"], progress["succeeded"], progress["failed"]), (True, 2, 1))
+        self.assertEqual(len(progress["results"]), 2)
+
+
+class PresetDiscoveryTest(TestCase):
+
+    def setUp(self):
+        self.readers = [
+            Reader.objects.create(serial_number=f"SN-{number}", name=f"Reader {number}", ip_address=f"192.168.1.{number}", port=443, username="admin", password="password")
+            for number in range(1, 3)
+        ]
+        self.addCleanup(reader_api.close_all)
+
+    def _respond(self, client, method, path, headers=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        if path == "/profiles/inventory/presets":
+            response._content = b'["default", "fast"]'
+        elif (headers or {}).get("If-None-Match") == '"v1"':
+            response.status_code = 304
+        else:
+            response._content = json.dumps({"preset": path.rsplit("/", 1)[1]}).encode()
+            # The default preset comes without an ETag
+            if not path.endswith("/default"):
+                response.headers["ETag"] = '"v1"'
+        return response
+
+    def test_presets_of_every_reader_are_upserted_and_refetched_only_when_changed(self):
+        with mock.patch.object(reader_api.ReaderClient, "request", autospec=True, side_effect=self._respond) as request:
+            results = preset_discovery.sync_readers()
+        self.assertEqual(results, {reader.pk: {"changed": 2, "unchanged": 0, "failed": 0} for reader in self.readers})
+        self.assertEqual(request.call_count, 6)
+        # Every reader keeps its own "default" preset
+        self.assertEqual(Preset.objects.filter(preset_id="default").count(), 2)
+        self.assertEqual(Preset.objects.get(reader=self.readers[0], preset_id="fast").configuration, {"preset": "fast"})
+
+        Preset.objects.filter(reader=self.readers[0], preset_id="fast").update(etag="")
+        Preset.objects.filter(reader=self.readers[0], preset_id="default").update(configuration={"preset": "edited"})
+        with mock.patch.object(reader_api.ReaderClient, "request", autospec=True, side_effect=self._respond):
+            counts = preset_discovery.sync_reader(self.readers[0])
+        self.assertEqual(counts, {"changed": 1, "unchanged": 1, "failed": 0})
+        self.assertEqual(Preset.objects.count(), 4)
+        # Same content hash: the preset without ETag keeps its local edit
+        self.assertEqual(Preset.objects.get(reader=self.readers[0], preset_id="default").configuration, {"preset": "edited"})
+
+
+class StatusPollerTest(TestCase):
+
+    def setUp(self):
+        self.readers = [
+            Reader.objects.create(serial_number=f"SN-{number}", name=f"Reader {number}", ip_address=f"192.168.1.{number}", port=443, username="admin", password="password")
+            for number in range(1, 3)
+        ]
+        self.addCleanup(reader_api.close_all)
+        self.down = {"192.168.1.2"}
+
+    def _respond(self, client, method, path, **kwargs):
+        if any(f"//{host}:" in client.base_url for host in self.down):
+            raise requests.exceptions.ConnectTimeout("timed out")
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"status": "running", "activePreset": {"id": "fast"}}'
+        return response
+
+    def test_snapshots_are_stored_and_served_without_calling_the_reader(self):
+        with mock.patch.object(reader_api.ReaderClient, "request", autospec=True, side_effect=self._respond):
+            status_poller.poll(jitter=0)
+        up, down = (ReaderStatusSnapshot.objects.get(reader=reader) for reader in self.readers)
+        self.assertEqual((up.reachable, up.active_preset_id, up.error), (True, "fast", ""))
+        self.assertEqual((down.reachable, down.last_reachable_at), (False, None))
+        self.assertIn("timed out", down.error)
+
+        # An unreachable reader keeps its last known preset
+        self.down = {"192.168.1.1"}
+        with mock.patch.object(reader_api.ReaderClient, "request", autospec=True, side_effect=self._respond) as request:
+            status_poller.poll(jitter=0)
+            self.assertEqual(self.readers[1].get_active_preset_from_status(), "fast")
+            self.assertTrue(self.readers[0].get_active_preset_from_status().startswith("Error: "))
+        self.assertEqual(request.call_count, 2)
+        up.refresh_from_db()
+        self.assertEqual((up.reachable, up.active_preset_id), (False, "fast"))
+        self.assertIsNotNone(up.last_reachable_at)
+        self.assertEqual(ReaderStatusSnapshot.objects.count(), 2)
+
+
+class TemplateDeploymentTest(TestCase):
+
+    def setUp(self):
+        self.readers = [
+            Reader.objects.create(serial_number=f"SN-{number}", name=f"Reader {number}", ip_address=f"192.168.1.{number}", port=443, username="admin", password="password")
+            for number in range(1, 4)
+        ]
+        self.addCleanup(reader_api.close_all)
+
+    @mock.patch("apps.readers.tasks.deploy_template.delay")
+    def test_one_job_per_save_pushes_to_all_readers(self, deploy):
+        with self.captureOnCommitCallbacks(execute=True):
+            template = WebhookTemplate.objects.create(name="Cloud", content={"eventUrl": "https://example.com"})
+            template.readers.set(self.readers)
+        deploy.assert_called_once_with(TemplateDeployment.WEBHOOK, template.id)
+
+        def respond(client, method, path, **kwargs):
+            response = requests.Response()
+            response.status_code = 503 if "192.168.1.2" in client.base_url else 204
+            return response
+
+        with mock.patch.object(reader_api.ReaderClient, "request", autospec=True, side_effect=respond) as request:
+            deployment = template_deployment.deploy(TemplateDeployment.WEBHOOK, template.id, max_workers=3)
+        self.assertEqual(request.call_args_list[0].args[1:], ("PUT", "/webhooks/event"))
+
+        deployment.refresh_from_db()
+        self.assertEqual((deployment.status, deployment.total, deployment.succeeded, deployment.failed), (TemplateDeployment.FINISHED, 3, 2, 1))
+        self.assertEqual(deployment.template, template)
+        results = deployment.webhook_results.all()
+        self.assertEqual(len(results), 3)
+        self.assertEqual([result.reader for result in results if not result.success], [self.readers[1]])
+        self.assertTrue(all(result.duration_ms is not None for result in results))
+
+
+class TimerWheelTest(TestCase):
+
+    def test_deadlines_fire_on_their_tick_across_levels(self):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        wheel = TimerWheel(now=start)
+        delays = {'a': 3, 'b': 70, 'c': 5000, 'd': 300000}
+        for key, seconds in delays.items():
+            wheel.schedule(key, start + timedelta(seconds=seconds))
+        wheel.schedule('b', start + timedelta(seconds=80))
+        wheel.schedule('e', start - timedelta(seconds=1))
+        wheel.cancel('c')
+
+        fired = {}
+        for seconds in range(0, 300001, 1):
+            for key in wheel.advance(start + timedelta(seconds=seconds)):
+                fired[key] = seconds
+        self.assertEqual(fired, {'e': 0, 'a': 3, 'b': 80, 'd': 300000})
+        self.assertEqual(len(wheel), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL only')
+class QueryPlanTest(TestCase):
+    """Hot queries must be served by an index, with sequential scans disabled a missing index shows up as Seq Scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = Reader.objects.create(serial_number="123-ABC-456", name="Test Reader", ip_address="192.168.1.1", port=8080, username="admin", password="password")
+        cls.read_point = ReadPoint.objects.create(name="Dock")
+        location = Location.objects.create(name="Warehouse")
+        cls.now = datetime(2024, 8, 9, tzinfo=timezone.utc)
+        TagEvent.objects.bulk_create(
+            TagEvent(reader=cls.reader, epc=f"E28011{i % 50:06d}", timestamp=cls.now - timedelta(minutes=i)) for i in range(500)
+        )
+        TagTraceability.objects.bulk_create(
+            TagTraceability(epc=f"E28011{i:06d}", read_point=cls.read_point, location=location, arrived_at=cls.now,
+                            last_seen=cls.now, departed_at=cls.now if i % 2 else None) for i in range(500)
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertIndexed(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn("Seq Scan", plan, plan)
+
+    def test_tag_event_queries(self):
+        self.assertIndexed(TagEvent.objects.filter(timestamp__gte=self.now - timedelta(hours=1)))
+        self.assertIndexed(TagEvent.objects.filter(reader=self.reader).order_by("-timestamp")[:10])
+        self.assertIndexed(TagEvent.objects.filter(epc="E28011000007").order_by("-timestamp"))
+
+    def test_traceability_queries(self):
+        self.assertIndexed(TagTraceability.objects.filter(epc="E28011000007", read_point=self.read_point))
+        self.assertIndexed(TagTraceability.objects.filter(read_point=self.read_point, departed_at__isnull=True, last_seen__lt=self.now))
+        self.assertIndexed(TagTraceability.objects.order_by("-arrived_at")[:10])
+
+    def test_dashboard_rollup_queries(self):
+        self.assertIndexed(TagReadRollup.objects.filter(granularity=TagReadRollup.MINUTE, bucket__gte=self.now - timedelta(hours=3)))
+
+
+class RetentionTest(TestCase):
+
+    @mock.patch("apps.readers.retention.time.sleep")
+    def test_expired_rows_are_deleted_in_batches(self, sleep):
+        reader = Reader.objects.create(serial_number="123-ABC-456", name="Test Reader", ip_address="192.168.1.1", port=8080, username="admin", password="password")
+        now = datetime(2024, 8, 9, tzinfo=timezone.utc)
+        for days in (30, 10, 1):
+            TagEvent.objects.create(reader=reader, epc=f"E2801100{days:04d}", timestamp=now - timedelta(days=days))
+        RetentionPolicy.objects.create(model="readers.TagEvent", keep_days=7)
+
+        with self.settings(RETENTION_BATCH_SIZE=1, RETENTION_POLICIES={"readers.TagEvent": 1, "smartreader.StatusEvent": 0}):
+            self.assertEqual(enforce_retention(now=now), {"readers.TagEvent": 2})
+
+        self.assertEqual(list(TagEvent.objects.values_list("epc", flat=True)), ["E28011000001"])
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(RetentionPolicy.objects.get().last_deleted, 2)
+
+
+class WebhookReceiverTest(SimpleTestCase):
+
+    def test_body_is_classified_without_parsing(self):
+        self.assertEqual(sniff_webhook_body(b' [ ]\n'), 'keepalive')
+        self.assertEqual(sniff_webhook_body(b'[{"eventType": "tagInventory"}]'), 'payload')
+        self.assertEqual(sniff_webhook_body(b'{"eventType": "tagInventory"}'), 'payload')
+        self.assertIsNone(sniff_webhook_body(b'not json'))
+        self.assertIsNone(sniff_webhook_body(b''))
+
+    @mock.patch("apps.readers.views.process_webhook_raw")
+    def test_raw_body_is_enqueued(self, raw_task):
+        body = '[{"eventType": "tagInventory"}]'
+        response = self.client.post(reverse('webhook_receiver'), data=body, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        raw_task.delay.assert_called_once_with(body)
+
+        response = self.client.post(reverse('webhook_receiver'), data='[]', content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(raw_task.delay.call_count, 1)
+
+    @mock.patch("apps.readers.views.webhook_publisher.publish", new_callable=mock.AsyncMock)
+    async def test_async_receiver_publishes_raw_body(self, publish):
+        body = '[{"eventType": "tagInventory"}]'
+        response = await self.async_client.post(reverse('webhook_receiver_async'), data=body, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        publish.assert_awaited_once()
+        self.assertEqual(publish.await_args.args[1:], (body,))
+
+
+class TagDecodingTest(SimpleTestCase):
+
+    def test_uniform_and_mixed_base64_columns(self):
+        # 'AAEC' and 'AwQF' share a width and take the joined fast path, the rest decode one by one
+        self.assertEqual(decode_base64_hex(['AAEC', None, 'AwQF']), ['000102', None, '030405'])
+        self.assertEqual(decode_base64_hex(['AAEC', 'AwQFBg==', 'not base64!']), ['000102', '03040506', None])
+
+
+
+class IngestPipelineTest(SimpleTestCase):
+
+    def setUp(self):
+        self.reader = Reader(id=1, name="Test Reader", serial_number="123-ABC-456")
+
+    def test_pipeline_matches_per_read_decoding(self):
+        events = synthetic_webhook_payload(50)
+        events[3]['tagInventoryEvent'].update(epc=None, epcHex='E200ABCD', tidHex='E2801100', antennaPort=0, peakRssiCdbm=100)
+
+        # Chunks smaller than the payload exercise the streaming between stages
+        tag_events = decode_with_pipeline(events, self.reader, chunk_size=16)
+
+        self.assertEqual(field_values(tag_events), field_values(decode_per_read(events, self.reader)))
+        self.assertIsNone(tag_events[3].antenna_port)
+        self.assertIs(tag_events[0].reader, self.reader)
+
+    def test_smartreader_tag_reads_and_unresolved_readers(self):
+        events = [
+            {"readerName": "dock", "tag_reads": [{"epc": "E2801100", "firstSeenTimestamp": 1723225470659000, "antennaPort": 2}, {"epc": ""}]},
+            {"readerName": "unknown", "tag_reads": [{"epc": "E2801101"}]},
+        ]
+        readers = {"dock": self.reader}
+
+        tag_events = list(normalize(((None, event) for event in events), lambda read_format, source, event: readers.get(event["readerName"])))
+
+        self.assertEqual([tag_event.epc for tag_event in tag_events], ["E2801100"])
+        self.assertEqual(tag_events[0].timestamp.isoformat(), "2024-08-09T17:44:30.659000+00:00")
+        self.assertEqual(tag_events[0].antenna_port, 2)
+
+
+class DedupWindowTest(SimpleTestCase):
+
+    def _tag_event(self, reader, seconds):
+        return TagEvent(reader=reader, epc="E2801100", antenna_port=1, timestamp=datetime(2024, 8, 9, tzinfo=timezone.utc) + timedelta(seconds=seconds))
+
+    @mock.patch("apps.readers.dedup_window.settings", INGEST_DEDUP_WINDOW_SECONDS=5, INGEST_DEDUP_STATE_CHANGES_ONLY=True, INGEST_DEDUP_MAX_KEYS=100)
+    def test_state_changes_only_persists_arrivals(self, settings):
+        window = DedupWindow()
+        reader = Reader(id=1, name="Test Reader", serial_number="123-ABC-456")
+        arrival = self._tag_event(reader, 0)
+
+        self.assertEqual(window.collapse([arrival, self._tag_event(reader, 4)]), ([arrival], []))
+        arrival.pk = 1
+        # The window slides with every read, so a tag that stays present is never written again
+        self.assertEqual(window.collapse([self._tag_event(reader, 8), self._tag_event(reader, 12)]), ([], []))
+        self.assertEqual(arrival.read_count, 4)
+
+        returned = self._tag_event(reader, 30)
+        self.assertEqual(window.collapse([returned]), ([returned], []))
+
+        # A window of 0 on the reader disables deduplication
+        reader.dedup_window_seconds = 0
+        self.assertEqual(len(window.collapse([self._tag_event(reader, 31), self._tag_event(reader, 31)])[0]), 2)
+
+    @mock.patch("apps.readers.dedup_window.settings", INGEST_DEDUP_WINDOW_SECONDS=5, INGEST_DEDUP_STATE_CHANGES_ONLY=False, INGEST_DEDUP_MAX_KEYS=100)
+    def test_reads_extending_an_event_being_inserted_are_reported_once_saved(self, settings):
+        window = DedupWindow()
+        reader = Reader(id=1, name="Test Reader", serial_number="123-ABC-456")
+        first = self._tag_event(reader, 0)
+        self.assertEqual(window.collapse([first]), ([first], []))
+
+        # Another writer reads the tag before the first one has inserted its event
+        self.assertEqual(window.collapse([self._tag_event(reader, 2)]), ([], []))
+        first.pk = 1
+        self.assertEqual(window.saved([first]), [first])
+        self.assertEqual(first.read_count, 2)
+        self.assertEqual(window.collapse([self._tag_event(reader, 3)]), ([], [first]))
+        self.assertEqual(window.saved([first]), [])
+
+
+class PartitionPlanningTest(SimpleTestCase):
+
+    def test_ranges_skip_existing_partitions(self):
+        day = lambda n: datetime(2024, 8, n, tzinfo=timezone.utc)
+        start = period_start(datetime(2024, 8, 9, 17, 44, tzinfo=timezone.utc), "day")
+        # The legacy partition ends tomorrow, one weekly partition already exists further ahead
+        existing = [(None, day(10)), (day(12), day(19))]
+
+        self.assertEqual(missing_ranges(existing, start, 4, "day"), [(day(10), day(11)), (day(11), day(12))])
+        self.assertEqual(partition_name(day(10)), "readers_tagevent_p20240810")
+
+    def test_weeks_start_on_monday(self):
+        self.assertEqual(period_start(datetime(2024, 8, 9, 17, 44, tzinfo=timezone.utc), "week"), datetime(2024, 8, 5, tzinfo=timezone.utc))
+
+
+class TTLCacheTest(SimpleTestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_entries=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expired_entry_is_reloaded(self):
+        cache = TTLCache(max_entries=2, ttl=0)
+        loader = mock.Mock(return_value="reader")
+        cache.get_or_load("a", loader)
+        cache.get_or_load("a", loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_missing_value_is_cached(self):
+        cache = TTLCache(max_entries=2, ttl=60)
+        loader = mock.Mock(return_value=None)
+        self.assertIsNone(cache.get_or_load("a", loader))
+        self.assertIsNone(cache.get_or_load("a", loader))
+        self.assertEqual(loader.call_count, 1)
@@ -0,0 +1,95 @@
+# readers/timer_wheel.py
+"""
+Hierarchical timing wheel of per-key deadlines.
+
+Deadlines are rounded up to whole ticks and kept in ``levels`` wheels of
+``slots`` slots: level 0 holds the next ``slots`` ticks, level 1 the next
+``slots ** 2`` ticks one slot per ``slots`` ticks, and so on, deadlines past
+the last level wait in an overflow list. When the wheel turns into a new slot
+of an upper level that slot is cascaded down, so scheduling, cancelling and
+firing a deadline are O(1) amortized however many keys are tracked.
+
+A key has one deadline at a time. Rescheduling a key only records the new
+deadline, the entry at the old one is skipped when its slot comes up.
+"""
+import math
+from datetime import datetime, timezone
+
+
+class TimerWheel:
+
+    def __init__(self, tick=1.0, slots=64, levels=4, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._now = now
+        self.clear()
+
+    def schedule(self, key, deadline):
+        """Fire ``key`` at ``deadline`` (aware datetime), replacing its previous deadline."""
+        when = math.ceil(deadline.timestamp() / self.tick)
+        self._deadlines[key] = when
+        self._place(key, when)
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def advance(self, now=None):
+        """Turn the wheel up to ``now`` and return the keys whose deadline has passed, earliest first."""
+        target = math.floor((now or datetime.now(timezone.utc)).timestamp() / self.tick)
+        fired = self._fire(self._due)
+        self._due = []
+        while self._current < target:
+            self._current += 1
+            if self._current % self.slots ** self.levels == 0:
+                overflow, self._overflow = self._overflow, []
+                for key, when in overflow:
+                    self._place(key, when)
+            # Upper levels first, their entries may land in a lower level that cascades at the same tick
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if self._current % span == 0:
+                    slot = self._wheels[level][(self._current // span) % self.slots]
+                    entries = slot[:]
+                    slot.clear()
+                    for key, when in entries:
+                        self._place(key, when)
+            slot = self._wheels[0][self._current % self.slots]
+            fired.extend(self._fire(slot))
+            slot.clear()
+            fired.extend(self._fire(self._due))
+            self._due = []
+        return fired
+
+    def clear(self):
+        self._wheels = [[[] for _ in range(self.slots)] for _ in range(self.levels)]
+        self._overflow = []
+        self._due = []
+        self._deadlines = {}
+        self._current = math.floor((self._now or datetime.now(timezone.utc)).timestamp() / self.tick)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _place(self, key, when):
+        delta = when - self._current
+        if delta <= 0:
+            self._due.append((key, when))
+            return
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1):
+                self._wheels[level][(when // self.slots ** level) % self.slots].append((key, when))
+                return
+        self._overflow.append((key, when))
+
+    def _fire(self, entries):
+        fired = []
+        for key, when in entries:
+            # Entries left behind by a reschedule or cancel no longer match the key's deadline
+            if self._deadlines.get(key) == when:
+                del self._deadlines[key]
+                fired.append(key)
+        return fired
@@ -2,11 +2,12 @@ from django.urls import path
 from . import views
 from .views import (
     dashboard, reader_list, reader_create, reader_update, 
-    reader_delete, start_preset, stop_preset, webhook_receiver, 
-    tag_event_list, tag_event_details, export_tag_events, PresetListView, PresetCreateView, 
-    PresetUpdateView, PresetDeleteView, query_presets, get_preset_details,
+    reader_delete, start_preset, stop_preset, webhook_receiver, webhook_receiver_async, 
+    tag_event_list, tag_event_details, export_tag_events, export_tag_read_rollups, PresetListView, PresetCreateView, 
+    PresetUpdateView, PresetDeleteView, query_presets, sync_all_presets, get_preset_details,
     PresetTemplateListView, PresetTemplateCreateView,
     PresetTemplateUpdateView, PresetTemplateDeleteView,
+    PresetRolloutListView, PresetRolloutDetailView, preset_rollout_create, preset_rollout_progress,
     WebhookTemplateListView, WebhookTemplateCreateView, WebhookTemplateUpdateView, WebhookTemplateDeleteView,
     MqttTemplateListView, MqttTemplateCreateView, MqttTemplateUpdateView, MqttTemplateDeleteView,
     WebhookTemplateResultListView, WebhookTemplateResultRetryView,
@@ -25,19 +26,26 @@ urlpatterns = [
     path('start-preset/<int:pk>/', start_preset, name='start_preset'),
     path('stop-preset/<int:pk>/', stop_preset, name='stop_preset'),
     path('webhook/', webhook_receiver, name='webhook_receiver'),
+    path('webhook/async/', webhook_receiver_async, name='webhook_receiver_async'),
     path('tags/', tag_event_list, name='tag_event_list'),
     path('tag-event/<int:event_id>/details/', tag_event_details, name='tag_event_details'),
     path('tags/export/', export_tag_events, name='export_tag_events'),
+    path('tags/rollups/export/', export_tag_read_rollups, name='export_tag_read_rollups'),
     path('reader/<int:reader_id>/presets/', PresetListView.as_view(), name='preset_list'),
     path('reader/<int:reader_id>/presets/add/', PresetCreateView.as_view(), name='preset_add'),
     path('preset/<int:pk>/edit/', PresetUpdateView.as_view(), name='preset_edit'),
     path('preset/<int:pk>/delete/', PresetDeleteView.as_view(), name='preset_delete'),
     path('get-preset-details/<int:reader_id>/<str:preset_id>/', get_preset_details, name='get_preset_details'),
     path('query-presets/<int:pk>/', query_presets, name='query_presets'),
+    path('presets/sync/', sync_all_presets, name='sync_all_presets'),
     path('preset-templates/', PresetTemplateListView.as_view(), name='preset_template_list'),
     path('preset-templates/add/', PresetTemplateCreateView.as_view(), name='preset_template_add'),
     path('preset-templates/<int:pk>/edit/', PresetTemplateUpdateView.as_view(), name='preset_template_edit'),
     path('preset-templates/<int:pk>/delete/', PresetTemplateDeleteView.as_view(), name='preset_template_delete'),
+    path('preset-rollouts/', PresetRolloutListView.as_view(), name='preset_rollout_list'),
+    path('preset-rollouts/add/', preset_rollout_create, name='preset_rollout_add'),
+    path('preset-rollouts/<int:pk>/', PresetRolloutDetailView.as_view(), name='preset_rollout_detail'),
+    path('preset-rollouts/<int:pk>/progress/', preset_rollout_progress, name='preset_rollout_progress'),
     path('webhook-templates/', WebhookTemplateListView.as_view(), name='webhook_template_list'),
     path('webhook-templates/add/', WebhookTemplateCreateView.as_view(), name='webhook_template_add'),
     path('webhook-templates/<int:pk>/edit/', WebhookTemplateUpdateView.as_view(), name='webhook_template_edit'),
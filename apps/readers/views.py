@@ -6,17 +6,22 @@ from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
+from django.db import transaction
 from django.db.models import Q, Count
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from datetime import timedelta
 from elasticsearch import Elasticsearch
-from .models import Location, Reader, Preset, PresetTemplate, ReadPoint, TagEvent, TagTraceability, MqttTemplate, MQTTTemplateApplicationResult, WebhookTemplate, WebhookTemplateApplicationResult
-from .forms import ReaderForm, PresetForm, PresetTemplateForm, MqttTemplateForm, WebhookTemplateForm
+from .models import Location, Reader, ReaderStatusSnapshot, Preset, PresetRollout, PresetTemplate, ReadPoint, TagEvent, TagReadRollup, TagTraceability, TemplateDeployment, MqttTemplate, MQTTTemplateApplicationResult, WebhookTemplate, WebhookTemplateApplicationResult
+from .forms import ReaderForm, PresetForm, PresetRolloutForm, PresetTemplateForm, MqttTemplateForm, WebhookTemplateForm
 from django.http import JsonResponse
 from django.http import HttpResponse
-from .tasks import process_webhook, process_webhook_settings, process_mqtt_settings
+from .tasks import deploy_template, process_webhook_raw, run_preset_rollout, sync_presets
+from .task_publisher import webhook_publisher
+from . import preset_discovery, preset_rollout, reader_api, rollups
+from django.conf import settings
 import csv
+import random
 import requests
 import json
 import base64
@@ -27,7 +32,8 @@ logging.basicConfig(level=logging.DEBUG)
 
 @login_required
 def reader_list(request):
-    readers = Reader.objects.all()
+    # The status comes from the snapshots of the status poller, the readers are not called
+    readers = Reader.objects.select_related('active_preset', 'status_snapshot')
     
     # Create a dictionary to store the active preset for each reader
     active_presets = {}
@@ -73,49 +79,26 @@ def reader_delete(request, pk):
 @login_required
 def query_presets(request, pk):
     reader = get_object_or_404(Reader, pk=pk)
-    url = f"https://{reader.ip_address}:{reader.port}/api/v1/profiles/inventory/presets"
-    print(f"url for preset list {url}")
-    auth = (reader.username, reader.password)
-    
     try:
-        response = requests.get(url, auth=auth, headers={'Content-Type': 'application/json'}, verify=False)
-        response.raise_for_status()
-        preset_ids = response.json()
-        
-        print(f"Preset IDs retrieved from reader {reader.name} ({reader.ip_address}): {preset_ids}")
-        
-        for preset_id in preset_ids:
-            # Check if preset already exists in the database
-            preset, created = Preset.objects.get_or_create(
-                reader=reader, 
-                preset_id=preset_id, 
-                defaults={'configuration': {}}
-            )
-            
-            if created:
-                # If created, fetch the preset details from the reader
-                detail_url = f"https://{reader.ip_address}:{reader.port}/api/v1/profiles/inventory/presets/{preset_id}"
-                print(f"url for preset {detail_url}")
-                try:
-                    detail_response = requests.get(detail_url, auth=auth, headers={'Content-Type': 'application/json'}, verify=False)
-                    detail_response.raise_for_status()
-                    preset.configuration = detail_response.json()
-                    print(f"Configuration for preset '{preset_id}': {preset.configuration}")
-                except requests.exceptions.RequestException as e:
-                    print(f"Failed to retrieve configuration for preset '{preset_id}': {e}")
-                    preset.configuration = {}
-                preset.save()  # Save the preset with the fetched or default configuration
-            else:
-                print(f"Preset '{preset_id}' already exists in the database.")
+        # Details are fetched concurrently, unchanged presets are skipped by their ETag
+        counts = preset_discovery.sync_reader(reader)
+        logger.info(f"Presets synced from reader {reader.name} ({reader.ip_address}): {counts}")
 
         # Get all presets associated with this reader
         presets = Preset.objects.filter(reader=reader)
         return JsonResponse({'presets': list(presets.values('id', 'preset_id'))})
 
     except requests.exceptions.RequestException as e:
-        print(f"Error querying presets from reader {reader.name} ({reader.ip_address}): {e}")
+        logger.error(f"Error querying presets from reader {reader.name} ({reader.ip_address}): {e}")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
     
+@login_required
+def sync_all_presets(request):
+    if request.method == 'POST':
+        sync_presets.delay()
+        messages.success(request, 'Preset sync of all readers started.')
+    return redirect('reader_list')
+
 @login_required
 def get_preset_details(request, reader_id, preset_id):
     reader = get_object_or_404(Reader, pk=reader_id)
@@ -148,11 +131,9 @@ def start_preset(request, pk):
 
     if preset.preset_id != 'default':
         # Update the reader with the selected preset configuration
-        update_url = f"https://{reader.ip_address}:{reader.port}/api/v1/profiles/inventory/presets/{preset.preset_id}"
-        auth = (reader.username, reader.password)
         logger.debug(f"Selected Preset: {preset.configuration}")
         try:
-            response = requests.put(update_url, json=preset.configuration, auth=auth, headers={'Content-Type': 'application/json'}, verify=False)
+            response = reader_api.client_for(reader).put_preset(preset.preset_id, preset.configuration)
             response.raise_for_status()  # Raise an HTTPError for bad responses
             messages.success(request, 'Preset started successfully.')
         except requests.exceptions.RequestException as e:
@@ -173,9 +154,8 @@ def start_preset(request, pk):
     reader.save()
 
     # Call the preset start endpoint
-    start_url = f"https://{reader.ip_address}:{reader.port}/api/v1/profiles/inventory/presets/{preset.preset_id}/start"
     try:
-        start_response = requests.post(start_url, auth=auth, verify=False)
+        start_response = reader_api.client_for(reader).start_preset(preset.preset_id)
         start_response.raise_for_status()  # Raise an HTTPError for bad responses
         # return JsonResponse({'status': 'started'})
         messages.success(request, 'Preset started successfully.')
@@ -189,9 +169,8 @@ def start_preset(request, pk):
 def stop_preset(request, pk):
     reader = get_object_or_404(Reader, pk=pk)
     # Call the preset stop endpoint
-    url = f'https://{reader.ip_address}:{reader.port}/api/v1/profiles/stop'
     try:
-        response = requests.post(url, auth=(reader.username, reader.password), verify=False)
+        response = reader_api.client_for(reader).stop_preset()
         response.raise_for_status()  # Raise an HTTPError for bad responses
         messages.success(request, 'Preset stopped successfully.')
         #return JsonResponse({'status': 'stopped'})
@@ -200,6 +179,50 @@ def stop_preset(request, pk):
         messages.error(request, f'Error stopping preset: {str(e)}')
     return redirect('reader_list')
 
+class PresetRolloutListView(LoginRequiredMixin, ListView):
+    model = PresetRollout
+    template_name = 'readers/preset_rollout_list.html'
+    context_object_name = 'rollouts'
+    paginate_by = 20
+    ordering = ['-created_at']
+
+@login_required
+def preset_rollout_create(request):
+    form = PresetRolloutForm(request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        readers = preset_rollout.target_readers(form.cleaned_data['readers'], form.cleaned_data['read_points'], form.cleaned_data['locations'])
+        rollout = preset_rollout.create_rollout(
+            form.cleaned_data['action'], readers,
+            preset_id=form.cleaned_data['preset_id'], preset_template=form.cleaned_data['preset_template'],
+        )
+        run_preset_rollout.delay(rollout.id)
+        return redirect('preset_rollout_detail', pk=rollout.pk)
+    return render(request, 'readers/preset_rollout_form.html', {'form': form})
+
+class PresetRolloutDetailView(LoginRequiredMixin, DetailView):
+    model = PresetRollout
+    template_name = 'readers/preset_rollout_detail.html'
+    context_object_name = 'rollout'
+
+@login_required
+def preset_rollout_progress(request, pk):
+    """Progress of a rollout as JSON, with the results after the ``after`` result id. Polled by the detail page."""
+    rollout = get_object_or_404(PresetRollout, pk=pk)
+    try:
+        after = int(request.GET.get('after') or 0)
+    except ValueError:
+        after = 0
+    # The rollout totals are only saved once it finishes
+    counts = rollout.results.aggregate(succeeded=Count('id', filter=Q(success=True)), failed=Count('id', filter=Q(success=False)))
+    results = [
+        {
+            'id': result.id, 'reader': result.reader.name, 'ip_address': result.reader.ip_address, 'success': result.success,
+            'step': result.step, 'message': result.response_message, 'duration_ms': result.duration_ms,
+        }
+        for result in rollout.results.filter(id__gt=after).select_related('reader').order_by('id')
+    ]
+    return JsonResponse({'status': rollout.status, 'finished': rollout.status == PresetRollout.FINISHED, **counts, 'results': results})
+
 @login_required
 def view_logs(request):
     es = Elasticsearch(['http://elasticsearch:9200'])
@@ -275,31 +298,50 @@ def view_logs(request):
 
     return render(request, 'readers/logs.html', context)
 
+def sniff_webhook_body(body):
+    """
+    Classify a webhook body without parsing it.
+
+    Returns 'keepalive' for an empty JSON array, 'payload' for anything shaped
+    like a JSON array or object, and None for bodies that cannot be JSON. The
+    worker does the real parse, exactly once.
+    """
+    stripped = body.strip()
+    if not stripped or stripped[:1] + stripped[-1:] not in (b'[]', b'{}'):
+        return None
+    if stripped[:1] == b'[' and not stripped[1:-1].strip():
+        return 'keepalive'
+    return 'payload'
+
+def _log_webhook_request(request):
+    # Only a sample of requests is logged, per-header logging costs more than the ingest itself
+    sample_rate = getattr(settings, 'WEBHOOK_DEBUG_SAMPLE_RATE', 0)
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return
+    headers = dict(request.headers.items())
+    logger.info(f"Webhook {request.method} headers={headers} body={request.body.decode('utf-8', errors='replace')}")
+
 @csrf_exempt
 def webhook_receiver(request):
-    logger.info(f"Method: {request.method}")
-    logger.info("Headers:")
-    for header, value in request.headers.items():
-        logger.info(f"{header}: {value}")
-
-    try:
-        logger.info("Body:")
-        logger.info(request.body.decode('utf-8'))
-    except Exception as e:
-        logger.error(f"Error reading body: {e}")
+    _log_webhook_request(request)
 
     if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-        except json.JSONDecodeError:
+        kind = sniff_webhook_body(request.body)
+        if kind is None:
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=200)
-        
+
         # Handle empty JSON array as a keepalive
-        if isinstance(data, list) and not data:
+        if kind == 'keepalive':
             return JsonResponse({'status': 'keepalive'}, status=204)
 
         try:
-            process_webhook.delay(data)
+            body = request.body.decode('utf-8')
+        except UnicodeDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=200)
+
+        try:
+            # The body is enqueued as received, the worker parses it
+            process_webhook_raw.delay(body)
         except Exception as e:
             logger.error(f"Error queuing task: {e}")
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
@@ -308,6 +350,37 @@ def webhook_receiver(request):
     
     return JsonResponse({'status': 'bad request'}, status=400)
 
+async def webhook_receiver_async(request):
+    """webhook_receiver for ASGI servers, many concurrent POSTs share one process and broker connection."""
+    _log_webhook_request(request)
+
+    if request.method == 'POST':
+        kind = sniff_webhook_body(request.body)
+        if kind is None:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=200)
+
+        # Keepalives are answered without touching the broker
+        if kind == 'keepalive':
+            return JsonResponse({'status': 'keepalive'}, status=204)
+
+        try:
+            body = request.body.decode('utf-8')
+        except UnicodeDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=200)
+
+        try:
+            await webhook_publisher.publish(process_webhook_raw, body)
+        except Exception as e:
+            logger.error(f"Error queuing task: {e}")
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+        return JsonResponse({'status': 'queued'})
+
+    return JsonResponse({'status': 'bad request'}, status=400)
+
+# csrf_exempt only wraps sync views before Django 5.0, mark the coroutine function directly
+webhook_receiver_async.csrf_exempt = True
+
 @login_required
 def tag_event_list(request):
     readers = Reader.objects.all()
@@ -415,6 +488,38 @@ def export_tag_events(request):
     
     return response
 
+@login_required
+def export_tag_read_rollups(request):
+    # Tag read report per reader, antenna and minute, hour or day, from the rollup tables
+    granularity = request.GET.get('granularity', TagReadRollup.HOUR)
+    if granularity not in dict(TagReadRollup.GRANULARITY_CHOICES):
+        return HttpResponse(f'Unknown granularity: {granularity}', status=400)
+
+    rollup_rows = TagReadRollup.objects.filter(granularity=granularity).select_related('reader')
+    reader_id = request.GET.get('reader')
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    if reader_id:
+        rollup_rows = rollup_rows.filter(reader__id=reader_id)
+    if start_date:
+        rollup_rows = rollup_rows.filter(bucket__gte=start_date)
+    if end_date:
+        rollup_rows = rollup_rows.filter(bucket__lte=end_date)
+
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="tag_reads_per_{granularity}.csv"'
+
+    writer = csv.writer(response)
+    writer.writerow(['Reader', 'Antenna', 'Period Start', 'Reads', 'Unique EPCs', 'RSSI Min', 'RSSI Max', 'RSSI Avg'])
+    for rollup in rollup_rows.order_by('bucket', 'reader__name', 'antenna_port').iterator():
+        rssi_avg = rollup.rssi_avg
+        writer.writerow([
+            rollup.reader.name, rollup.antenna_port or '', rollup.bucket, rollup.read_count, rollup.unique_epcs,
+            rollup.rssi_min, rollup.rssi_max, round(rssi_avg) if rssi_avg is not None else '',
+        ])
+
+    return response
+
 @login_required
 def dashboard(request):
     # Calculate time ranges
@@ -422,16 +527,20 @@ def dashboard(request):
     three_hours_ago = now - timedelta(hours=3)
     one_hour_ago = now - timedelta(hours=1)
 
+    # Both figures come from the per-minute rollups, not from the TagEvent table
     # Get the count of readers that have not sent events in the last 3 hours
-    readers_with_recent_events = TagEvent.objects.filter(timestamp__gte=three_hours_ago).values('reader').distinct()
-    inactive_readers_count = Reader.objects.exclude(id__in=readers_with_recent_events).count()
+    inactive_readers_count = Reader.objects.exclude(id__in=rollups.active_reader_ids(three_hours_ago)).count()
 
-    # Get the count of tag events received in the last hour
-    tag_events_last_hour = TagEvent.objects.filter(timestamp__gte=one_hour_ago).count()
+    # Get the count of tag reads received in the last hour
+    tag_events_last_hour = rollups.read_count_since(one_hour_ago)
+
+    # Readers that did not answer the last status poll
+    unreachable_readers_count = ReaderStatusSnapshot.objects.filter(reachable=False).count()
 
     context = {
         'inactive_readers_count': inactive_readers_count,
         'tag_events_last_hour': tag_events_last_hour,
+        'unreachable_readers_count': unreachable_readers_count,
     }
     
     return render(request, 'readers/dashboard.html', context)
@@ -516,18 +625,25 @@ class PresetTemplateDeleteView(LoginRequiredMixin, DeleteView):
     template_name = 'readers/preset_template_confirm_delete.html'
     success_url = reverse_lazy('preset_template_list')
 
+class TemplateDeploymentMixin:
+    """Saves the template and its readers in one transaction, so the deployment queued on commit sees the readers."""
+
+    def form_valid(self, form):
+        with transaction.atomic():
+            return super().form_valid(form)
+
 class WebhookTemplateListView(LoginRequiredMixin, ListView):
     model = WebhookTemplate
     template_name = 'readers/webhook_template_list.html'
     context_object_name = 'webhook_templates'
 
-class WebhookTemplateCreateView(LoginRequiredMixin, CreateView):
+class WebhookTemplateCreateView(LoginRequiredMixin, TemplateDeploymentMixin, CreateView):
     model = WebhookTemplate
     form_class = WebhookTemplateForm
     template_name = 'readers/webhook_template_form.html'
     success_url = reverse_lazy('webhook_template_list')
 
-class WebhookTemplateUpdateView(LoginRequiredMixin, UpdateView):
+class WebhookTemplateUpdateView(LoginRequiredMixin, TemplateDeploymentMixin, UpdateView):
     model = WebhookTemplate
     form_class = WebhookTemplateForm
     template_name = 'readers/webhook_template_form.html'
@@ -550,7 +666,7 @@ class WebhookTemplateResultRetryView(DetailView):
 
     def post(self, request, *args, **kwargs):
         result = self.get_object()
-        process_webhook_settings.apply_async((result.template.id, result.reader.id))
+        deploy_template.delay(TemplateDeployment.WEBHOOK, result.template.id, [result.reader.id])
         result.retry = True
         result.save()
         return redirect('webhook_template_result_list')
@@ -560,13 +676,13 @@ class MqttTemplateListView(LoginRequiredMixin, ListView):
     template_name = 'readers/mqtt_template_list.html'
     context_object_name = 'mqtt_templates'
 
-class MqttTemplateCreateView(LoginRequiredMixin, CreateView):
+class MqttTemplateCreateView(LoginRequiredMixin, TemplateDeploymentMixin, CreateView):
     model = MqttTemplate
     form_class = MqttTemplateForm
     template_name = 'readers/mqtt_template_form.html'
     success_url = reverse_lazy('mqtt_template_list')
 
-class MqttTemplateUpdateView(LoginRequiredMixin, UpdateView):
+class MqttTemplateUpdateView(LoginRequiredMixin, TemplateDeploymentMixin, UpdateView):
     model = MqttTemplate
     form_class = MqttTemplateForm
     template_name = 'readers/mqtt_template_form.html'
@@ -589,7 +705,7 @@ class MQTTTemplateResultRetryView(DetailView):
 
     def post(self, request, *args, **kwargs):
         result = self.get_object()
-        process_mqtt_settings.apply_async((result.template.id, result.reader.id))
+        deploy_template.delay(TemplateDeployment.MQTT, result.template.id, [result.reader.id])
         result.retry = True
         result.save()
         return redirect('mqtt_template_result_list')
@@ -633,13 +749,13 @@ class ReadPointListView(ListView):
 
 class ReadPointCreateView(CreateView):
     model = ReadPoint
-    fields = ['name', 'readers', 'timeout_seconds']
+    fields = ['name', 'readers', 'timeout_seconds', 'location']
     template_name = 'readers/read_point_form.html'
     success_url = reverse_lazy('read_point_list')
 
 class ReadPointUpdateView(UpdateView):
     model = ReadPoint
-    fields = ['name', 'readers', 'timeout_seconds']
+    fields = ['name', 'readers', 'timeout_seconds', 'location']
     template_name = 'readers/read_point_form.html'
     success_url = reverse_lazy('read_point_list')
 
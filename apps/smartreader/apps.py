@@ -5,3 +5,6 @@ class SmartreaderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = "apps.smartreader"
     verbose_name = _("smartreader_app_verbose_name")
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,248 @@
+# smartreader/async_subscriber.py
+"""
+asyncio engine for the MQTT subscriber (``start_mqtt_subscriber --engine asyncio``).
+
+Every broker connection of the process is serviced by one event loop: paho's
+sockets are registered with the loop through its socket callbacks instead of
+each client running its own network thread. Routing and payload decoding run
+in a small thread pool and all database writes go through a single writer
+task, so a subscriber process holds one database connection for its writes
+and a few threads in total. Run one process per core to scale out.
+
+The engine is opt-in, the threaded one stays the default: its throughput has
+not been measured against paho's threaded subscriber yet. Both engines log
+messages/sec with their queue stats every ``MQTT_INGEST_STATS_INTERVAL``
+seconds, which gives that comparison on a real broker.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .config_watcher import ConfigurationWatcher
+from .mqtt_subscriber import BrokerConnection, SubscriberSupervisor, prepare_messages, write_prepared
+
+logger = logging.getLogger(__name__)
+
+MAX_RECONNECT_DELAY = 60
+
+
+class AsyncBrokerConnection(BrokerConnection):
+    """BrokerConnection whose socket is read and written from the asyncio loop."""
+
+    def __init__(self, key, configurations, engine, shard=None):
+        super().__init__(key, configurations, shard=shard)
+        self.engine = engine
+        self.loop = engine.loop
+        self._task = None
+        self.client.on_message = self.on_message
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_message(self, client, userdata, msg):
+        self.engine.submit((userdata, msg.topic, msg.payload))
+
+    # paho calls these from whichever thread touched the socket, the connect runs in an executor
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._forget_socket, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+
+    def _forget_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def start(self):
+        self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.client.disconnect()
+
+    async def _run(self):
+        hostname, port = self.key[0], self.key[1]
+        delay = 1
+        connected_once = False
+        while True:
+            # loop_misc drives keepalive pings and reports a dropped connection
+            if not connected_once or self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    # The TCP (and TLS) handshake blocks, keep it off the event loop
+                    if connected_once:
+                        await self.loop.run_in_executor(None, self.client.reconnect)
+                    else:
+                        connected_once = True
+                        await self.loop.run_in_executor(None, self.client.connect, hostname, port, self.keepalive)
+                    delay = 1
+                except OSError as e:
+                    logger.warning(f"Cannot reach MQTT broker {hostname}:{port}, retrying in {delay}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                    continue
+            await asyncio.sleep(1)
+
+
+class AsyncSubscriber:
+    """Single event loop running the broker connections, decoder, writer and configuration reload tasks."""
+
+    def __init__(self, queue_size=None, batch_size=None, batch_timeout=None, decode_workers=None, reload_interval=None, shard=None):
+        self.shard = shard
+        self.queue_size = queue_size or settings.MQTT_INGEST_QUEUE_SIZE
+        self.batch_size = batch_size or settings.MQTT_INGEST_BATCH_SIZE
+        self.batch_timeout = settings.MQTT_INGEST_BATCH_TIMEOUT if batch_timeout is None else batch_timeout
+        self.decode_workers = decode_workers or settings.MQTT_INGEST_WORKERS or 1
+        self.reload_interval = settings.MQTT_SUBSCRIBER_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        self.counters = {'received': 0, 'dropped': 0, 'processed': 0, 'failed': 0, 'batches': 0}
+        self.loop = None
+        self.inbox = None
+        self.supervisor = None
+
+    def submit(self, message):
+        """Queue a raw message from a broker connection, dropping the oldest one when full."""
+        self.counters['received'] += 1
+        if self.inbox.full():
+            self.inbox.get_nowait()
+            self.counters['dropped'] += 1
+        self.inbox.put_nowait(message)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.inbox = asyncio.Queue(maxsize=self.queue_size)
+        # At most one batch waits for the writer while the next one is decoded
+        prepared = asyncio.Queue(maxsize=1)
+
+        decode_pool = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix='mqtt-decode')
+        watcher_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mqtt-config-watcher')
+        self.supervisor = SubscriberSupervisor(connection_class=functools.partial(AsyncBrokerConnection, engine=self), shard=self.shard)
+        await self.reload()
+
+        tasks = [
+            self.loop.create_task(self._decode(decode_pool, prepared)),
+            self.loop.create_task(self._write(prepared)),
+            self.loop.create_task(self._log_stats()),
+        ]
+        if self.reload_interval > 0:
+            tasks.append(self.loop.create_task(self._watch_configurations(watcher_pool)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.supervisor.stop()
+            decode_pool.shutdown(wait=False)
+            watcher_pool.shutdown(wait=False)
+
+    async def reload(self, notified=False):
+        try:
+            state = await sync_to_async(self.supervisor.load, thread_sensitive=True)()
+            # Connections are created and updated on the loop thread, which owns their sockets
+            if self.supervisor.reload(state):
+                logger.info(f"Applied MQTT configuration changes ({'notified' if notified else 'polled'})")
+        except Exception as e:
+            logger.error(f"Failed to apply MQTT configuration changes: {e}", exc_info=True)
+
+    async def _watch_configurations(self, watcher_pool):
+        # The LISTEN connection must stay on the thread that opened it
+        watcher = ConfigurationWatcher()
+        try:
+            while True:
+                notified = await self.loop.run_in_executor(watcher_pool, watcher.wait, self.reload_interval)
+                await self.reload(notified)
+        finally:
+            try:
+                watcher_pool.submit(watcher.close)
+            except RuntimeError:
+                # The pool is already shut down, the process is exiting
+                pass
+
+    async def _next_batch(self):
+        batch = [await self.inbox.get()]
+        deadline = self.loop.time() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            if self.inbox.empty():
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.inbox.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self.inbox.get_nowait())
+        return batch
+
+    async def _decode(self, decode_pool, prepared):
+        while True:
+            batch = await self._next_batch()
+            try:
+                result = await self.loop.run_in_executor(decode_pool, prepare_messages, batch)
+            except Exception as e:
+                self.counters['failed'] += len(batch)
+                logger.error(f"Failed to decode a batch of {len(batch)} messages: {e}", exc_info=True)
+                continue
+            await prepared.put((len(batch), result))
+
+    async def _write(self, prepared):
+        # thread_sensitive pins every write to one thread, and so to one database connection
+        write = sync_to_async(self._write_batch, thread_sensitive=True)
+        while True:
+            count, (tag_events, handler_calls) = await prepared.get()
+            if await write(tag_events, handler_calls):
+                self.counters['processed'] += count
+            else:
+                self.counters['failed'] += count
+            self.counters['batches'] += 1
+
+    def _write_batch(self, tag_events, handler_calls):
+        try:
+            write_prepared(tag_events, handler_calls)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to write a batch of {len(tag_events)} tag events: {e}", exc_info=True)
+            # Drop connections that went away while the database was unavailable
+            close_old_connections()
+            return False
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update({
+            'depth': self.inbox.qsize() if self.inbox is not None else 0,
+            'maxsize': self.queue_size,
+            'connections': len(self.supervisor.connections) if self.supervisor is not None else 0,
+        })
+        return stats
+
+    async def _log_stats(self):
+        last_processed, last_stats = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(settings.MQTT_INGEST_STATS_INTERVAL)
+            now = time.monotonic()
+            stats = self.stats()
+            stats['messages_per_second'] = round((stats['processed'] - last_processed) / (now - last_stats), 1)
+            last_processed, last_stats = stats['processed'], now
+            logger.info(f"MQTT asyncio ingest stats: {stats}")
+
+
+def start_async_subscriber(workers=None, queue_size=None, reload_interval=None, shard=None):
+    subscriber = AsyncSubscriber(queue_size=queue_size, decode_workers=workers, reload_interval=reload_interval, shard=shard)
+    try:
+        asyncio.run(subscriber.run())
+    except KeyboardInterrupt:
+        pass
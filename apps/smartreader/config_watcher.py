@@ -0,0 +1,91 @@
+# smartreader/config_watcher.py
+"""
+Change notification for MQTTConfiguration rows.
+
+Saving or deleting a configuration sends ``NOTIFY mqtt_configuration_changed``
+(see smartreader/signals.py). A running subscriber LISTENs on that channel so
+it reloads within moments of a change made through the UI. On databases
+without LISTEN/NOTIFY, or if a notification is missed, the subscriber still
+notices changes by comparing a snapshot of the table on every poll interval.
+"""
+import logging
+import select
+import time
+
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'mqtt_configuration_changed'
+
+
+def notify_configuration_change():
+    """Wake up subscribers listening for configuration changes. Delivered when the transaction commits."""
+    if connection.vendor != 'postgresql':
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'NOTIFY {CHANNEL}')
+    except Exception as e:
+        logger.warning(f"Failed to notify MQTT configuration change: {e}")
+
+
+def configuration_snapshot(configurations):
+    """Comparable snapshot of every concrete field of the given configurations."""
+    return tuple(
+        tuple(getattr(config, field.attname) for field in config._meta.concrete_fields)
+        for config in configurations
+    )
+
+
+class ConfigurationWatcher:
+    """Blocks until a configuration change is notified or the poll interval elapses."""
+
+    def __init__(self, channel=CHANNEL):
+        self.channel = channel
+        self._connection = None
+
+    def _listen(self):
+        if self._connection is not None or connection.vendor != 'postgresql':
+            return self._connection
+        try:
+            # A dedicated autocommit connection, so LISTEN is not tied to the ORM's transactions
+            self._connection = connections.create_connection('default')
+            self._connection.ensure_connection()
+            raw_connection = self._connection.connection
+            raw_connection.autocommit = True
+            with raw_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.channel}')
+        except Exception as e:
+            logger.warning(f"LISTEN {self.channel} failed, falling back to polling: {e}")
+            self.close()
+        return self._connection
+
+    def wait(self, timeout):
+        """Return True if a change notification arrived within ``timeout`` seconds."""
+        listener = self._listen()
+        if listener is None:
+            time.sleep(timeout)
+            return False
+
+        raw_connection = listener.connection
+        try:
+            readable, _, _ = select.select([raw_connection], [], [], timeout)
+            if not readable:
+                return False
+            raw_connection.poll()
+            notified = bool(raw_connection.notifies)
+            raw_connection.notifies.clear()
+            return notified
+        except Exception as e:
+            logger.warning(f"Lost the {self.channel} listener, reconnecting on next wait: {e}")
+            self.close()
+            return True
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+        self._connection = None
@@ -0,0 +1,150 @@
+# smartreader/ingest_queue.py
+"""
+Bounded hand-off between the MQTT network loop and database writers.
+
+paho runs ``on_message`` on its network thread, so any slow database write
+there delays keepalives and QoS 1 acknowledgements for every reader on the
+connection. The subscriber instead puts raw messages on an IngestQueue and a
+pool of worker threads drains it in batches.
+
+When the queue is full one of the drop policies applies:
+
+* ``drop_oldest``: discard the oldest queued message to make room (default).
+* ``drop_newest``: discard the incoming message.
+* ``block``: wait up to ``block_timeout`` seconds for room, then discard the
+  incoming message. The network loop is never blocked indefinitely.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class IngestQueue:
+    """Bounded queue drained in batches by a pool of worker threads."""
+
+    def __init__(self, process_batch, maxsize=10000, workers=4, batch_size=200, batch_timeout=0.5,
+                 drop_policy=DROP_OLDEST, block_timeout=1.0, name='mqtt-ingest'):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{drop_policy}', expected one of {', '.join(DROP_POLICIES)}")
+        self.process_batch = process_batch
+        self.maxsize = maxsize
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._counters = {'enqueued': 0, 'dropped': 0, 'processed': 0, 'failed': 0, 'batches': 0}
+        self._high_watermark = 0
+
+    def put(self, item):
+        """Enqueue an item without stalling the caller. Returns False if an item was dropped."""
+        try:
+            if self.drop_policy == BLOCK:
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.drop_policy != DROP_OLDEST:
+                self._count('dropped')
+                return False
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            self._count('dropped')
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._count('dropped')
+                return False
+            self._count('enqueued')
+            self._high_watermark = self.maxsize
+            return False
+
+        self._count('enqueued')
+        depth = self._queue.qsize()
+        if depth > self._high_watermark:
+            self._high_watermark = depth
+        return True
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        """Stop accepting work and let the workers drain what is already queued."""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({
+            'depth': self._queue.qsize(),
+            'maxsize': self.maxsize,
+            'high_watermark': self._high_watermark,
+            'workers': len(self._threads),
+            'drop_policy': self.drop_policy,
+        })
+        return stats
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.batch_timeout)]
+        except queue.Empty:
+            return []
+
+        # Keep collecting until the batch is full or the batch window closes
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.process_batch(batch)
+                self._count('processed', len(batch))
+            except Exception as e:
+                self._count('failed', len(batch))
+                logger.error(f"Failed to process a batch of {len(batch)} messages: {e}", exc_info=True)
+                # Drop connections that went away while the database was unavailable
+                close_old_connections()
+            finally:
+                self._count('batches')
+                for _ in batch:
+                    self._queue.task_done()
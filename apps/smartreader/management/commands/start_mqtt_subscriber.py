@@ -1,11 +1,51 @@
 # smartreader/management/commands/start_mqtt_subscriber.py
 
-from django.core.management.base import BaseCommand
-from smartreader.mqtt_subscriber import start_mqtt_subscriber
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from apps.smartreader.ingest_queue import DROP_POLICIES
+from apps.smartreader.mqtt_subscriber import start_mqtt_subscriber
+from apps.smartreader.sharding import SubscriptionShard
+
+ENGINES = ('threaded', 'asyncio')
 
 class Command(BaseCommand):
     help = 'Start the MQTT Subscriber for SmartReader'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', choices=ENGINES, help='Subscriber engine, defaults to MQTT_SUBSCRIBER_ENGINE (threaded), asyncio is opt-in')
+        parser.add_argument('--workers', type=int, help='Number of DB writer threads (0 handles messages on the MQTT loop), decoder threads with --engine asyncio')
+        parser.add_argument('--queue-size', type=int, help='Maximum number of messages waiting for a writer thread')
+        parser.add_argument('--drop-policy', choices=DROP_POLICIES, help='What to do with messages when the queue is full (threaded engine)')
+        parser.add_argument('--reload-interval', type=int, help='Seconds between configuration polls, 0 disables hot reload')
+        parser.add_argument('--shard-index', type=int, help='Index of this subscriber among --shard-count subscribers, starting at 0')
+        parser.add_argument('--shard-count', type=int, help='Number of subscribers splitting the SmartReaders between them')
+        parser.add_argument('--shared-group', help='Subscribe through MQTT 5 shared subscriptions of this group ($share/<group>/...)')
+
     def handle(self, *args, **kwargs):
-        self.stdout.write(self.style.SUCCESS('Starting MQTT Subscriber...'))
-        start_mqtt_subscriber()
+        engine = kwargs['engine'] or settings.MQTT_SUBSCRIBER_ENGINE
+        try:
+            shard = SubscriptionShard(
+                shard_index=settings.MQTT_SUBSCRIBER_SHARD_INDEX if kwargs['shard_index'] is None else kwargs['shard_index'],
+                shard_count=kwargs['shard_count'] or settings.MQTT_SUBSCRIBER_SHARD_COUNT,
+                shared_group=kwargs['shared_group'] or settings.MQTT_SUBSCRIBER_SHARED_GROUP,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'Starting MQTT Subscriber ({engine} engine, {shard})...'))
+        if engine == 'asyncio':
+            from apps.smartreader.async_subscriber import start_async_subscriber
+            start_async_subscriber(
+                workers=kwargs['workers'],
+                queue_size=kwargs['queue_size'],
+                reload_interval=kwargs['reload_interval'],
+                shard=shard,
+            )
+            return
+        start_mqtt_subscriber(
+            workers=kwargs['workers'],
+            queue_size=kwargs['queue_size'],
+            drop_policy=kwargs['drop_policy'],
+            reload_interval=kwargs['reload_interval'],
+            shard=shard,
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartreader', '0003_remove_smartreader_mqtt_control_response_retain_messages_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heartbeatevent',
+            name='received_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
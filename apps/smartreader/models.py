@@ -1247,6 +1247,7 @@ class HeartbeatEvent(models.Model):
     reader_name = models.CharField(max_length=255)
     mac_address = models.CharField(max_length=255)
     tag_reads = models.JSONField()  # Assuming tag_reads is a JSON object
+    received_at = models.DateTimeField(default=timezone.now)  # Used by the retention policies
 
 class GPIEvent(models.Model):
     smartreader = models.ForeignKey(SmartReader, on_delete=models.CASCADE, related_name='gpi_events')
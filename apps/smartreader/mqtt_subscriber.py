@@ -3,75 +3,112 @@
 import paho.mqtt.client as mqtt
 import json
 import logging
+import time
 from django.conf import settings
+from django.db import close_old_connections
 from django.utils import timezone
-from apps.readers.models import Reader, TagEvent, SmartReader
+from apps.readers import identity_cache, ingest_pipeline
 from apps.smartreader.models import MQTTConfiguration, MQTTCommand, StatusEvent, ConnectionEvent, DisconnectionEvent, InventoryStatusEvent, HeartbeatEvent, GPIEvent
 from .utils import parse_status_event
 from .utils import execute_alerts_for_event
-from .utils import process_tag_event_data
+from .utils import resolve_smartreader_reader, save_tag_events
+from .config_watcher import ConfigurationWatcher, configuration_snapshot
+from .ingest_queue import IngestQueue
+from .sharding import SubscriptionShard
+from .topic_router import compile_router
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Set by start_mqtt_subscriber when messages are handed off to worker threads
+ingest_queue = None
+
 def on_message(client, userdata, msg):
-    try:
-        data = json.loads(msg.payload.decode('utf-8'))
-
-        # Extract the SmartReader serial number from the topic
-        topic_parts = msg.topic.split('/')
-        if len(topic_parts) >= 2 and topic_parts[0] == 'smartreader':
-            serial_number = topic_parts[1]
-
-            # Retrieve the corresponding SmartReader object
-            smartreader = SmartReader.objects.filter(reader_serial=serial_number).first()
-
-            if smartreader:
-                # Retrieve the MQTTConfiguration for the smartreader
-                config = MQTTConfiguration.objects.filter(smartreader=smartreader).first()
-
-                if not config:
-                    logger.warning(f"No MQTT configuration found for SmartReader with serial number {serial_number}.")
-                    return
-
-                # Extract the last part of each topic for comparison
-                tag_events_topic_end = config.tag_events_topic.split('/')[-1]
-                management_command_response_topic_end = config.management_command_response_topic.split('/')[-1]
-                control_command_response_topic_end = config.control_command_response_topic.split('/')[-1]
-                management_events_topic_end = config.management_events_topic.split('/')[-1]
-
-                # Extract the last part of the received message topic
-                msg_topic_end = topic_parts[-1]
-
-                # Pass the SmartReader object to the appropriate handler based on the configuration topics
-                if msg_topic_end == tag_events_topic_end:
-                    handle_tag_event(data, smartreader)
-                elif msg_topic_end == management_command_response_topic_end:
-                    handle_management_command_response(data, smartreader)
-                elif msg_topic_end == control_command_response_topic_end:
-                    handle_control_command_response(data, smartreader)
-                elif msg_topic_end == management_events_topic_end:
-                    handle_management_event(data, smartreader)
-                else:
-                    logger.warning(f"Unhandled topic: {msg.topic}")
+    # Keep paho's network loop free: only hand the raw message off to the worker pool
+    if ingest_queue is not None:
+        if not ingest_queue.put((userdata, msg.topic, msg.payload)):
+            logger.debug(f"Ingest queue full, dropped a message ({ingest_queue.drop_policy}) from topic {msg.topic}")
+        return
+    process_messages([(userdata, msg.topic, msg.payload)])
+
+def process_messages(messages):
+    """Route and handle a batch of raw MQTT messages, writing their tag events together."""
+    tag_events, handler_calls = prepare_messages(messages)
+    write_prepared(tag_events, handler_calls)
+
+def prepare_messages(messages):
+    """Decode and route raw messages. Tag events are built but not saved, other handlers are not called yet."""
+    tag_payloads = []
+    handler_calls = []
+    for router, topic, payload in messages:
+        try:
+            resolved = resolve_message(router, topic, payload)
+            if resolved is None:
+                continue
+            route, data, smartreader = resolved
+            if route.name == 'tag_events':
+                if has_reader(smartreader):
+                    tag_payloads.append((smartreader, data))
             else:
-                logger.warning(f"SmartReader with serial number {serial_number} not found.")
+                handler_calls.append((route.handler, data, smartreader, topic))
+        except Exception as e:
+            logger.error(f"Failed to process message from topic {topic}: {e}", exc_info=True)
+
+    # Tag reads of every message in the batch go through the ingest pipeline together
+    try:
+        tag_events = list(ingest_pipeline.normalize(tag_payloads, resolve_smartreader_reader))
     except Exception as e:
-        logger.error(f"Failed to process message from topic {msg.topic}: {e}", exc_info=True)
+        logger.error(f"Failed to normalize tag events of {len(tag_payloads)} messages: {e}", exc_info=True)
+        tag_events = []
+    return tag_events, handler_calls
 
-def handle_tag_event(data, smartreader):
-    serial_number = data.get('serial_number')
-    epc = data.get('epc')
-    timestamp = timezone.now()
-    antenna_port = data.get('antenna_port')
+def write_prepared(tag_events, handler_calls):
+    for handler, data, smartreader, topic in handler_calls:
+        try:
+            handler(data, smartreader)
+        except Exception as e:
+            logger.error(f"Failed to process message from topic {topic}: {e}", exc_info=True)
 
-    # Get the corresponding reader
-    reader = Reader.objects.filter(serial_number=serial_number).first()
-    if reader:
-        # Create and save a TagEvent instance
-        process_tag_event_data(data, smartreader)
+    # One bulk INSERT for every tag event in the batch
+    save_tag_events(tag_events)
+
+def resolve_message(router, topic, payload):
+    # Resolve the handler from the router compiled for this client's configuration
+    route, wildcard_segments = router.match(topic)
+    if route is None:
+        logger.warning(f"Unhandled topic: {topic}")
+        return None
+
+    # The SmartReader serial number is the segment captured by the 'smartreader/+/...' filter
+    if wildcard_segments:
+        serial_number = wildcard_segments[0]
     else:
-        logger.warning(f"Reader with serial number {serial_number} not found.")
+        topic_parts = topic.split('/')
+        serial_number = topic_parts[1] if len(topic_parts) >= 2 else None
+
+    # Resolve the SmartReader, its Reader and MQTTConfiguration from the identity cache
+    identity = identity_cache.get_smartreader_identity(serial_number)
+    if not identity:
+        logger.warning(f"SmartReader with serial number {serial_number} not found.")
+        return None
+    if not identity.config:
+        logger.warning(f"No MQTT configuration found for SmartReader with serial number {serial_number}.")
+        return None
+
+    data = json.loads(payload.decode('utf-8'))
+    return route, data, identity.smartreader
+
+def has_reader(smartreader):
+    # Get the corresponding reader
+    if not identity_cache.get_reader_by_serial(smartreader.reader_serial):
+        logger.warning(f"Reader with serial number {smartreader.reader_serial} not found.")
+        return False
+    return True
+
+def handle_tag_event(data, smartreader):
+    # Create and save the TagEvent instances
+    if has_reader(smartreader):
+        save_tag_events(ingest_pipeline.normalize([(smartreader, data)], resolve_smartreader_reader))
 
 def handle_management_command_response(data, smartreader):
     # Example: Handle the response to a management command
@@ -173,25 +210,215 @@ def handle_gpi_event(data, smartreader):
     )
     execute_alerts_for_event(received_event)
 
-def start_mqtt_subscriber():
-    configurations = MQTTConfiguration.objects.all()
+TOPIC_HANDLERS = {
+    'tag_events': handle_tag_event,
+    'management_command_response': handle_management_command_response,
+    'control_command_response': handle_control_command_response,
+    'management_events': handle_management_event,
+}
+
+def build_topic_router(config, router=None, shard=None):
+    """Compile the topic routing table for an MQTTConfiguration, limited to the readers of a shard."""
+    if shard is None:
+        return compile_router(config, TOPIC_HANDLERS, router=router)
+    return compile_router(config, TOPIC_HANDLERS, router=router, serials=shard.serials, include_unkeyed=shard.owns_unkeyed_topics)
+
+def broker_key(config):
+    """Configurations sharing this key are served by a single broker connection."""
+    return (
+        config.broker_hostname,
+        config.broker_port,
+        config.broker_username or '',
+        config.broker_password or '',
+        config.mqtt_broker_protocol or 'tcp',
+    )
+
+def group_configurations(configurations):
+    groups = {}
     for config in configurations:
-        client = mqtt.Client()
+        groups.setdefault(broker_key(config), []).append(config)
+    return groups
+
+class BrokerConnection:
+    """One MQTT client multiplexing the subscriptions of every configuration on a broker."""
+
+    def __init__(self, key, configurations, shard=None):
+        self.key = key
+        self.configurations = list(configurations)
+        self.shard = shard or SubscriptionShard()
+        self.router = self._compile_router()
+
+        hostname, port, username, password, protocol = key
+        transport = 'websockets' if protocol in ('ws', 'wss') else 'tcp'
+        # Shared subscriptions are an MQTT 5 feature
+        protocol_version = mqtt.MQTTv5 if self.shard.shared_group else mqtt.MQTTv311
+        self.client = mqtt.Client(userdata=self.router, transport=transport, protocol=protocol_version)
+        if protocol == 'wss':
+            self.client.tls_set()
+        if username:
+            self.client.username_pw_set(username, password or None)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = on_message
 
-        # Connect to the broker
-        client.connect(config.broker_hostname, config.broker_port, 60)
+    def _compile_router(self):
+        # A single routing table for all configurations, each route remembers its configuration
+        router = None
+        for config in self.configurations:
+            router = build_topic_router(config, router=router, shard=self.shard)
+        return router
 
-        # Set the on_message callback
-        client.on_message = on_message
+    def subscriptions(self):
+        # Messages arrive on the plain topic, only the subscription carries the $share prefix
+        return [(self.shard.subscription_filter(topic_filter), qos) for topic_filter, qos in self.router.subscriptions()]
 
-        # Subscribe to the relevant topics
-        client.subscribe(config.tag_events_topic, qos=config.tag_events_qos)
-        client.subscribe(config.management_command_response_topic, qos=config.management_command_qos)
-        client.subscribe(config.control_command_response_topic, qos=config.control_command_qos)
-        client.subscribe(config.management_events_topic, qos=config.management_command_qos)
+    def update(self, configurations):
+        """Swap in new configurations or shard readers, only subscribing and unsubscribing the topics that changed."""
+        previous = dict(self.subscriptions())
+        self.configurations = list(configurations)
+        self.router = self._compile_router()
+        self.client.user_data_set(self.router)
+
+        current = dict(self.subscriptions())
+        removed = [topic_filter for topic_filter in previous if topic_filter not in current]
+        added = [(topic_filter, qos) for topic_filter, qos in current.items() if previous.get(topic_filter) != qos]
+        if removed:
+            self.client.unsubscribe(removed)
+        if added:
+            self.client.subscribe(added)
+        if removed or added:
+            logger.info(f"MQTT broker {self.key[0]}:{self.key[1]}: subscribed {[t for t, q in added]}, unsubscribed {removed}")
+
+    @property
+    def keepalive(self):
+        return min(config.mqtt_broker_keepalive or 60 for config in self.configurations)
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            logger.error(f"Connection to MQTT broker {self.key[0]}:{self.key[1]} refused (rc={rc})")
+            return
+        # Subscribing on every (re)connect keeps subscriptions across clean sessions
+        subscriptions = self.subscriptions()
+        if subscriptions:
+            client.subscribe(subscriptions)
+        logger.info(f"Connected to MQTT broker {self.key[0]}:{self.key[1]} ({self.shard}) for {len(self.configurations)} configuration(s), {len(subscriptions)} subscription(s)")
+
+    def start(self):
+        hostname, port = self.key[0], self.key[1]
+        self.client.connect_async(hostname, port, self.keepalive)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+def load_configurations():
+    return list(MQTTConfiguration.objects.order_by('pk'))
+
+class SubscriberSupervisor:
+    """Keeps one BrokerConnection per broker in line with the MQTTConfiguration table and the shard's readers."""
+
+    def __init__(self, connection_class=None, shard=None):
+        self.connection_class = connection_class or BrokerConnection
+        self.shard = shard or SubscriptionShard()
+        self.connections = {}
+        self.snapshot = None
+
+    def load(self):
+        """Read the configurations and the serials owned by the shard, both from the database."""
+        return load_configurations(), self.shard.load_serials()
+
+    def reload(self, state=None):
+        configurations, serials = state if state is not None else self.load()
+        snapshot = (configuration_snapshot(configurations), serials)
+        if snapshot == self.snapshot:
+            return False
+        self.snapshot = snapshot
+        self.shard.serials = serials
+        self.apply(configurations)
+        return True
+
+    def apply(self, configurations):
+        groups = group_configurations(configurations)
+
+        # Close connections to brokers that no configuration points at anymore
+        for key in [key for key in self.connections if key not in groups]:
+            logger.info(f"Closing MQTT connection to {key[0]}:{key[1]}")
+            self.connections.pop(key).stop()
+
+        # Open new broker connections and diff the subscriptions of existing ones
+        for key, group in groups.items():
+            connection = self.connections.get(key)
+            if connection is None:
+                connection = self.connection_class(key, group, shard=self.shard)
+                connection.start()
+                self.connections[key] = connection
+            else:
+                connection.update(group)
+
+        # Cached identities may reference the configurations that changed
+        identity_cache.invalidate()
+
+    def stop(self):
+        for connection in self.connections.values():
+            connection.stop()
+        self.connections = {}
+
+def start_mqtt_subscriber(workers=None, queue_size=None, drop_policy=None, reload_interval=None, shard=None):
+    global ingest_queue
+
+    workers = settings.MQTT_INGEST_WORKERS if workers is None else workers
+    if workers > 0:
+        # Database writes happen on worker threads, never on paho's network loop
+        ingest_queue = IngestQueue(
+            process_messages,
+            maxsize=queue_size or settings.MQTT_INGEST_QUEUE_SIZE,
+            workers=workers,
+            batch_size=settings.MQTT_INGEST_BATCH_SIZE,
+            batch_timeout=settings.MQTT_INGEST_BATCH_TIMEOUT,
+            drop_policy=drop_policy or settings.MQTT_INGEST_DROP_POLICY,
+        )
+        ingest_queue.start()
+
+    # One connection per broker endpoint and credentials, not per configuration
+    supervisor = SubscriberSupervisor(shard=shard)
+    supervisor.reload()
+
+    reload_interval = settings.MQTT_SUBSCRIBER_RELOAD_INTERVAL if reload_interval is None else reload_interval
+    watcher = ConfigurationWatcher() if reload_interval > 0 else None
+    wait_interval = min(reload_interval, settings.MQTT_INGEST_STATS_INTERVAL) if watcher else settings.MQTT_INGEST_STATS_INTERVAL
+    next_stats = time.monotonic() + settings.MQTT_INGEST_STATS_INTERVAL
+    last_processed, last_stats = 0, time.monotonic()
+
+    try:
+        # paho's loop threads are daemons, keep the process alive, apply configuration
+        # changes as they are notified (or polled) and report queue metrics
+        while True:
+            if watcher is None:
+                time.sleep(wait_interval)
+            else:
+                notified = watcher.wait(wait_interval)
+                try:
+                    if supervisor.reload():
+                        logger.info(f"Applied MQTT configuration changes ({'notified' if notified else 'polled'})")
+                except Exception as e:
+                    logger.error(f"Failed to apply MQTT configuration changes: {e}", exc_info=True)
+                    close_old_connections()
 
-        # Start the MQTT loop
-        client.loop_start()
+            if ingest_queue is not None and time.monotonic() >= next_stats:
+                now = time.monotonic()
+                next_stats = now + settings.MQTT_INGEST_STATS_INTERVAL
+                stats = ingest_queue.stats()
+                stats['messages_per_second'] = round((stats['processed'] - last_processed) / (now - last_stats), 1)
+                last_processed, last_stats = stats['processed'], now
+                logger.info(f"MQTT ingest queue stats: {stats}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.close()
+        supervisor.stop()
+        if ingest_queue is not None:
+            ingest_queue.stop()
 
 if __name__ == "__main__":
     start_mqtt_subscriber()
@@ -0,0 +1,91 @@
+# smartreader/sharding.py
+"""
+Partitioning of SmartReaders across MQTT subscriber processes.
+
+Without sharding every ``start_mqtt_subscriber`` process subscribes to every
+configuration, so running two of them stores every message twice. With
+``--shard-count N`` each process owns the SmartReaders whose ``reader_serial``
+hashes to its ``--shard-index`` on a consistent hash ring, and subscribes to
+their topics only (``smartreader/<serial>/...``). Growing or shrinking the
+number of shards only moves about ``1/N`` of the readers.
+
+Alternatively, or on top of that, ``--shared-group`` turns every subscription
+into an MQTT 5 shared subscription (``$share/<group>/<filter>``) and lets the
+broker balance messages between the processes of the group. Messages of one
+reader may then be handled by different processes, so per-reader ordering is
+not guaranteed across the group.
+"""
+import bisect
+import hashlib
+
+DEFAULT_RING_REPLICAS = 64
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ShardRing:
+    """Consistent hash ring mapping a key to one of ``shard_count`` shards."""
+
+    def __init__(self, shard_count, replicas=DEFAULT_RING_REPLICAS):
+        if shard_count < 1:
+            raise ValueError(f"shard_count must be at least 1, got {shard_count}")
+        self.shard_count = shard_count
+        # Several points per shard keep the share of each shard close to 1/N
+        points = sorted((_hash(f'shard-{shard}-{replica}'), shard) for shard in range(shard_count) for replica in range(replicas))
+        self._points = [point for point, shard in points]
+        self._shards = [shard for point, shard in points]
+
+    def shard_for(self, key):
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[index]
+
+
+class SubscriptionShard:
+    """The SmartReaders and topic filters one subscriber process is responsible for."""
+
+    def __init__(self, shard_index=0, shard_count=1, shared_group=None):
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"shard_index must be between 0 and {shard_count - 1}, got {shard_index}")
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.shared_group = shared_group or None
+        self.ring = ShardRing(shard_count) if shard_count > 1 else None
+        # Serials owned by this shard, None subscribes with a wildcard for every reader
+        self.serials = None
+
+    @property
+    def sharded(self):
+        return self.ring is not None
+
+    def owns(self, reader_serial):
+        return self.ring is None or self.ring.shard_for(reader_serial) == self.shard_index
+
+    @property
+    def owns_unkeyed_topics(self):
+        """Topics without a reader serial cannot be partitioned, the first shard subscribes to them."""
+        return self.shard_index == 0
+
+    def load_serials(self):
+        """Serials of the SmartReaders owned by this shard, or None when not sharded."""
+        if not self.sharded:
+            return None
+        from .models import SmartReader
+        serials = SmartReader.objects.values_list('reader_serial', flat=True)
+        # A serial containing MQTT separators or wildcards cannot be subscribed to on its own
+        return sorted(
+            serial for serial in set(serials)
+            if serial and not any(char in serial for char in '/+#') and self.owns(serial)
+        )
+
+    def subscription_filter(self, topic_filter):
+        if self.shared_group:
+            return f'$share/{self.shared_group}/{topic_filter}'
+        return topic_filter
+
+    def __str__(self):
+        description = f'shard {self.shard_index + 1}/{self.shard_count}'
+        if self.shared_group:
+            description += f', shared group {self.shared_group}'
+        return description
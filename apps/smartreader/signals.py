@@ -0,0 +1,27 @@
+# smartreader/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.readers import identity_cache
+from .config_watcher import notify_configuration_change
+from .models import MQTTConfiguration, SmartReader
+
+
+@receiver([post_save, post_delete], sender=SmartReader)
+@receiver([post_save, post_delete], sender=MQTTConfiguration)
+def invalidate_smartreader_identity_cache(sender, instance, **kwargs):
+    identity_cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=MQTTConfiguration)
+def notify_mqtt_subscribers(sender, instance, **kwargs):
+    # Running subscribers apply the change without a restart
+    notify_configuration_change()
+
+
+@receiver(post_save, sender=SmartReader)
+@receiver(post_delete, sender=SmartReader)
+def notify_sharded_mqtt_subscribers(sender, instance, created=True, **kwargs):
+    # Sharded subscribers subscribe per reader serial; plain updates are picked up by the poll
+    if created:
+        notify_configuration_change()
@@ -1,3 +1,172 @@
-from django.test import TestCase
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from . import mqtt_subscriber
+from .async_subscriber import AsyncSubscriber
+from .ingest_queue import DROP_NEWEST, DROP_OLDEST, IngestQueue
+from .sharding import ShardRing, SubscriptionShard
+from .topic_router import TopicRouter, compile_router, smartreader_topic_filter
+
+
+class TopicRouterTest(SimpleTestCase):
+
+    def test_exact_and_wildcard_matches(self):
+        router = TopicRouter()
+        router.add('smartreader/+/tagEvents', 'tag_events')
+        router.add('smartreader/+/managementEvents', 'management_events')
+        router.add('smartreader/special/tagEvents', 'special')
+        router.add('metrics/#', 'metrics')
+
+        self.assertEqual(router.match('smartreader/370-17-09-0014/tagEvents'), ('tag_events', ('370-17-09-0014',)))
+        self.assertEqual(router.match('smartreader/special/tagEvents'), ('special', ()))
+        self.assertEqual(router.match('metrics/a/b'), ('metrics', ('a/b',)))
+        self.assertEqual(router.match('metrics'), ('metrics', ()))
+        self.assertEqual(router.match('smartreader/370-17-09-0014/unknown'), (None, ()))
+
+    def test_configuration_topics_are_compiled_with_serial_wildcard(self):
+        self.assertEqual(smartreader_topic_filter('smartreader/tagEvents'), 'smartreader/+/tagEvents')
+        self.assertEqual(smartreader_topic_filter('smartreader/+/tagEvents'), 'smartreader/+/tagEvents')
+
+        config = SimpleNamespace(
+            mqtt_tag_events_topic='smartreader/tagEvents',
+            mqtt_tag_events_qos_level=1,
+            mqtt_management_command_response_topic=None,
+            mqtt_management_command_response_qos_level=0,
+            mqtt_control_command_response_topic='smartreader/controlResponse',
+            mqtt_control_command_response_qos_level=0,
+            mqtt_management_events_topic='smartreader/managementEvents',
+            mqtt_management_events_qos_level=0,
+        )
+        handler = object()
+        router = compile_router(config, {'tag_events': handler, 'management_events': handler})
+
+        self.assertEqual(router.subscriptions(), [('smartreader/+/tagEvents', 1), ('smartreader/+/managementEvents', 0)])
+        route, segments = router.match('smartreader/ABC/tagEvents')
+        self.assertEqual((route.name, route.handler, route.config, segments), ('tag_events', handler, config, ('ABC',)))
+
+        # An empty router passed in is filled, not replaced
+        empty = TopicRouter()
+        self.assertIs(compile_router(config, {'tag_events': handler}, router=empty), empty)
+        self.assertEqual(len(empty), 1)
+
+
+class IngestQueueTest(SimpleTestCase):
+
+    def test_drop_policies_when_full(self):
+        newest = IngestQueue(lambda batch: None, maxsize=2, workers=0, drop_policy=DROP_NEWEST)
+        oldest = IngestQueue(lambda batch: None, maxsize=2, workers=0, drop_policy=DROP_OLDEST)
+        for item in (1, 2, 3):
+            newest.put(item)
+            oldest.put(item)
+
+        self.assertEqual(list(newest._queue.queue), [1, 2])
+        self.assertEqual(list(oldest._queue.queue), [2, 3])
+        self.assertEqual(newest.stats()['dropped'], 1)
+        self.assertEqual(oldest.stats()['depth'], 2)
+
+    def test_workers_drain_in_batches(self):
+        batches = []
+        ingest_queue = IngestQueue(batches.append, maxsize=100, workers=1, batch_size=10, batch_timeout=0.05)
+        for item in range(25):
+            ingest_queue.put(item)
+        ingest_queue.start()
+        ingest_queue.stop(timeout=5)
+
+        self.assertEqual(sorted(item for batch in batches for item in batch), list(range(25)))
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        self.assertEqual(ingest_queue.stats()['processed'], 25)
+
+
+class BrokerConnectionTest(SimpleTestCase):
+
+    def _config(self, hostname, tag_events_topic, username=None):
+        return SimpleNamespace(
+            broker_hostname=hostname,
+            broker_port=1883,
+            broker_username=username,
+            broker_password=None,
+            mqtt_broker_protocol='tcp',
+            mqtt_broker_keepalive=60,
+            mqtt_tag_events_topic=tag_events_topic,
+            mqtt_tag_events_qos_level=1,
+            mqtt_management_command_response_topic=None,
+            mqtt_management_command_response_qos_level=0,
+            mqtt_control_command_response_topic=None,
+            mqtt_control_command_response_qos_level=0,
+            mqtt_management_events_topic=None,
+            mqtt_management_events_qos_level=0,
+        )
+
+    def test_configurations_on_one_broker_share_a_connection(self):
+        dock = self._config('mosquitto', 'smartreader/dock/tagEvents')
+        yard = self._config('mosquitto', 'smartreader/yard/tagEvents')
+        other = self._config('mosquitto', 'smartreader/tagEvents', username='ops')
+        groups = mqtt_subscriber.group_configurations([dock, yard, other])
+
+        self.assertEqual(sorted(len(configs) for configs in groups.values()), [1, 2])
+
+        connection = mqtt_subscriber.BrokerConnection(mqtt_subscriber.broker_key(dock), [dock, yard])
+        self.assertEqual(len(connection.router), 2)
+        self.assertIs(connection.router.match('smartreader/SN1/yard/tagEvents')[0].config, yard)
+        self.assertIs(connection.router.match('smartreader/SN1/dock/tagEvents')[0].config, dock)
+
+    def test_update_only_changes_the_subscriptions_that_differ(self):
+        dock = self._config('mosquitto', 'smartreader/dock/tagEvents')
+        yard = self._config('mosquitto', 'smartreader/yard/tagEvents')
+        connection = mqtt_subscriber.BrokerConnection(mqtt_subscriber.broker_key(dock), [dock])
+        connection.client = mock.Mock()
+
+        connection.update([yard])
+
+        connection.client.unsubscribe.assert_called_once_with(['smartreader/+/dock/tagEvents'])
+        connection.client.subscribe.assert_called_once_with([('smartreader/+/yard/tagEvents', 1)])
+        connection.client.user_data_set.assert_called_once_with(connection.router)
+
+    def test_sharded_connection_subscribes_per_serial(self):
+        dock = self._config('mosquitto', 'smartreader/dock/tagEvents')
+        shard = SubscriptionShard(shard_index=1, shard_count=2, shared_group='ingest')
+        shard.serials = ['SN1', 'SN2']
+        connection = mqtt_subscriber.BrokerConnection(mqtt_subscriber.broker_key(dock), [dock], shard=shard)
+
+        self.assertEqual(connection.subscriptions(), [
+            ('$share/ingest/smartreader/SN1/dock/tagEvents', 1),
+            ('$share/ingest/smartreader/SN2/dock/tagEvents', 1),
+        ])
+        self.assertIsNone(connection.router.match('smartreader/SN3/dock/tagEvents')[0])
+        self.assertIs(connection.router.match('smartreader/SN2/dock/tagEvents')[0].config, dock)
+
+
+class ShardRingTest(SimpleTestCase):
+
+    def test_serials_are_spread_and_mostly_stay_when_shards_are_added(self):
+        serials = [f'SN{index:05d}' for index in range(2000)]
+        three = ShardRing(3)
+        four = ShardRing(4)
+
+        counts = [0, 0, 0]
+        for serial in serials:
+            counts[three.shard_for(serial)] += 1
+        self.assertTrue(all(count > 400 for count in counts))
+        self.assertEqual([three.shard_for(serial) for serial in serials], [ShardRing(3).shard_for(serial) for serial in serials])
+
+        moved = sum(1 for serial in serials if three.shard_for(serial) != four.shard_for(serial))
+        self.assertLess(moved, len(serials) / 2)
+
+
+class AsyncSubscriberTest(SimpleTestCase):
+
+    def test_submit_drops_oldest_and_batches(self):
+        async def scenario():
+            subscriber = AsyncSubscriber(queue_size=3, batch_size=2, batch_timeout=0.01, decode_workers=1, reload_interval=0)
+            subscriber.loop = asyncio.get_running_loop()
+            subscriber.inbox = asyncio.Queue(maxsize=3)
+            for item in range(5):
+                subscriber.submit(item)
+            return subscriber, [await subscriber._next_batch(), await subscriber._next_batch()]
+
+        subscriber, batches = asyncio.run(scenario())
+
+        self.assertEqual(batches, [[2, 3], [4]])
+        self.assertEqual((subscriber.counters['received'], subscriber.counters['dropped']), (5, 2))
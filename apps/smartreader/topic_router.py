@@ -0,0 +1,136 @@
+# smartreader/topic_router.py
+"""
+Precompiled MQTT topic routing.
+
+Topic filters are stored in a trie keyed on topic segments, so resolving a
+received topic to its handler costs O(segments) regardless of how many
+filters are registered. MQTT wildcards are supported: ``+`` matches exactly
+one segment and ``#`` matches the remaining segments (including none).
+"""
+from collections import namedtuple
+
+Route = namedtuple('Route', ['name', 'handler', 'config'])
+
+# Topic fields of MQTTConfiguration that a SmartReader publishes on, with the name of the route
+CONFIGURATION_TOPIC_FIELDS = (
+    ('tag_events', 'mqtt_tag_events_topic', 'mqtt_tag_events_qos_level'),
+    ('management_command_response', 'mqtt_management_command_response_topic', 'mqtt_management_command_response_qos_level'),
+    ('control_command_response', 'mqtt_control_command_response_topic', 'mqtt_control_command_response_qos_level'),
+    ('management_events', 'mqtt_management_events_topic', 'mqtt_management_events_qos_level'),
+)
+
+
+class _Node:
+    __slots__ = ('children', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.route = None
+
+
+class TopicRouter:
+    """Trie of MQTT topic filters mapping a received topic to a route."""
+
+    def __init__(self):
+        self._root = _Node()
+        self._filters = {}
+
+    def add(self, topic_filter, route, qos=0):
+        node = self._root
+        for segment in topic_filter.split('/'):
+            node = node.children.setdefault(segment, _Node())
+        if node.route is None:
+            node.route = route
+            self._filters[topic_filter] = qos
+        return node.route is route
+
+    def match(self, topic):
+        """Return ``(route, wildcard_segments)`` for a topic, or ``(None, ())`` if nothing matches."""
+        segments = topic.split('/')
+        return self._match(self._root, segments, 0, ())
+
+    def _match(self, node, segments, index, captured):
+        if index == len(segments):
+            if node.route is not None:
+                return node.route, captured
+            # '#' also matches the parent level, e.g. 'a/#' matches 'a'
+            multi = node.children.get('#')
+            if multi is not None and multi.route is not None:
+                return multi.route, captured
+            return None, ()
+
+        segment = segments[index]
+        children = node.children
+
+        # Exact segments take precedence over '+' which takes precedence over '#'
+        exact = children.get(segment)
+        if exact is not None:
+            route, values = self._match(exact, segments, index + 1, captured)
+            if route is not None:
+                return route, values
+
+        single = children.get('+')
+        if single is not None:
+            route, values = self._match(single, segments, index + 1, captured + (segment,))
+            if route is not None:
+                return route, values
+
+        multi = children.get('#')
+        if multi is not None and multi.route is not None:
+            return multi.route, captured + ('/'.join(segments[index:]),)
+
+        return None, ()
+
+    def subscriptions(self):
+        """Topic filters with their QoS, ready to pass to ``client.subscribe``."""
+        return list(self._filters.items())
+
+    def __len__(self):
+        return len(self._filters)
+
+
+def is_serial_keyed(topic):
+    """True if SmartReaders publish the topic with their serial inserted after ``smartreader/``."""
+    segments = topic.split('/')
+    return len(segments) >= 2 and segments[0] == 'smartreader' and segments[1] not in ('+', '#')
+
+
+def smartreader_topic_filter(topic, serial='+'):
+    """
+    Turn a configuration topic into the filter SmartReaders actually publish on.
+
+    ``SmartReader.populate_mqtt_from_configuration`` inserts the reader serial
+    after the ``smartreader/`` prefix, so ``smartreader/tagEvents`` becomes
+    ``smartreader/+/tagEvents`` with the serial captured by the wildcard, or
+    ``smartreader/<serial>/tagEvents`` for a single reader.
+    """
+    if not is_serial_keyed(topic):
+        return topic
+    segments = topic.split('/')
+    segments.insert(1, serial)
+    return '/'.join(segments)
+
+
+def compile_router(config, handlers, router=None, serials=None, include_unkeyed=True):
+    """
+    Register the topics of an MQTTConfiguration on a router.
+
+    ``handlers`` maps route names from CONFIGURATION_TOPIC_FIELDS to callables.
+    With ``serials`` each topic is registered once per reader serial instead of
+    with a wildcard, and topics without a serial only if ``include_unkeyed``.
+    """
+    router = router if router is not None else TopicRouter()
+    for name, topic_field, qos_field in CONFIGURATION_TOPIC_FIELDS:
+        topic = getattr(config, topic_field)
+        handler = handlers.get(name)
+        if not topic or handler is None:
+            continue
+        route = Route(name, handler, config)
+        qos = getattr(config, qos_field) or 0
+        if serials is None or not is_serial_keyed(topic):
+            if serials is None or include_unkeyed:
+                router.add(smartreader_topic_filter(topic), route, qos=qos)
+            continue
+        for serial in serials:
+            router.add(smartreader_topic_filter(topic, serial), route, qos=qos)
+    return router
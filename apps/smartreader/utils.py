@@ -1,10 +1,12 @@
 import json
 from django.utils.dateparse import parse_datetime
-from apps.readers.models import Reader, TagEvent
-from .models import Smartreader, StatusEvent, ConnectionEvent, DisconnectionEvent, InventoryStatusEvent, GPIEvent, AntennaStatus, HeartbeatEvent, Alert
-from datetime import datetime
+from apps.readers import identity_cache, ingest_pipeline
+from apps.readers.models import TagEvent
+from .models import SmartReader, StatusEvent, ConnectionEvent, DisconnectionEvent, InventoryStatusEvent, GPIEvent, AntennaStatus, HeartbeatEvent, Alert
 from django.utils import timezone
-import base64
+import logging
+
+logger = logging.getLogger(__name__)
 
 def get_event_model_fields():
     event_models = {
@@ -25,130 +27,30 @@ def get_event_model_fields():
     return event_fields
 
 def process_tag_event_data(event, smartreader):
-    if event.get('eventType') == 'tagInventory':
-        tag_inventory = event.get('tagInventoryEvent')
-        if tag_inventory:
-            # Determine the reader based on hostname if provided
-            reader = None
-            hostname = event.get('hostname')
-            if hostname:
-                try:
-                    reader = Reader.objects.get(serial_number=smartreader.reader_serial)
-                except Reader.DoesNotExist:
-                    # Create or use a default reader if not found
-                    reader, created = Reader.objects.get_or_create(serial_number='default-serial-number', defaults={'name': hostname})
-
-            # Handle EPC, checking for either Base64 or Hex format
-            epc_hex = None
-            epc_base64 = tag_inventory.get('epc')
-            if epc_base64:
-                epc_hex = base64.b64decode(epc_base64).hex().upper()
-            else:
-                epc_hex = tag_inventory.get('epcHex')
-
-            if epc_hex:
-                timestamp = event.get('timestamp')
-
-                # Parse optional fields
-                antenna_port = tag_inventory.get('antennaPort')
-                antenna_name = tag_inventory.get('antennaName')
-                peak_rssi_cdbm = tag_inventory.get('peakRssiCdbm')
-                frequency = tag_inventory.get('frequency')
-                transmit_power_cdbm = tag_inventory.get('transmitPowerCdbm')
-                last_seen_time_str = tag_inventory.get('lastSeenTime')
-                tid_base64 = tag_inventory.get('tid')
-                tid_hex = tag_inventory.get('tidHex')
+    return save_tag_events(build_tag_events(event, smartreader))
 
-                # Convert last seen time to datetime object if present
-                last_seen_time = None
-                if last_seen_time_str:
-                    try:
-                        last_seen_time = datetime.fromisoformat(last_seen_time_str.replace('Z', '+00:00'))
-                    except ValueError:
-                        last_seen_time = None
+def save_tag_events(tag_events):
+    """Write tag events with bulk INSERTs and hand traceability off in batches."""
+    return ingest_pipeline.sink(tag_events)
 
-                # Decode tid from base64 if provided
-                if tid_base64 and not tid_hex:
-                    tid_hex = base64.b64decode(tid_base64).hex().upper()
-
-                # Store the data in the database
-                tag_event = TagEvent.objects.create(
-                    reader=reader,
-                    epc=epc_hex,  # Store the hexadecimal EPC
-                    timestamp=timestamp,
-                    antenna_port=antenna_port if antenna_port is not None and antenna_port > 0 else None,
-                    antenna_name=antenna_name,
-                    peak_rssi_cdbm=peak_rssi_cdbm if peak_rssi_cdbm is not None and peak_rssi_cdbm < 0 else None,
-                    frequency=frequency if frequency is not None and frequency > 0 else None,
-                    transmit_power_cdbm=transmit_power_cdbm if transmit_power_cdbm is not None and transmit_power_cdbm > 0 else None,
-                    last_seen_time=last_seen_time,
-                    tid=tid_base64,
-                    tid_hex=tid_hex
-                )
-
-                try:
-                    from .tasks import process_tag_event
-                    process_tag_event.delay(tag_event.id)
-                except Exception as e:
-                    # Optionally log this exception
-                    pass
-    # Handle the second type of tag event
-    elif 'tag_reads' in event:
-        reader_name = event.get('readerName')
-        mac_address = event.get('mac')
-        tag_reads = event.get('tag_reads')
+def build_tag_events(event, smartreader):
+    """Build unsaved TagEvent instances from a SmartReader tag event payload."""
+    return list(ingest_pipeline.normalize([(smartreader, event)], resolve_smartreader_reader))
 
+def resolve_smartreader_reader(read_format, smartreader, event):
+    """Reader of tag reads received from a SmartReader, the pipeline source is the SmartReader."""
+    if read_format == ingest_pipeline.TAG_READS:
         # Find or create the reader by its name
-        reader = None
-        if reader_name:
-            try:
-                reader = Reader.objects.get(name=reader_name)
-            except Reader.DoesNotExist:
-                # Create or use a default reader if not found
-                reader, created = Reader.objects.get_or_create(serial_number='default-serial-number', defaults={'name': reader_name})
-
-        for tag_read in tag_reads:
-            epc = tag_read.get('epc')
-            first_seen_timestamp = tag_read.get('firstSeenTimestamp')
-            antenna_port = tag_read.get('antennaPort')
-            antenna_name = tag_read.get('antennaZone')
-            peak_rssi = tag_read.get('peakRssi')
-            tx_power = tag_read.get('txPower')
-            tid = tag_read.get('tid')
-            rf_phase = tag_read.get('rfPhase')
-            frequency = tag_read.get('frequency')
-            tag_data_key = tag_read.get('tagDataKey')
-            tag_data_key_name = tag_read.get('tagDataKeyName')
-            tag_data_serial = tag_read.get('tagDataSerial')
-
-            # Convert the timestamp to a datetime object
-            timestamp = None
-            if first_seen_timestamp:
-                timestamp = datetime.fromtimestamp(first_seen_timestamp / 1e6)
-
-            # Store the data in the database
-            tag_event = TagEvent.objects.create(
-                reader=reader,
-                epc=epc,
-                timestamp=timestamp,
-                antenna_port=antenna_port,
-                antenna_name=antenna_name,
-                peak_rssi_cdbm=peak_rssi,
-                transmit_power_cdbm=tx_power,
-                tid=tid,
-                rf_phase=rf_phase,
-                frequency=frequency,
-                tag_data_key=tag_data_key,
-                tag_data_key_name=tag_data_key_name,
-                tag_data_serial=tag_data_serial
-            )
-
-            try:
-                from .tasks import process_tag_event
-                process_tag_event.delay(tag_event.id)
-            except Exception as e:
-                # Optionally log this exception
-                pass
+        reader_name = event.get('readerName')
+        if not reader_name:
+            return None
+        return identity_cache.get_reader_by_name(reader_name) or identity_cache.get_default_reader(reader_name)
+
+    # Determine the reader based on hostname if provided
+    hostname = event.get('hostname')
+    if not hostname:
+        return None
+    return identity_cache.get_reader_by_serial(smartreader.reader_serial) or identity_cache.get_default_reader(hostname)
 
 def parse_status_event(json_data, smartreader):
     # Step 1: Parse general status event data
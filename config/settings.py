@@ -32,6 +32,88 @@ MQTT_USERNAME = os.environ.get("MQTT_USERNAME", "")
 MQTT_PASSWORD = os.environ.get("MQTT_PASSWORD", "")
 MQTT_USE_TLS = bool(int(os.environ.get("MQTT_USE_TLS", "0")))
 MQTT_TLS_CA_CERTS = os.environ.get("MQTT_TLS_CA_CERTS", "")
+# Subscriber hand-off from paho's network loop to DB writer threads (0 workers handles messages inline)
+MQTT_INGEST_WORKERS = int(os.environ.get("MQTT_INGEST_WORKERS", 4))
+MQTT_INGEST_QUEUE_SIZE = int(os.environ.get("MQTT_INGEST_QUEUE_SIZE", 10000))
+MQTT_INGEST_BATCH_SIZE = int(os.environ.get("MQTT_INGEST_BATCH_SIZE", 200))
+MQTT_INGEST_BATCH_TIMEOUT = float(os.environ.get("MQTT_INGEST_BATCH_TIMEOUT", 0.5))
+MQTT_INGEST_DROP_POLICY = os.environ.get("MQTT_INGEST_DROP_POLICY", "drop_oldest")  # drop_oldest, drop_newest or block
+MQTT_INGEST_STATS_INTERVAL = int(os.environ.get("MQTT_INGEST_STATS_INTERVAL", 60))
+# Seconds between MQTTConfiguration polls when no change notification arrives (0 disables hot reload)
+MQTT_SUBSCRIBER_RELOAD_INTERVAL = int(os.environ.get("MQTT_SUBSCRIBER_RELOAD_INTERVAL", 30))
+# "threaded" (paho network threads + writer pool) or "asyncio" (one event loop per process). asyncio is opt-in
+# until its throughput has been measured against the threaded engine with a real broker
+MQTT_SUBSCRIBER_ENGINE = os.environ.get("MQTT_SUBSCRIBER_ENGINE", "threaded")
+# Run MQTT_SUBSCRIBER_SHARD_COUNT subscribers, each owning the readers hashed to its index
+MQTT_SUBSCRIBER_SHARD_INDEX = int(os.environ.get("MQTT_SUBSCRIBER_SHARD_INDEX", 0))
+MQTT_SUBSCRIBER_SHARD_COUNT = int(os.environ.get("MQTT_SUBSCRIBER_SHARD_COUNT", 1))
+# MQTT 5 shared subscription group ($share/<group>/...), empty subscribes normally
+MQTT_SUBSCRIBER_SHARED_GROUP = os.environ.get("MQTT_SUBSCRIBER_SHARED_GROUP", "")
+# endregion
+
+# region: Ingest
+# Number of tag events written per bulk INSERT and handed off per traceability task
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 500))
+# Fraction of webhook requests logged with their headers and body (0 disables, 1 logs every request)
+WEBHOOK_DEBUG_SAMPLE_RATE = float(os.environ.get("WEBHOOK_DEBUG_SAMPLE_RATE", 0))
+# In-process reader identity cache used by the webhook and MQTT ingest paths
+READER_CACHE_TTL = int(os.environ.get("READER_CACHE_TTL", 300))
+READER_CACHE_MAX_ENTRIES = int(os.environ.get("READER_CACHE_MAX_ENTRIES", 1024))
+# Reads of one EPC on one reader antenna within this many seconds are stored as one event (0 disables)
+INGEST_DEDUP_WINDOW_SECONDS = int(os.environ.get("INGEST_DEDUP_WINDOW_SECONDS", 0))
+# Store only arrivals, a present tag then no longer refreshes its event or traceability last_seen
+INGEST_DEDUP_STATE_CHANGES_ONLY = os.environ.get("INGEST_DEDUP_STATE_CHANGES_ONLY", "False").lower() in ("true", "1")
+INGEST_DEDUP_MAX_KEYS = int(os.environ.get("INGEST_DEDUP_MAX_KEYS", 100000))
+# TagEvent range partitions on PostgreSQL (see apps/readers/partitions.py): "day" or "week" per partition,
+# partitions created ahead of time, and days after which partitions are dropped (0 keeps them forever)
+TAG_EVENT_PARTITION_INTERVAL = os.environ.get("TAG_EVENT_PARTITION_INTERVAL", "day")
+TAG_EVENT_PARTITION_PREMAKE = int(os.environ.get("TAG_EVENT_PARTITION_PREMAKE", 7))
+TAG_EVENT_PARTITION_RETENTION_DAYS = int(os.environ.get("TAG_EVENT_PARTITION_RETENTION_DAYS", 0))
+# Detach expired partitions instead of dropping them, e.g. to archive them first
+TAG_EVENT_PARTITION_DETACH_ONLY = os.environ.get("TAG_EVENT_PARTITION_DETACH_ONLY", "False").lower() in ("true", "1")
+# endregion
+
+# region: Traceability
+# Open TagTraceability rows closed per UPDATE by the departure sweep, and seconds between sweeps.
+# The presence ticker closes departures as they expire, the sweep only catches rows it missed
+TRACEABILITY_SWEEP_CHUNK_SIZE = int(os.environ.get("TRACEABILITY_SWEEP_CHUNK_SIZE", 1000))
+TRACEABILITY_SWEEP_INTERVAL = int(os.environ.get("TRACEABILITY_SWEEP_INTERVAL", 900))
+# Seconds between bulk writes of the last_seen values held by the presence tracker (see apps/readers/presence.py)
+PRESENCE_FLUSH_INTERVAL = int(os.environ.get("PRESENCE_FLUSH_INTERVAL", 10))
+# Seconds between turns of the presence timer wheel, i.e. how late a departure may be written
+PRESENCE_TICK_SECONDS = float(os.environ.get("PRESENCE_TICK_SECONDS", 1))
+# endregion
+
+# region: Reader API
+# Pooled client of the reader REST API (see apps/readers/reader_api.py): timeouts in seconds,
+# retries with exponential backoff, keep-alive connections per reader and TLS verification
+READER_API_CONNECT_TIMEOUT = float(os.environ.get("READER_API_CONNECT_TIMEOUT", 5))
+READER_API_READ_TIMEOUT = float(os.environ.get("READER_API_READ_TIMEOUT", 15))
+READER_API_RETRIES = int(os.environ.get("READER_API_RETRIES", 3))
+READER_API_BACKOFF = float(os.environ.get("READER_API_BACKOFF", 0.5))
+READER_API_POOL_SIZE = int(os.environ.get("READER_API_POOL_SIZE", 4))
+READER_API_VERIFY_TLS = os.environ.get("READER_API_VERIFY_TLS", "False").lower() in ("true", "1")
+# Readers called at the same time by fleet operations such as preset rollouts
+READER_API_CONCURRENCY = int(os.environ.get("READER_API_CONCURRENCY", 16))
+# Seconds between status polls of the whole fleet, and random delay of up to this many seconds per reader
+READER_STATUS_POLL_INTERVAL = int(os.environ.get("READER_STATUS_POLL_INTERVAL", 60))
+READER_STATUS_POLL_JITTER = float(os.environ.get("READER_STATUS_POLL_JITTER", 2))
+# endregion
+
+# region: Retention
+# Days to keep per model label (see apps/readers/retention.py), RetentionPolicy rows in the admin take precedence
+RETENTION_POLICIES = {
+    "readers.TagEvent": int(os.environ.get("RETENTION_TAG_EVENT_DAYS", 0)),
+    "smartreader.StatusEvent": int(os.environ.get("RETENTION_STATUS_EVENT_DAYS", 0)),
+    "smartreader.HeartbeatEvent": int(os.environ.get("RETENTION_HEARTBEAT_EVENT_DAYS", 0)),
+    "readers.TagReadRollup.minute": int(os.environ.get("RETENTION_MINUTE_ROLLUP_DAYS", 2)),
+    "readers.TagReadRollup.hour": int(os.environ.get("RETENTION_HOUR_ROLLUP_DAYS", 365)),
+    "readers.TagReadRollup.day": int(os.environ.get("RETENTION_DAY_ROLLUP_DAYS", 0)),
+}
+# Rows deleted per transaction, pause in seconds between batches and batches per model and run
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 5000))
+RETENTION_BATCH_PAUSE = float(os.environ.get("RETENTION_BATCH_PAUSE", 0.2))
+RETENTION_MAX_BATCHES = int(os.environ.get("RETENTION_MAX_BATCHES", 200))
 # endregion
 
 # region: DB
@@ -107,9 +189,27 @@ LOGGING = {
 
 # region CELERY
 CELERY_BEAT_SCHEDULE = {
-    "update-departure-time-every-minute": {
-        "task": "config.tasks.process_departure_time",
-        "schedule": crontab(minute="*"),  # Run every minute
+    "sweep-departures": {
+        "task": "process_departure_time",
+        "schedule": float(TRACEABILITY_SWEEP_INTERVAL),
+    },
+    "maintain-tag-event-partitions-daily": {
+        "task": "maintain_tag_event_partitions",
+        "schedule": crontab(hour=0, minute=15),
+    },
+    "flush-presence": {
+        "task": "flush_presence",
+        "schedule": float(PRESENCE_FLUSH_INTERVAL),
+    },
+    "poll-reader-status": {
+        "task": "poll_reader_status",
+        "schedule": float(READER_STATUS_POLL_INTERVAL),
+        # A poll still queued when the next one is due is dropped
+        "options": {"expires": READER_STATUS_POLL_INTERVAL},
+    },
+    "enforce-retention-hourly": {
+        "task": "enforce_retention",
+        "schedule": crontab(minute=30),
     },
 }
 
@@ -141,6 +241,11 @@ CELERY_TASK_DEFAULT_ROUTING_KEY = "default"
 
 # Routing configuration
 CELERY_TASK_ROUTES = {
+    # Presence state lives in one process, run a single worker with -Q traceability_queue --concurrency 1.
+    # The queue is left out of CELERY_TASK_QUEUES so the other workers do not consume it.
+    "process_tag_event": {"queue": "traceability_queue"},
+    "process_tag_event_batch": {"queue": "traceability_queue"},
+    "flush_presence": {"queue": "traceability_queue"},
     "config.tasks.process_webhook": {
         "queue": "webhook_queue",
         "routing_key": "webhook.process",